@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Correctness checks for the ingest triggers, run against the bench fakes.
+
+    uv run checks.py
+
+Builds S3 event notifications with dnd_core.events.fake_s3_event and feeds them
+through changed_keys and both ingest handlers: keys spread over several
+records and sources are deduplicated, FULL_SCAN rescans everything, URL
+encoded keys come out as the real key, and a burst of triggers that arrives
+while an ingest holds the lease is processed once by a single drain. For the
+Gemini ingest, failed uploads, deletes and listings never lose or duplicate a
+document in the File Search store and leave their keys queued, and enqueue
+gives up after a bounded number of throttled writes. Exits
+non-zero if any check fails; handlers whose dependencies are not installed
+are skipped like in run.py.
+"""
+
+import contextlib
+import os
+import sys
+import tempfile
+import traceback
+from pathlib import Path
+from types import SimpleNamespace
+
+import boto3
+
+import corpus
+import fakes
+import stubs
+from run import HANDLERS, LAMBDA_DIR, REQUIRES, load_module, missing_module, prepare_chroma_ingest
+from dnd_core import ingest_queue
+from dnd_core.events import FULL_SCAN, changed_keys, fake_s3_event
+from dnd_core.lease import Lease
+
+BUCKET = os.environ["S3_BUCKET"]
+PREFIX = corpus.NOTES_PREFIX
+# Quoted by fake_s3_event the way S3 quotes keys in notifications: spaces as +, the rest as %XX
+ODD_KEY = PREFIX + "sessions/Mira's notes (draft) + 50% more.md"
+
+
+def check_dedup_and_batching():
+    keys = [PREFIX + "a.md", PREFIX + "b.md", PREFIX + "a.md"]
+    event = fake_s3_event(BUCKET, keys)
+    assert len(event["Records"]) == 3
+    assert changed_keys(event) == {PREFIX + "a.md", PREFIX + "b.md"}
+
+    # Records, top level keys and body keys are one batch
+    event["keys"] = [PREFIX + "b.md", PREFIX + "c.md"]
+    event["body"] = {"keys": [PREFIX + "c.md", PREFIX + "d.md"]}
+    assert changed_keys(event) == {PREFIX + k for k in ("a.md", "b.md", "c.md", "d.md")}
+
+    # Only markdown under the prefix
+    event = fake_s3_event(BUCKET, [PREFIX + "audio.mp3", "other/e.md", PREFIX + "e.md"])
+    assert changed_keys(event) == {PREFIX + "e.md"}
+    assert changed_keys(fake_s3_event(BUCKET, [])) == set()
+    assert changed_keys({}) is None
+    assert changed_keys({"drain": True}) is None
+
+
+def check_full_scan_keys():
+    event = fake_s3_event(BUCKET, [PREFIX + "a.md"])
+    event["keys"] = [FULL_SCAN]
+    assert changed_keys(event) == {FULL_SCAN, PREFIX + "a.md"}
+    assert changed_keys({"body": '{"keys": ["*"]}'}) == {FULL_SCAN}
+
+
+def check_url_encoded_keys():
+    event = fake_s3_event(BUCKET, [ODD_KEY])
+    quoted = event["Records"][0]["s3"]["object"]["key"]
+    assert quoted != ODD_KEY and " " not in quoted and "+" in quoted and "%25" in quoted
+    assert changed_keys(event) == {ODD_KEY}
+
+
+class Ingest:
+    """
+    One ingest handler over a fresh world, with the names of the files each
+    call embedded or uploaded.
+    """
+
+    def __init__(self, name, tmp):
+        self.world = fakes.World()
+        boto3.client = self.world.client
+        for key, text in corpus.generate(12).items():
+            self.world.s3.put_object(Bucket=BUCKET, Key=key, Body=text)
+        self.world.s3.put_object(Bucket=BUCKET, Key=ODD_KEY, Body="# Draft\n\nMira bargains with the dragon.\n")
+        self.files = {key.removeprefix(PREFIX) for key in self.world.s3.objects}
+        self.processed = []
+        # Kept open, the lambdas' log handlers hold on to the stdout they were loaded with
+        self.devnull = open(os.devnull, "w")
+        with contextlib.redirect_stdout(self.devnull):
+            self.module = load_module(name, LAMBDA_DIR / HANDLERS[name] / "lambda_function.py")
+        if name == "dnd_rag_ingest":
+            prepare_chroma_ingest(self.module, self.world, stubs.StubEmbeddingFunction(64, 0), tmp)()
+            embed_file = self.module.embed_file
+
+            def recording_embed_file(file_path, file_name, file_id):
+                self.processed.append(file_name)
+                return embed_file(file_path, file_name, file_id)
+
+            self.module.embed_file = recording_embed_file
+        else:
+            gemini = stubs.StubGemini()
+            upload = gemini.file_search_stores.upload_to_file_search_store
+
+            def recording_upload(file, file_search_store_name, config):
+                self.processed.append(config["display_name"])
+                return upload(file=file, file_search_store_name=file_search_store_name, config=config)
+
+            gemini.file_search_stores.upload_to_file_search_store = recording_upload
+            self.module.genai = SimpleNamespace(Client=lambda **kwargs: gemini)
+            self.module.types = SimpleNamespace(CustomMetadata=SimpleNamespace)
+
+    def __call__(self, event):
+        result = self.run(event)
+        assert result["statusCode"] < 300, result
+        return result
+
+    def run(self, event):
+        self.processed = []
+        with contextlib.redirect_stdout(self.devnull):
+            return self.module.lambda_handler(event, None)
+
+    def queued(self):
+        consumer = f"ingest_queue#{self.module.FUNCTION_NAME}"
+        return {key for partition, key in self.world.dynamo.items if partition == consumer}
+
+
+def check_ingest(ingest):
+    # An empty index or store starts from every file
+    ingest({})
+    assert set(ingest.processed) == ingest.files, ingest.processed
+
+    # Batched and duplicated keys: one record per key, each changed file once
+    keys = [PREFIX + "sessions/2024-01-06-notes.md", ODD_KEY, PREFIX + "sessions/2024-01-06-notes.md"]
+    for key in keys:
+        ingest.world.s3.put_object(Bucket=BUCKET, Key=key, Body=f"# Edited\n\n{key} was rewritten.\n")
+    ingest(fake_s3_event(BUCKET, keys))
+    assert sorted(ingest.processed) == sorted({key.removeprefix(PREFIX) for key in keys}), ingest.processed
+
+    # Unchanged files are not processed again, FULL_SCAN looks at every one
+    ingest({"keys": [PREFIX + "sessions/2024-01-13-notes.md"]})
+    assert ingest.processed == []
+    ingest.world.s3.put_object(Bucket=BUCKET, Key=PREFIX + "sessions/2024-01-20-notes.md", Body="# Changed\n")
+    ingest({"keys": [FULL_SCAN]})
+    assert ingest.processed == ["sessions/2024-01-20-notes.md"], ingest.processed
+
+    # A burst while another run holds the lease is queued once per key and drained together
+    holder = Lease(ingest.world.dynamo, ingest.module.TABLE_NAME, ingest.module.FUNCTION_NAME)
+    assert holder.acquire()
+    burst = [PREFIX + "sessions/2024-01-27-notes.md", ODD_KEY, PREFIX + "sessions/2024-01-27-notes.md"]
+    try:
+        for key in burst:
+            ingest.world.s3.put_object(Bucket=BUCKET, Key=key, Body=f"# Burst\n\n{key} again.\n")
+            assert ingest(fake_s3_event(BUCKET, [key]))["statusCode"] == 201
+            assert ingest.processed == []
+    finally:
+        holder.release()
+    assert ingest.queued() == set(burst)
+    ingest({"drain": True})
+    assert sorted(ingest.processed) == sorted({key.removeprefix(PREFIX) for key in burst}), ingest.processed
+    assert ingest.queued() == set()
+
+
+@contextlib.contextmanager
+def failing(namespace, name):
+    """
+    Makes ``namespace.name`` raise until the block ends.
+    """
+    original = getattr(namespace, name)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError(f"{name} failed")
+
+    setattr(namespace, name, fail)
+    try:
+        yield
+    finally:
+        setattr(namespace, name, original)
+
+
+def check_gemini_failures(ingest):
+    stores = ingest.module.genai.Client().file_search_stores
+    key = PREFIX + "sessions/2024-01-06-notes.md"
+    name = key.removeprefix(PREFIX)
+
+    def documents():
+        return [d for d in stores.documents.documents.values() if d.display_name == name]
+
+    ingest({})
+    [original] = documents()
+
+    # A failed upload keeps the old version in the store and the key in the queue
+    ingest.world.s3.put_object(Bucket=BUCKET, Key=key, Body="# Edited\n\nThe upload of this fails.\n")
+    with failing(ingest.module, "upload_document"):
+        assert ingest.run(fake_s3_event(BUCKET, [key]))["statusCode"] == 500
+    assert documents() == [original], documents()
+    assert ingest.queued() == {key}
+
+    # So does one found by a full scan, only the failed key stays queued
+    with failing(ingest.module, "upload_document"):
+        assert ingest.run({"keys": [FULL_SCAN]})["statusCode"] == 500
+    assert ingest.queued() == {key}
+
+    # A failed delete leaves both versions, the next drain deletes the stale one
+    with failing(stores.documents, "delete"):
+        assert ingest.run({"drain": True})["statusCode"] == 500
+    assert len(documents()) == 2 and original in documents(), documents()
+    assert ingest.queued() == {key}
+    ingest({"drain": True})
+    assert ingest.processed == [] and ingest.queued() == set()
+    [current] = documents()
+    assert current is not original
+
+    # Without the store's listing every key would look new and be uploaded twice
+    ingest.world.s3.put_object(Bucket=BUCKET, Key=key, Body="# Edited\n\nListing fails.\n")
+    with failing(stores.documents, "list"):
+        assert ingest.run(fake_s3_event(BUCKET, [key]))["statusCode"] == 500
+    assert ingest.processed == [] and documents() == [current]
+    assert ingest.queued() == {key}
+
+
+def check_enqueue_backoff():
+    world = fakes.World()
+    write = world.dynamo.batch_write_item
+    calls = []
+
+    def throttled(RequestItems, **kwargs):
+        # Leaves the last request of every batch unprocessed
+        calls.append(RequestItems)
+        [(table, requests)] = RequestItems.items()
+        write(RequestItems={table: requests[:-1]})
+        return {"UnprocessedItems": {table: requests[-1:]}}
+
+    world.dynamo.batch_write_item = throttled
+    try:
+        ingest_queue.enqueue(world.dynamo, "table", "consumer", [PREFIX + "a.md", PREFIX + "b.md"])
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("enqueue kept going under throttling")
+    assert len(calls) == ingest_queue.BATCH_WRITE_ATTEMPTS, len(calls)
+
+
+def main():
+    checks = [check_dedup_and_batching, check_full_scan_keys, check_url_encoded_keys, check_enqueue_backoff]
+    failures = 0
+    for check in checks:
+        failures += run_check(check.__name__, check)
+    for name in ("dnd_rag_ingest", "dnd-rag-ingest-gemini"):
+        missing = missing_module(tuple(m for m in REQUIRES[name] if m != "google.genai"))
+        if missing:
+            print(f"Skipping {name}: No module named '{missing}'")
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            failures += run_check(f"check_ingest[{name}]", lambda: check_ingest(Ingest(name, Path(tmp))))
+            if name == "dnd-rag-ingest-gemini":
+                failures += run_check("check_gemini_failures", lambda: check_gemini_failures(Ingest(name, Path(tmp))))
+    sys.exit(1 if failures else 0)
+
+
+def run_check(name, check):
+    try:
+        check()
+    except Exception:
+        print(f"FAIL {name}")
+        traceback.print_exc()
+        return 1
+    print(f"ok   {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    main()
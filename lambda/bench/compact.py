@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Recall, size and latency of the compact vector index modes on the synthetic
+corpus: full or shortened dimensions, float32, int8 alone, and int8 with
+float32 re-scoring.
+
+    uv run compact.py --files 300 --dimensions 1536,512,256 --queries 200
+
+The stub embeddings sum a fixed random vector per word, with the energy
+falling off along the dimensions the way a model trained for shortened
+embeddings concentrates it up front, so overlapping texts land close together
+and a truncated vector still ranks sensibly. Recall@k is measured against an
+exact float32 search over the full dimensions.
+"""
+import argparse
+import contextlib
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "dnd_core"))
+sys.path.insert(0, str(BENCH_DIR))
+
+import corpus  # noqa: E402
+import stubs  # noqa: E402
+from dnd_core import vector_index  # noqa: E402
+
+FULL_DIMENSIONS = 1536
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 75
+
+
+class WordEmbeddings:
+    def __init__(self, dimensions=FULL_DIMENSIONS, seed=0):
+        self.dimensions = dimensions
+        self.rng = np.random.default_rng(seed)
+        self.weights = (1.0 / np.sqrt(1.0 + np.arange(dimensions) / 64.0)).astype(np.float32)
+        self.words = {}
+
+    def word(self, word):
+        if word not in self.words:
+            self.words[word] = self.rng.standard_normal(self.dimensions).astype(np.float32) * self.weights
+        return self.words[word]
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[i] += self.word(word)
+        return vector_index.normalize(vectors)
+
+
+def shorten(vectors, dimensions):
+    # What the dimensions option does server side: keep the leading dimensions and renormalize
+    return vector_index.normalize(vectors[:, :dimensions])
+
+
+def chunk_corpus(files, seed):
+    # Same token windows as dnd_rag_ingest.chunk_text
+    encoding = stubs.StubEncoding()
+    chunks = []
+    for key, text in corpus.generate(files, seed).items():
+        tokens = encoding.encode(text)
+        for start in range(0, len(tokens), CHUNK_SIZE - CHUNK_OVERLAP):
+            chunks.append((f"{key}_{len(chunks)}", encoding.decode(tokens[start : start + CHUNK_SIZE])))
+    return chunks
+
+
+def make_queries(chunks, count, seed):
+    """
+    Short word windows cut from random chunks, with a few words swapped for
+    random ones so the query never matches its chunk exactly.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(chunks)[1].split()
+        length = rng.randint(8, 16)
+        start = rng.randrange(max(len(words) - length, 1))
+        window = words[start : start + length]
+        for _ in range(len(window) // 4):
+            window[rng.randrange(len(window))] = rng.choice(corpus.WORDS)
+        queries.append(" ".join(window))
+    return queries
+
+
+def folder_bytes(folder, names):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in names)
+
+
+def run(args):
+    chunks = chunk_corpus(args.files, args.seed)
+    ids = [chunk_id for chunk_id, _ in chunks]
+    texts = [text for _, text in chunks]
+    embed = WordEmbeddings(FULL_DIMENSIONS, args.seed)
+    full = embed(texts)
+    queries = embed(make_queries(chunks, args.queries, args.seed))
+    print(f"{len(chunks)} chunks from {args.files} files, {len(queries)} queries, k={args.k}")
+
+    # Ground truth: exact float32 search over the full vectors
+    truth = [set(np.argsort(-(full @ q))[: args.k]) for q in queries]
+    position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+
+    print(
+        f"{'dims':>5} {'mode':<14} {'recall@k':>9} {'download':>10} {'scanned':>10} "
+        f"{'p50':>9} {'p95':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for dimensions in args.dimensions:
+            vectors = shorten(full, dimensions)
+            folder = os.path.join(tmp, str(dimensions))
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                vector_index.write(
+                    folder, ids, vectors, texts, [{} for _ in ids], "stub", embed_dimensions=dimensions, quantized=True
+                )
+            index = vector_index.VectorIndex(folder)
+            download = folder_bytes(folder, vector_index.snapshot_files(folder))
+            query_vectors = shorten(queries, dimensions)
+
+            modes = {
+                "float32": ([vector_index.VECTORS_FILE], lambda q: search_float(index, q, args.k)),
+                "int8": (
+                    [vector_index.QUANTIZED_FILE, vector_index.SCALES_FILE],
+                    lambda q: index.search(q, args.k, rescore=False),
+                ),
+                "int8+rescore": (
+                    [vector_index.QUANTIZED_FILE, vector_index.SCALES_FILE],
+                    lambda q: index.search(q, args.k),
+                ),
+            }
+            for mode, (scanned_files, search) in modes.items():
+                recall = 0.0
+                timings = []
+                for q, expected in zip(query_vectors, truth):
+                    start = time.perf_counter()
+                    results = search(q)
+                    timings.append((time.perf_counter() - start) * 1000)
+                    found = {position[chunk["id"]] for _, chunk in results}
+                    recall += len(found & expected) / args.k
+                timings.sort()
+                print(
+                    f"{dimensions:>5} {mode:<14} {recall / len(truth):>9.3f} "
+                    f"{download / 1e6:>8.1f}MB {folder_bytes(folder, scanned_files) / 1e6:>8.1f}MB "
+                    f"{timings[len(timings) // 2]:>7.3f}ms {timings[int(len(timings) * 0.95)]:>7.3f}ms"
+                )
+
+
+def search_float(index, query, k):
+    # The float32 path of a quantized index, as an unquantized index would search
+    scores = index.vectors @ vector_index.normalize(query)
+    return index._best(np.arange(len(index)), scores, k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=300, help="synthetic notes files to chunk")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dimensions", default="1536,512,256", help="comma separated embedding sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.dimensions = [int(d) for d in args.dimensions.split(",")]
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
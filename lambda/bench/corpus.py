@@ -0,0 +1,60 @@
+"""
+Synthetic session notes shaped like the real bucket: per-session notes,
+transcripts and chat logs under sessions/, plus character sheets. The same
+size and seed always produce the same files.
+"""
+import random
+from datetime import date, timedelta
+
+NOTES_PREFIX = "session-notes/"
+WORDS = (
+    "the party dragon tavern sword spell goblin wizard cleric rogue bard paladin ranger druid monk warlock "
+    "sorcerer fighter barbarian dungeon cave forest desert castle king queen merchant guard thief ritual "
+    "portal map treasure gold potion scroll ring amulet curse blessing initiative attack damage heal rest "
+    "neiro jeffers mira tolan vex quill ash ember frost storm shadow silver iron oak river mountain road"
+).split()
+CHARACTERS = ["neiro", "jeffers", "mira", "tolan", "vex", "quill"]
+
+
+def paragraph(rng, words):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def document(rng, title, paragraphs, words_per_paragraph):
+    body = "\n\n".join(paragraph(rng, words_per_paragraph) for _ in range(paragraphs))
+    return f"# {title}\n\n{body}\n"
+
+
+def session_date(index):
+    return (date(2024, 1, 6) + timedelta(days=7 * index)).isoformat()
+
+
+def generate(files, seed=0):
+    """
+    Returns {s3 key: text} with ``files`` notes. Sessions get a notes file, a
+    transcript (several times longer) and a chat log, and every tenth file is a
+    character sheet.
+    """
+    rng = random.Random(seed)
+    corpus = {}
+    session = 0
+    kinds = 0
+    while len(corpus) < files:
+        if len(corpus) % 10 == 9:
+            name = f"{CHARACTERS[len(corpus) % len(CHARACTERS)]}-{len(corpus)}"
+            corpus[f"{NOTES_PREFIX}characters/{name}-sheets.md"] = document(rng, name, 6, 40)
+            continue
+        day = session_date(session)
+        kind = ("notes", "transcript", "chat-log")[kinds % 3]
+        kinds += 1
+        if kind == "notes":
+            text = document(rng, f"Session {day}", 12, 60)
+        elif kind == "transcript":
+            text = document(rng, f"Transcript {day}", 60, 120)
+        else:
+            text = document(rng, f"Chat log {day}", 20, 30)
+            session += 1
+        corpus[f"{NOTES_PREFIX}sessions/{day}-{kind}.md"] = text
+    corpus[f"{NOTES_PREFIX}instructions.md"] = document(rng, "Instructions", 3, 40)
+    return corpus
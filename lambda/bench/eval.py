@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality and latency of dnd_rag_completion over a golden question set.
+
+    uv run eval.py --questions golden.yaml --notes ../../session-notes --chunks 300/75,500/100 --k 3,5,8
+    uv run eval.py --questions golden.yaml --snapshot /tmp/vector_index/<snapshot> --k 5,8
+    uv run eval.py --stub --files 200 --chunks 300/75,150/40 --k 3,5,8
+
+Every question names the notes files that answer it (see golden.example.yaml).
+With --notes, each --chunks size/overlap is chunked with dnd_rag_ingest's own
+chunk_text, embedded, and written as a vector index the way the ingest writes
+it; with --snapshot a downloaded vector index snapshot is searched as is. The
+questions go through dnd_rag_completion's own retrieve, with and without
+routing, for every k. Per configuration it reports:
+
+    recall@k  share of a question's source files found in the top k
+    hit@k     questions with at least one source file in the top k
+    MRR       mean of 1 / rank of the first chunk from a source file
+    tokens    mean tokens of the k chunks handed to the model
+    p50/p95   search time, the query embedding excluded
+
+Embeddings come from the OpenAI API and are cached by model, size and text
+in --cache, so re-running with another k or a chunk size tried before costs
+nothing. --stub runs offline on the synthetic corpus with word embeddings and
+questions cut from the notes, which is enough to check the harness, not to
+tune anything.
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import compact  # noqa: E402
+import corpus  # noqa: E402
+import stubs  # noqa: E402
+from run import LAMBDA_DIR, load_module, percentile  # noqa: E402
+from dnd_core import vector_index  # noqa: E402
+
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_BATCH = 256
+DEFAULT_CACHE = Path.home() / ".cache" / "dnd-eval" / "embeddings.sqlite"
+IGNORE_SUFFIXES = (".ignore.md",)
+IGNORE_DIRS = {".session-sync-backups", ".session-sync-tmp"}
+
+
+def load_questions(path):
+    """
+    [{"question", "sources", "filters"}] from a YAML or JSON list. Sources are
+    file names relative to the notes folder, S3 keys work too.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit("Reading YAML needs PyYAML (pip install pyyaml), or pass the questions as JSON")
+            entries = yaml.safe_load(f)
+        else:
+            entries = json.load(f)
+    questions = []
+    for entry in entries:
+        sources = entry.get("sources") or []
+        if not entry.get("question") or not sources:
+            sys.exit(f"Every question needs a question and at least one source: {entry}")
+        questions.append(
+            {
+                "question": entry["question"],
+                "sources": {source.removeprefix(corpus.NOTES_PREFIX) for source in sources},
+                "filters": entry.get("filters"),
+            }
+        )
+    return questions
+
+
+def read_notes(folder):
+    notes = {}
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
+        for name in files:
+            if name.endswith(".md") and not name.endswith(IGNORE_SUFFIXES):
+                path = Path(root) / name
+                notes[path.relative_to(folder).as_posix()] = path.read_text(encoding="utf-8")
+    return notes
+
+
+def stub_questions(notes, count, seed):
+    # A window of words from one file, a few of them swapped, answered by that file
+    rng = random.Random(seed)
+    names = sorted(notes)
+    questions = []
+    for _ in range(count):
+        name = rng.choice(names)
+        words = notes[name].split()
+        length = rng.randint(8, 16)
+        start = rng.randrange(max(len(words) - length, 1))
+        window = words[start : start + length]
+        for _ in range(len(window) // 4):
+            window[rng.randrange(len(window))] = rng.choice(corpus.WORDS)
+        questions.append({"question": " ".join(window), "sources": {name}, "filters": None})
+    return questions
+
+
+class OpenAIEmbeddings:
+    def __init__(self, model, dimensions, cache_path):
+        import openai
+
+        self.client = openai.OpenAI()
+        self.model = model
+        self.dimensions = dimensions
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self.cache = sqlite3.connect(cache_path)
+        self.cache.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\n{self.dimensions}\n{text}".encode("utf-8")).hexdigest()
+
+    def __call__(self, texts):
+        keys = [self.key(text) for text in texts]
+        found = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            rows = self.cache.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        missing = sorted({key: text for key, text in zip(keys, texts) if key not in found}.items())
+        for i in range(0, len(missing), EMBED_BATCH):
+            batch = missing[i : i + EMBED_BATCH]
+            options = {"dimensions": self.dimensions} if self.dimensions else {}
+            response = self.client.embeddings.create(model=self.model, input=[text for _, text in batch], **options)
+            for (key, _), item in zip(batch, response.data):
+                found[key] = np.asarray(item.embedding, dtype=np.float32)
+                self.cache.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", (key, found[key].tobytes()))
+            self.cache.commit()
+        if missing:
+            print(f"Embedded {len(missing)} new texts with {self.model}, {len(texts) - len(missing)} from the cache")
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+
+def build_index(ingest, notes, chunk_size, overlap, embed, folder, args):
+    """
+    Chunks, embeds and writes the notes the way dnd_rag_ingest does, with the
+    given chunk size and overlap.
+    """
+    ids, documents, metadatas = [], [], []
+    for name in sorted(notes):
+        chunks = ingest.chunk_text(notes[name], chunk_size, overlap)
+        file_id = name + hashlib.md5(notes[name].encode("utf-8")).hexdigest()
+        record = ingest.file_record(name, file_id, chunks, [])
+        ids += record["ids"]
+        documents += record["documents"]
+        metadatas += record["metadatas"]
+    vectors = embed(documents)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        vector_index.write(
+            folder, ids, vectors, documents, metadatas, args.model, args.dimensions, quantized=args.quantized
+        )
+    return vector_index.VectorIndex(folder)
+
+
+def evaluate(completion, questions, query_vectors, encoding, k, routed):
+    recall = hits = reciprocal = tokens = 0.0
+    timings = []
+    for question, query_vector in zip(questions, query_vectors):
+        filters = question["filters"]
+        start = time.perf_counter()
+        results, _ = completion.retrieve(
+            question["question"], query_vector, filters, routed=routed and filters is None, k=k
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+
+        sources = [chunk.get("source") for _, chunk in results]
+        found = question["sources"] & set(sources)
+        recall += len(found) / len(question["sources"])
+        hits += bool(found)
+        rank = next((i + 1 for i, source in enumerate(sources) if source in question["sources"]), None)
+        reciprocal += 1 / rank if rank else 0.0
+        tokens += sum(len(encoding.encode(chunk["text"])) for _, chunk in results)
+    count = len(questions)
+    return {
+        "recall": recall / count,
+        "hit": hits / count,
+        "mrr": reciprocal / count,
+        "tokens": tokens / count,
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+    }
+
+
+def print_row(row):
+    print(
+        f"{row['config']:<14} {row['k']:>3} {'yes' if row['routed'] else 'no':>6} {row['recall']:>9.3f} "
+        f"{row['hit']:>6.3f} {row['mrr']:>6.3f} {row['tokens']:>8.0f} {row['p50_ms']:>7.3f}ms {row['p95_ms']:>7.3f}ms"
+    )
+
+
+def run(args):
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        ingest = load_module("dnd_rag_ingest", LAMBDA_DIR / "dnd_rag_ingest" / "lambda_function.py")
+        completion = load_module("dnd_rag_completion", LAMBDA_DIR / "dnd_rag_completion" / "lambda_function.py")
+
+    if args.stub:
+        encoding = stubs.StubEncoding()
+        ingest.tiktoken = type("tiktoken", (), {"get_encoding": staticmethod(lambda name: encoding)})
+        embed = compact.WordEmbeddings(args.dimensions or compact.FULL_DIMENSIONS, args.seed)
+        args.model = "stub"
+    else:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        embed = None
+
+    if args.stub and not args.notes:
+        notes = {key.removeprefix(corpus.NOTES_PREFIX): text for key, text in corpus.generate(args.files).items()}
+    elif args.notes:
+        notes = read_notes(args.notes)
+    else:
+        notes = None
+    if args.questions:
+        questions = load_questions(args.questions)
+    elif args.stub:
+        questions = stub_questions(notes, args.count, args.seed)
+    else:
+        sys.exit("--questions is needed unless --stub generates them")
+
+    rows = []
+    print(f"{len(questions)} questions")
+    print(
+        f"{'config':<14} {'k':>3} {'routed':>6} {'recall@k':>9} {'hit@k':>6} {'MRR':>6} {'tokens':>8} "
+        f"{'p50':>9} {'p95':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.snapshot:
+            indexes = [(Path(args.snapshot).name, vector_index.VectorIndex(args.snapshot))]
+            embed = embed or OpenAIEmbeddings(indexes[0][1].model, indexes[0][1].embed_dimensions, args.cache)
+        else:
+            embed = embed or OpenAIEmbeddings(args.model, args.dimensions, args.cache)
+            indexes = (
+                (
+                    f"{size}/{overlap}",
+                    build_index(ingest, notes, size, overlap, embed, os.path.join(tmp, f"{size}-{overlap}"), args),
+                )
+                for size, overlap in args.chunks
+            )
+        query_vectors = embed([question["question"] for question in questions])
+
+        for config, index in indexes:
+            completion.index = index
+            for k in args.k:
+                for routed in (False, True) if args.route else (False,):
+                    row = {"config": config, "k": k, "routed": routed, "chunks": len(index)}
+                    row.update(evaluate(completion, questions, query_vectors, encoding, k, routed))
+                    print_row(row)
+                    rows.append(row)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"Wrote {args.json}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--questions", help="golden questions, YAML or JSON")
+    parser.add_argument("--notes", help="session-notes folder to chunk and embed per --chunks")
+    parser.add_argument("--snapshot", help="downloaded vector index snapshot folder to search instead")
+    parser.add_argument("--chunks", default="300/75", help="comma separated chunk size/overlap pairs in tokens")
+    parser.add_argument("--k", default="3,5,8", help="comma separated result counts")
+    parser.add_argument("--route", action="store_true", help="also evaluate with dnd_rag_completion's routing")
+    parser.add_argument("--model", default=EMBED_MODEL)
+    parser.add_argument("--dimensions", type=int, help="shortened embedding size, as EMBED_DIMENSIONS")
+    parser.add_argument("--quantized", action="store_true", help="int8 index with float32 re-scoring")
+    parser.add_argument("--cache", default=str(DEFAULT_CACHE), help="embedding cache")
+    parser.add_argument("--stub", action="store_true", help="offline: synthetic corpus and word embeddings")
+    parser.add_argument("--files", type=int, default=200, help="synthetic notes files with --stub")
+    parser.add_argument("--count", type=int, default=100, help="generated questions with --stub")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the rows here")
+    args = parser.parse_args()
+    if not (args.notes or args.snapshot or args.stub):
+        parser.error("one of --notes, --snapshot or --stub is needed")
+    args.chunks = [tuple(int(n) for n in pair.split("/")) for pair in args.chunks.split(",")]
+    args.k = [int(k) for k in args.k.split(",")]
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+In-memory stand-ins for the boto3 clients the lambdas use. They implement just
+the calls and expression forms the code in this repo makes, and raise
+NotImplementedError for anything else so a new call shows up loudly.
+"""
+import hashlib
+import io
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+
+def client_error(code, operation, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class FakeEvents:
+    # tracing.instrument registers botocore hooks, the fakes never fire them
+    def register(self, *args, **kwargs):
+        pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.meta = SimpleNamespace(events=FakeEvents())
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def count(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+
+class Paginator:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return self.pages(**kwargs)
+
+
+class FakeS3(FakeClient):
+    PAGE_SIZE = 1000
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}
+
+    def _store(self, key, data):
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self.lock:
+            self.objects[key] = {"data": data, "etag": etag, "modified": datetime.now(timezone.utc)}
+        return etag
+
+    def _load(self, key, operation):
+        obj = self.objects.get(key)
+        if obj is None:
+            raise client_error("404" if operation == "HeadObject" else "NoSuchKey", operation)
+        return obj
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.count("PutObject")
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        return {"ETag": self._store(Key, Body)}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self.count("GetObject")
+        obj = self._load(Key, "GetObject")
+        if IfNoneMatch and IfNoneMatch == obj["etag"]:
+            raise client_error("304", "GetObject")
+        return {
+            "Body": io.BytesIO(obj["data"]),
+            "ETag": obj["etag"],
+            "ContentLength": len(obj["data"]),
+            "LastModified": obj["modified"],
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.count("HeadObject")
+        obj = self._load(Key, "HeadObject")
+        return {"ETag": obj["etag"], "ContentLength": len(obj["data"]), "LastModified": obj["modified"]}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.count("DeleteObject")
+        with self.lock:
+            self.objects.pop(Key, None)
+        return {"ResponseMetadata": {"HTTPStatusCode": 204}}
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        self.count("DownloadFile")
+        data = self._load(Key, "HeadObject")["data"]
+        with open(Filename, "wb") as f:
+            f.write(data)
+        if Callback:
+            Callback(len(data))
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self.count("UploadFile")
+        with open(Filename, "rb") as f:
+            data = f.read()
+        self._store(Key, data)
+        if Callback:
+            Callback(len(data))
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None, Callback=None, Config=None, **kwargs):
+        self.count("Copy")
+        self._store(Key, self._load(CopySource["Key"], "HeadObject")["data"])
+
+    def _list_pages(self, Bucket, Prefix="", Delimiter=None, **kwargs):
+        self.count("ListObjectsV2")
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        prefixes = []
+        if Delimiter:
+            # Keys below the next delimiter roll up into one CommonPrefixes entry
+            nested = {k for k in keys if Delimiter in k[len(Prefix) :]}
+            prefixes = sorted({k[: k.index(Delimiter, len(Prefix)) + 1] for k in nested})
+            keys = [k for k in keys if k not in nested]
+        for i in range(0, max(len(keys), 1), self.PAGE_SIZE):
+            contents = [
+                {
+                    "Key": k,
+                    "ETag": self.objects[k]["etag"],
+                    "Size": len(self.objects[k]["data"]),
+                    "LastModified": self.objects[k]["modified"],
+                }
+                for k in keys[i : i + self.PAGE_SIZE]
+            ]
+            page = {"Contents": contents} if contents else {}
+            if i == 0 and prefixes:
+                page["CommonPrefixes"] = [{"Prefix": prefix} for prefix in prefixes]
+            yield page
+
+    def get_paginator(self, name):
+        if name != "list_objects_v2":
+            raise NotImplementedError(name)
+        return Paginator(self._list_pages)
+
+
+def attribute(item, name, names):
+    return item.get(names.get(name, name))
+
+
+def compare(left, right):
+    # Dynamo typed values, numbers compare numerically
+    if left is None or right is None:
+        return None
+    if "N" in left and "N" in right:
+        return (float(left["N"]) > float(right["N"])) - (float(left["N"]) < float(right["N"]))
+    return (json.dumps(left) > json.dumps(right)) - (json.dumps(left) < json.dumps(right))
+
+
+def condition_holds(item, expression, names, values):
+    """
+    Evaluates the condition expressions used in this repo: terms joined by OR,
+    each either attribute_not_exists(a) or "a <op> :v" with =, <, >.
+    """
+    item = item or {}
+    for term in re.split(r"\s+OR\s+", expression.strip()):
+        term = term.strip()
+        match = re.fullmatch(r"attribute_not_exists\((\S+)\)", term)
+        if match:
+            if attribute(item, match.group(1), names) is None:
+                return True
+            continue
+        match = re.fullmatch(r"(\S+)\s*(=|<|>)\s*(:\w+)", term)
+        if not match:
+            raise NotImplementedError(f"Condition {term}")
+        result = compare(attribute(item, match.group(1), names), values[match.group(3)])
+        if result is not None and {"=": result == 0, "<": result < 0, ">": result > 0}[match.group(2)]:
+            return True
+    return False
+
+
+class FakeDynamo(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.items = {}
+
+    @staticmethod
+    def _key(key):
+        return key["key1"]["S"], key["key2"]["S"]
+
+    def _check(self, current, kwargs, operation):
+        expression = kwargs.get("ConditionExpression")
+        if expression is None:
+            return
+        if not condition_holds(
+            current, expression, kwargs.get("ExpressionAttributeNames", {}), kwargs.get("ExpressionAttributeValues", {})
+        ):
+            error = client_error("ConditionalCheckFailedException", operation)
+            if kwargs.get("ReturnValuesOnConditionCheckFailure") == "ALL_OLD" and current:
+                error.response["Item"] = current
+            raise error
+
+    def get_item(self, TableName, Key, **kwargs):
+        self.count("GetItem")
+        item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, TableName, Item, **kwargs):
+        self.count("PutItem")
+        key = self._key(Item)
+        with self.lock:
+            self._check(self.items.get(key), kwargs, "PutItem")
+            self.items[key] = dict(Item)
+        return {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self.count("DeleteItem")
+        key = self._key(Key)
+        with self.lock:
+            self._check(self.items.get(key), kwargs, "DeleteItem")
+            self.items.pop(key, None)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, **kwargs):
+        self.count("UpdateItem")
+        match = re.fullmatch(r"SET\s+(.+)", UpdateExpression.strip())
+        if not match:
+            raise NotImplementedError(UpdateExpression)
+        names = kwargs.get("ExpressionAttributeNames", {})
+        values = kwargs.get("ExpressionAttributeValues", {})
+        key = self._key(Key)
+        with self.lock:
+            current = self.items.get(key)
+            self._check(current, kwargs, "UpdateItem")
+            item = dict(current or Key)
+            for assignment in match.group(1).split(","):
+                name, value = (part.strip() for part in assignment.split("="))
+                item[names.get(name, name)] = values[value]
+            self.items[key] = item
+        return {}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.count("BatchWriteItem")
+        for requests in RequestItems.values():
+            for request in requests:
+                if "PutRequest" in request:
+                    item = request["PutRequest"]["Item"]
+                    with self.lock:
+                        self.items[self._key(item)] = dict(item)
+                else:
+                    with self.lock:
+                        self.items.pop(self._key(request["DeleteRequest"]["Key"]), None)
+        return {"UnprocessedItems": {}}
+
+    def _matching(self, kwargs):
+        if "KeyConditions" in kwargs:
+            conditions = kwargs["KeyConditions"]
+            partition = conditions["key1"]["AttributeValueList"][0]["S"]
+            sort = conditions.get("key2")
+            prefix = sort["AttributeValueList"][0]["S"] if sort and sort["ComparisonOperator"] == "BEGINS_WITH" else ""
+        else:
+            match = re.fullmatch(r"key1\s*=\s*(:\w+)", kwargs["KeyConditionExpression"].strip())
+            if not match:
+                raise NotImplementedError(kwargs["KeyConditionExpression"])
+            partition = kwargs["ExpressionAttributeValues"][match.group(1)]["S"]
+            prefix = ""
+        with self.lock:
+            keys = sorted(k for k in self.items if k[0] == partition and k[1].startswith(prefix))
+            items = [dict(self.items[k]) for k in keys]
+        if kwargs.get("ScanIndexForward") is False:
+            items.reverse()
+        if "Limit" in kwargs:
+            items = items[: kwargs["Limit"]]
+        return items
+
+    def query(self, TableName, **kwargs):
+        self.count("Query")
+        items = self._matching(kwargs)
+        return {"Items": items, "Count": len(items)}
+
+    def get_paginator(self, name):
+        if name != "query":
+            raise NotImplementedError(name)
+        return Paginator(lambda **kwargs: iter([self.query(**kwargs)]))
+
+
+class FakeLambda(FakeClient):
+    """
+    RequestResponse invokes run the registered in-process handler, Event invokes
+    are only recorded since the caller never waits for them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.handlers = {}
+        self.events = []
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}", **kwargs):
+        self.count(f"Invoke:{InvocationType}")
+        payload = json.loads(Payload)
+        name = FunctionName.rsplit(":", 1)[-1]
+        if InvocationType == "Event":
+            with self.lock:
+                self.events.append((name, payload))
+            return {"StatusCode": 202, "Payload": io.BytesIO(b"")}
+        if name not in self.handlers:
+            raise client_error("ResourceNotFoundException", "Invoke", f"No bench handler for {name}")
+        result = self.handlers[name](payload, None)
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode("utf-8"))}
+
+
+class FakeSQS(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.count("SendMessage")
+        with self.lock:
+            self.messages.append((QueueUrl, MessageBody))
+        return {"MessageId": str(len(self.messages))}
+
+
+class ResourceNotFoundException(Exception):
+    pass
+
+
+class ConflictException(Exception):
+    pass
+
+
+class FakeScheduler(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.schedules = {}
+        self.exceptions = SimpleNamespace(
+            ResourceNotFoundException=ResourceNotFoundException,
+            ConflictException=ConflictException,
+        )
+
+    def update_schedule(self, Name, **kwargs):
+        self.count("UpdateSchedule")
+        if Name not in self.schedules:
+            raise ResourceNotFoundException(Name)
+        self.schedules[Name] = kwargs
+
+    def create_schedule(self, Name, **kwargs):
+        self.count("CreateSchedule")
+        if Name in self.schedules:
+            raise ConflictException(Name)
+        self.schedules[Name] = kwargs
+
+
+class World:
+    """
+    One set of fake clients. ``client`` replaces ``boto3.client`` so every
+    module-level client a lambda creates at import talks to the same fakes.
+    """
+
+    def __init__(self):
+        self.clients = {
+            "s3": FakeS3(),
+            "dynamodb": FakeDynamo(),
+            "lambda": FakeLambda(),
+            "sqs": FakeSQS(),
+            "scheduler": FakeScheduler(),
+        }
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name not in self.clients:
+            raise NotImplementedError(f"No fake for {service_name}")
+        return self.clients[service_name]
+
+    @property
+    def s3(self):
+        return self.clients["s3"]
+
+    @property
+    def dynamo(self):
+        return self.clients["dynamodb"]
+
+    @property
+    def lambda_client(self):
+        return self.clients["lambda"]
+
+    def reset_calls(self):
+        for client in self.clients.values():
+            client.calls.clear()
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Runs every lambda handler (and sync-notes.py) in-process against in-memory
+fakes for S3, DynamoDB, Lambda, SQS and Scheduler, with stub embedding and LLM
+backends, over synthetic corpora of several sizes.
+
+    uv run run.py --sizes 10,100,1000 --iterations 20 --json results.json
+    uv run run.py --compare results.json
+
+For every scenario it reports latency percentiles from a timing pass, then the
+peak traced memory and the number of blocks still allocated afterwards from a
+separate tracemalloc pass, so tracing overhead never skews the timings.
+Handlers whose dependencies are not installed in the current environment are
+skipped with the import error.
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from types import SimpleNamespace
+
+BENCH_DIR = Path(__file__).resolve().parent
+LAMBDA_DIR = BENCH_DIR.parent
+REPO_DIR = LAMBDA_DIR.parent
+
+APP_NAME = "dnd"
+ORIGIN = "https://dnd.example.com"
+PHONE = "5556152345"
+TOKEN = "bench-token"
+CSRF = "bench-csrf"
+FAR_FUTURE = str(int(time.time()) + 365 * 24 * 60 * 60)
+
+ENVIRONMENT = {
+    "S3_BUCKET": "bench-bucket",
+    "S3_PREFIX": "session-notes/",
+    "DYNAMODB_TABLE_NAME": "bench-table",
+    "HTTPS_DOMAIN_NAME": ORIGIN,
+    "DOMAIN_NAME": "dnd.example.com",
+    "APP_NAME": APP_NAME,
+    "GEMINI_API_KEY": "bench",
+    "OPENAI_API_KEY": "bench",
+    "FILE_SEARCH_STORE_NAME": "fileSearchStores/bench",
+    # The Gemini ingest only reads from S3 when it thinks it is running in lambda
+    "LAMBDA_TASK_ROOT": str(LAMBDA_DIR),
+    "LOG_SAMPLE_RATE": "0",
+}
+for name, value in ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+sys.path.insert(0, str(LAMBDA_DIR / "dnd_core"))
+sys.path.insert(0, str(BENCH_DIR))
+
+import boto3  # noqa: E402
+
+import corpus  # noqa: E402
+import fakes  # noqa: E402
+import stubs  # noqa: E402
+from dnd_core import tracing  # noqa: E402
+
+HANDLERS = {
+    "notes": "dnd-notes-lambda",
+    "dnd_rag_ingest": "dnd_rag_ingest",
+    "dnd_rag_completion": "dnd_rag_completion",
+    "dnd-rag-ingest-gemini": "dnd-rag-ingest-gemini",
+    "dnd-rag-completion-gemini": "dnd-rag-completion-gemini",
+    "dnd-summary-gemini": "dnd-summary-gemini",
+}
+# SDKs the lambdas only import on first use, so a missing one would not fail the load
+REQUIRES = {
+    "dnd_rag_ingest": ("chromadb", "tiktoken"),
+    "dnd_rag_completion": ("numpy",),
+    "dnd-rag-ingest-gemini": ("google.genai",),
+    "dnd-summary-gemini": ("google.genai",),
+}
+# Packages the lambdas import by plain name, dropped between loads so every corpus gets fresh module state
+LAMBDA_PACKAGES = {"dnd_notes_lambda", "dnd_rag_ingest", "dnd_rag_completion", "backup_store"}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def missing_module(names):
+    for name in names:
+        try:
+            if importlib.util.find_spec(name) is None:
+                return name
+        except ModuleNotFoundError:
+            return name
+    return None
+
+
+def load_module(name, path):
+    for module in [m for m in sys.modules if m.split(".")[0] in LAMBDA_PACKAGES]:
+        del sys.modules[module]
+    sys.path.insert(0, str(path.parent))
+    try:
+        spec = importlib.util.spec_from_file_location(f"bench_{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        sys.path.remove(str(path.parent))
+
+
+def api_event(path, **body):
+    return {
+        "path": path,
+        "httpMethod": "POST",
+        "headers": {"origin": ORIGIN, "cookie": f"{APP_NAME}-auth-token={TOKEN}"},
+        "body": json.dumps({"csrf": CSRF, **body}),
+        "requestContext": {"requestId": f"bench-{time.perf_counter_ns()}"},
+    }
+
+
+def seed_session(world, previous_queries):
+    dynamo = world.dynamo
+    dynamo.items[("user", PHONE)] = {"key1": {"S": "user"}, "key2": {"S": PHONE}}
+    dynamo.items[("token", TOKEN)] = {
+        "key1": {"S": "token"},
+        "key2": {"S": TOKEN},
+        "csrf": {"S": CSRF},
+        "user": {"S": PHONE},
+        "expiration": {"N": FAR_FUTURE},
+    }
+    dynamo.items[("active_tokens", PHONE)] = {
+        "key1": {"S": "active_tokens"},
+        "key2": {"S": PHONE},
+        "tokens": {"M": {TOKEN: {"N": FAR_FUTURE}}},
+    }
+    for i in range(previous_queries):
+        for kind in ("completion", "summary"):
+            key2 = f"{PHONE}#{1700000000 + i}"
+            dynamo.items[(kind, key2)] = {
+                "key1": {"S": kind},
+                "key2": {"S": key2},
+                "user": {"S": PHONE},
+                "time": {"N": str(1700000000 + i)},
+                "query": {"S": f"Question {i}?"},
+                "date": {"S": corpus.session_date(0)},
+                "response": {"S": "An answer. " * 40},
+                "model": {"S": "Gemini"},
+            }
+
+
+def canned(body):
+    return lambda payload, context: {"statusCode": 200, "body": body}
+
+
+def prepare_chroma_ingest(module, world, embed, tmp):
+    """
+    Points dnd_rag_ingest's local paths into ``tmp`` and swaps in the stub
+    embeddings and encoding. Returns a function that resets chromadb.zip to an
+    empty index.
+    """
+    module.embed_fn = embed
+    module.DATA_FOLDER = str(tmp / "session-notes") + "/"
+    module.MIRROR_STATE = str(tmp / "session-notes.json")
+    module.CHROMA_PATH = str(tmp / "chroma_data") + "/"
+    module.CHROMA_ZIP = str(tmp / "chromadb.zip")
+    module.CHROMA_SNAPSHOT_ZIP = str(tmp / "chroma_snapshot.zip")
+    module.INDEX_EXPORT_PATH = str(tmp / "vector_index_export") + "/"
+    module.INDEX_PREVIOUS_PATH = str(tmp / "vector_index_previous") + "/"
+    # The real encodings are downloaded on first use, chunking works the same on stub tokens
+    encoding = stubs.StubEncoding()
+    module.tiktoken = SimpleNamespace(get_encoding=lambda name: encoding)
+    empty = tmp / "empty-snapshot.zip"
+    zipfile.ZipFile(empty, "w").close()
+
+    def empty_index():
+        world.s3.put_object(Bucket="", Key="chromadb.zip", Body=empty.read_bytes())
+
+    return empty_index
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        self.devnull = open(os.devnull, "w")
+
+    def quiet(self):
+        stack = contextlib.ExitStack()
+        if not self.args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(self.devnull))
+            stack.enter_context(contextlib.redirect_stderr(self.devnull))
+        return stack
+
+    def measure(self, size, handler, scenario, fn, setup=None, iterations=None):
+        iterations = iterations or self.args.iterations
+        statuses = []
+
+        def call():
+            result = fn()
+            statuses.append(result.get("statusCode", 200) if isinstance(result, dict) else 200)
+
+        with self.quiet():
+            if setup:
+                setup()
+            call()
+            samples = []
+            for _ in range(iterations):
+                if setup:
+                    setup()
+                start = time.perf_counter()
+                call()
+                samples.append(time.perf_counter() - start)
+
+            if setup:
+                setup()
+            tracemalloc.start()
+            call()
+            retained = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        result = {
+            "size": size,
+            "handler": handler,
+            "scenario": scenario,
+            "n": len(samples),
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "max_ms": max(samples) * 1000,
+            "peak_kb": peak / 1024,
+            "retained_blocks": retained,
+            "errors": sum(1 for status in statuses if status >= 500),
+        }
+        self.results.append(result)
+        self.print_row(result)
+
+    def print_row(self, result):
+        print(
+            f"{result['size']:>6} {result['handler']:<26} {result['scenario']:<34} n={result['n']:<3} "
+            f"p50={result['p50_ms']:>9.2f}ms p95={result['p95_ms']:>9.2f}ms max={result['max_ms']:>9.2f}ms "
+            f"peak={result['peak_kb']:>9.1f}KB blocks={result['retained_blocks']:>7} errors={result['errors']}",
+            flush=True,
+        )
+
+    def load(self, world, selected):
+        boto3.client = world.client
+        modules = {}
+        for name, directory in HANDLERS.items():
+            if name not in selected:
+                continue
+            missing = missing_module(REQUIRES.get(name, ()))
+            if missing:
+                print(f"Skipping {name}: No module named '{missing}'")
+                continue
+            try:
+                with self.quiet():
+                    modules[name] = load_module(name, LAMBDA_DIR / directory / "lambda_function.py")
+            except ImportError as e:
+                print(f"Skipping {name}: {e}")
+        if "sync-notes" in selected:
+            modules["sync-notes"] = load_module("sync_notes", REPO_DIR / "session-notes" / "sync-notes.py")
+        return modules
+
+    def run_size(self, size, selected, tmp):
+        args = self.args
+        world = fakes.World()
+        modules = self.load(world, selected)
+        embed = stubs.StubEmbeddingFunction(args.embed_dimensions, args.embed_latency_ms)
+        gemini = stubs.StubGemini(args.model_latency_ms, args.upload_latency_ms)
+
+        notes = corpus.generate(size)
+        for key, text in notes.items():
+            world.s3.put_object(Bucket="", Key=key, Body=text)
+        seed_session(world, previous_queries=50)
+        sample_key = next(k for k in notes if "/sessions/" in k)
+        sample_date = corpus.session_date(0)
+
+        handlers = world.lambda_client.handlers
+        handlers["dnd_rag_completion"] = canned("Canned answer")
+        handlers["dnd-rag-completion-gemini"] = canned(json.dumps({"response": "Canned answer", "sources": []}))
+        handlers["dnd-summary-gemini"] = canned(json.dumps({"response": "A canned summary of the session. " * 200}))
+        for name, module in modules.items():
+            if name in handlers:
+                handlers[name] = self.isolated(module.lambda_handler)
+
+        if "dnd-rag-completion-gemini" in modules:
+            module = modules["dnd-rag-completion-gemini"]
+            module.client = gemini
+            module.generate_config = SimpleNamespace()
+        if "dnd-summary-gemini" in modules:
+            modules["dnd-summary-gemini"].client = gemini
+        if "dnd-rag-ingest-gemini" in modules:
+            modules["dnd-rag-ingest-gemini"].genai = SimpleNamespace(Client=lambda **kwargs: gemini)
+        if "dnd_rag_completion" in modules:
+            module = modules["dnd_rag_completion"]
+            module.openai = SimpleNamespace(OpenAI=lambda **kwargs: stubs.StubOpenAI(args.model_latency_ms, embed))
+            module.INDEX_ROOT = str(tmp / "vector_index")
+
+        if "dnd_rag_ingest" in modules:
+            self.bench_chroma_ingest(size, modules["dnd_rag_ingest"], world, embed, sample_key, tmp)
+        if "dnd_rag_completion" in modules:
+            if world.s3.objects.get("vector-index/current.json"):
+                module = modules["dnd_rag_completion"]
+                for scenario, query in (
+                    ("query", "How did neiro get to the desert with jeffers?"),
+                    ("query (last session)", "What happened in the last session?"),
+                ):
+                    event = {"body": {"query": query}}
+                    self.measure(size, "dnd_rag_completion", scenario, lambda e=event: module.lambda_handler(e, None))
+            else:
+                print("Skipping dnd_rag_completion: needs the vector index dnd_rag_ingest publishes")
+        if "dnd-rag-ingest-gemini" in modules:
+            self.bench_gemini_ingest(size, modules["dnd-rag-ingest-gemini"], gemini, sample_key)
+        if "dnd-rag-completion-gemini" in modules:
+            module = modules["dnd-rag-completion-gemini"]
+            event = {"body": {"query": "How did neiro get to the desert with jeffers?", "user": PHONE}}
+            self.measure(size, "dnd-rag-completion-gemini", "query", lambda: module.lambda_handler(event, None))
+        if "dnd-summary-gemini" in modules:
+            module = modules["dnd-summary-gemini"]
+            for scenario, force in (("summary (cached)", False), ("summary (forced)", True)):
+                event = {"body": {"date": sample_date, "user": PHONE, "force": force}}
+                self.measure(size, "dnd-summary-gemini", scenario, lambda e=event: module.lambda_handler(e, None))
+        if "notes" in modules:
+            self.bench_notes(size, modules["notes"], sample_key, sample_date)
+        if "sync-notes" in modules:
+            self.bench_sync(size, modules["sync-notes"], notes, tmp)
+
+    @staticmethod
+    def isolated(handler):
+        # A real invoke runs in another container, so the callee must not end the caller's trace
+        def invoke(payload, context):
+            caller = tracing.current
+            try:
+                return handler(payload, context)
+            finally:
+                tracing.current = caller
+
+        return invoke
+
+    def bench_notes(self, size, module, sample_key, sample_date):
+        filename = sample_key.removeprefix(corpus.NOTES_PREFIX)
+        scratch = "bench/scratch.md"
+        routes = [
+            ("/ping", {}),
+            ("/logged-in-check", {}),
+            ("/get-notes-list", {}),
+            ("/get-note", {"filename": filename}),
+            ("/set-note", {"filename": scratch, "content": "# Scratch\n\nA dragon appears.\n"}),
+            ("/get-previous-queries", {}),
+            ("/get-previous-summaries", {}),
+            ("/load-cache", {}),
+            ("/find", {"find": "dragon"}),
+            ("/replace", {"find": "dragon", "replace": "dragon"}),
+            ("/get-completion", {"query": "How did neiro get to the desert with jeffers?"}),
+            ("/get-completion-gemini", {"query": "How did neiro get to the desert with jeffers?"}),
+            ("/generate-summary-gemini", {"date": sample_date}),
+            ("/delete-note", {"filename": scratch}),
+        ]
+        for path, body in routes:
+            self.measure(size, "notes", path, lambda p=path, b=body: module.lambda_handler(api_event(p, **b), None))
+
+    def bench_gemini_ingest(self, size, module, gemini, sample_key):
+        heavy = self.args.heavy_iterations
+        self.measure(
+            size,
+            "dnd-rag-ingest-gemini",
+            "full scan (empty store)",
+            lambda: module.lambda_handler({}, None),
+            setup=gemini.documents.documents.clear,
+            iterations=heavy,
+        )
+        self.measure(size, "dnd-rag-ingest-gemini", "full scan (in sync)", lambda: module.lambda_handler({}, None), iterations=heavy)
+        event = {"keys": [sample_key]}
+        self.measure(size, "dnd-rag-ingest-gemini", "one changed key", lambda: module.lambda_handler(event, None))
+
+    def bench_chroma_ingest(self, size, module, world, embed, sample_key, tmp):
+        empty_index = prepare_chroma_ingest(module, world, embed, tmp)
+
+        heavy = self.args.heavy_iterations
+        self.measure(
+            size,
+            "dnd_rag_ingest",
+            "full scan (empty index)",
+            lambda: module.lambda_handler({}, None),
+            setup=empty_index,
+            iterations=heavy,
+        )
+        self.measure(size, "dnd_rag_ingest", "full scan (in sync)", lambda: module.lambda_handler({}, None), iterations=heavy)
+        event = {"keys": [sample_key]}
+        self.measure(size, "dnd_rag_ingest", "one changed key", lambda: module.lambda_handler(event, None), iterations=heavy)
+
+        edits = iter(range(1, 1_000_000))
+
+        def edit_sample():
+            body = world.s3.get_object(Bucket="", Key=sample_key)["Body"].read()
+            world.s3.put_object(Bucket="", Key=sample_key, Body=body + f"\nEdit {next(edits)}.\n".encode())
+
+        self.measure(
+            size,
+            "dnd_rag_ingest",
+            "one edited key",
+            lambda: module.lambda_handler(event, None),
+            setup=edit_sample,
+            iterations=heavy,
+        )
+        self.measure(
+            size,
+            "dnd_rag_ingest",
+            "full scan (one edited file)",
+            lambda: module.lambda_handler({}, None),
+            setup=edit_sample,
+            iterations=heavy,
+        )
+
+        def checkpointed_scan():
+            # Always out of time, so every invocation embeds one batch and hands the rest to the next
+            context = SimpleNamespace(function_name="dnd_rag_ingest", get_remaining_time_in_millis=lambda: 0)
+            events = world.lambda_client.events
+            events.clear()
+            result = module.lambda_handler({}, context)
+            while events:
+                _, payload = events.pop(0)
+                result = module.lambda_handler(payload, context)
+            return result
+
+        self.measure(
+            size,
+            "dnd_rag_ingest",
+            "full scan (checkpointed)",
+            checkpointed_scan,
+            setup=empty_index,
+            iterations=heavy,
+        )
+        self.measure(
+            size,
+            "dnd_rag_ingest",
+            "compact",
+            lambda: module.lambda_handler({"compact": True}, None),
+            iterations=heavy,
+        )
+
+    def bench_sync(self, size, module, notes, tmp):
+        local = tmp / "sync"
+        cwd = os.getcwd()
+
+        def fresh_checkout():
+            shutil.rmtree(local, ignore_errors=True)
+            for key, text in notes.items():
+                path = local / key.removeprefix(corpus.NOTES_PREFIX)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(text)
+
+        def sync():
+            os.chdir(local)
+            try:
+                module.main(on_conflict="skip")
+            finally:
+                os.chdir(cwd)
+
+        heavy = self.args.heavy_iterations
+        self.measure(size, "sync-notes", "first sync (no state)", sync, setup=fresh_checkout, iterations=heavy)
+        self.measure(size, "sync-notes", "no-op sync", sync)
+
+    def run(self):
+        selected = set(self.args.handlers.split(",")) if self.args.handlers else set(HANDLERS) | {"sync-notes"}
+        for size in (int(s) for s in self.args.sizes.split(",")):
+            with tempfile.TemporaryDirectory() as tmp:
+                self.run_size(size, selected, Path(tmp))
+
+
+def compare(results, baseline_path, threshold):
+    baseline = {(r["size"], r["handler"], r["scenario"]): r for r in json.loads(Path(baseline_path).read_text())}
+    regressions = 0
+    print(f"\nCompared with {baseline_path} (flagging p95 more than {threshold:.0%} slower)")
+    for result in results:
+        before = baseline.get((result["size"], result["handler"], result["scenario"]))
+        if not before or not before["p95_ms"]:
+            continue
+        change = result["p95_ms"] / before["p95_ms"] - 1
+        if change > threshold:
+            regressions += 1
+            print(
+                f"REGRESSION {result['size']} {result['handler']} {result['scenario']}: "
+                f"p95 {before['p95_ms']:.2f}ms -> {result['p95_ms']:.2f}ms ({change:+.0%})"
+            )
+    print(f"{regressions} regressions")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,100,1000", help="comma separated corpus sizes, up to 10000")
+    parser.add_argument("--iterations", type=int, default=20, help="timed runs per scenario")
+    parser.add_argument("--heavy-iterations", type=int, default=3, help="timed runs for full scans and syncs")
+    parser.add_argument("--handlers", help=f"comma separated subset of {', '.join([*HANDLERS, 'sync-notes'])}")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="stub LLM latency per call")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="stub embedding latency per batch")
+    parser.add_argument("--upload-latency-ms", type=float, default=0.0, help="stub File Search latency per call")
+    parser.add_argument("--embed-dimensions", type=int, default=256, help="stub embedding size")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="baseline results json to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 slowdown that counts as a regression")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the handlers' own output")
+    args = parser.parse_args()
+
+    bench = Bench(args)
+    bench.run()
+    if args.json:
+        Path(args.json).write_text(json.dumps(bench.results, indent=2))
+    if args.compare and compare(bench.results, args.compare, args.threshold):
+        sys.exit(1)
@@ -0,0 +1,153 @@
+"""
+Deterministic stand-ins for the embedding and LLM APIs. Every call sleeps for a
+configurable latency so the harness can model a slow or fast provider, and the
+same input always produces the same output.
+"""
+import hashlib
+import itertools
+import math
+import random
+import re
+import time
+from types import SimpleNamespace
+
+try:
+    from chromadb import EmbeddingFunction
+except ImportError:
+    # Only the Chroma lambdas need the stub to be a real Chroma embedding function
+    EmbeddingFunction = object
+
+
+def sleep_ms(ms):
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+def stub_vector(text, dimensions):
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class StubEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, dimensions=1536, latency_ms=0.0):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, input):
+        self.calls += 1
+        self.texts += len(input)
+        sleep_ms(self.latency_ms)
+        return [stub_vector(text, self.dimensions) for text in input]
+
+
+class StubEncoding:
+    """
+    Stands in for a tiktoken encoding, one token per word with its leading
+    whitespace, so chunking works without downloading the real BPE files.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.pieces = []
+
+    def encode(self, text):
+        tokens = []
+        for piece in re.findall(r"\s*\S+|\s+", text):
+            if piece not in self.ids:
+                self.ids[piece] = len(self.pieces)
+                self.pieces.append(piece)
+            tokens.append(self.ids[piece])
+        return tokens
+
+    def decode(self, tokens):
+        return "".join(self.pieces[t] for t in tokens)
+
+
+def stub_answer(prompt):
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+    return f"Stub answer {digest} for a {len(prompt)} character prompt."
+
+
+class StubOpenAI:
+    """
+    Looks like ``openai.OpenAI`` for ``chat.completions.create`` and ``embeddings.create``.
+    """
+
+    def __init__(self, latency_ms=0.0, embed=None):
+        self.latency_ms = latency_ms
+        self.embed = embed or StubEmbeddingFunction()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+        self.embeddings = SimpleNamespace(create=self._embeddings)
+
+    def _complete(self, model, messages, **kwargs):
+        sleep_ms(self.latency_ms)
+        prompt = "\n".join(message["content"] for message in messages)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=stub_answer(prompt)))],
+            usage=SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=16),
+        )
+
+    def _embeddings(self, model, input, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        vectors = self.embed(texts)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=v, index=i) for i, v in enumerate(vectors)])
+
+
+class StubDocuments:
+    def __init__(self, latency_ms):
+        self.latency_ms = latency_ms
+        self.documents = {}
+
+    def list(self, parent):
+        sleep_ms(self.latency_ms)
+        return list(self.documents.values())
+
+    def delete(self, name, config=None):
+        sleep_ms(self.latency_ms)
+        self.documents.pop(name, None)
+
+
+class StubGemini:
+    """
+    Looks like ``google.genai.Client`` for ``models.generate_content`` and the
+    File Search store calls the Gemini ingest makes.
+    """
+
+    def __init__(self, latency_ms=0.0, upload_latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.upload_latency_ms = upload_latency_ms
+        documents = StubDocuments(upload_latency_ms)
+        self.models = SimpleNamespace(generate_content=self._generate)
+        self.file_search_stores = SimpleNamespace(
+            documents=documents,
+            upload_to_file_search_store=self._upload,
+        )
+        self.operations = SimpleNamespace(get=lambda operation: operation)
+        self.documents = documents
+        self.uploads = itertools.count()
+
+    def _generate(self, model, contents, config=None):
+        sleep_ms(self.latency_ms)
+        prompt = "\n".join(str(part) for part in contents)
+        return SimpleNamespace(
+            text=stub_answer(prompt),
+            candidates=[],
+            usage_metadata=SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=16),
+        )
+
+    def _upload(self, file, file_search_store_name, config):
+        sleep_ms(self.upload_latency_ms)
+        name = f"{file_search_store_name}/documents/{next(self.uploads)}"
+        metadata = [
+            SimpleNamespace(key=m.key, string_value=m.string_value) for m in config.get("custom_metadata", [])
+        ]
+        self.documents.documents[name] = SimpleNamespace(
+            name=name,
+            display_name=config["display_name"],
+            custom_metadata=metadata,
+        )
+        return SimpleNamespace(done=True, name=name)
@@ -0,0 +1,158 @@
+"""
+Completion and summary history items. A long response is zlib compressed into
+a binary attribute, and one that is still too big after that goes to S3 with
+only its key left in the item, so items stay far below DynamoDB's 400 KB limit
+and the get-previous routes read fewer capacity units. ``<field>_codec`` says
+how a field is stored; items without it are plain strings from before.
+
+Routes don't write their items themselves: save_history buffers them and
+flush_history hands them off once the response is built, so a failing write
+never changes what the user gets back. API Gateway still waits for the
+handler to return, so the hand-off is on the response path: with
+HISTORY_QUEUE_URL set it is one SQS send and write_history_records packs and
+writes the items from the queue with retries; without it, it is a single
+batch_write_item attempt (plus an S3 put for a response big enough to offload),
+and whatever that attempt leaves unprocessed is logged instead of retried.
+"""
+import json
+import os
+import random
+import time
+import zlib
+
+from botocore.exceptions import ClientError
+
+from .utils import S3_BUCKET, TABLE_NAME, dynamo, python_obj_to_dynamo_obj, s3, sqs
+
+HISTORY_COMPRESS_BYTES = int(os.environ.get("HISTORY_COMPRESS_BYTES", "1024"))
+HISTORY_S3_BYTES = int(os.environ.get("HISTORY_S3_BYTES", "65536"))
+HISTORY_PREFIX = "history/"
+PACKED_FIELDS = ("response",)
+MISSING_TEXT = "This response is no longer available"
+HISTORY_QUEUE_URL = os.environ.get("HISTORY_QUEUE_URL")
+BATCH_WRITE_LIMIT = 25
+BATCH_WRITE_ATTEMPTS = 5
+# Without a queue the write happens before the response is returned, so no retries and no backoff sleeps
+INLINE_WRITE_ATTEMPTS = 1
+
+# Items saved during this invocation, written by flush_history
+pending = []
+
+
+def pack_history(item):
+    """
+    Compresses the long fields of a history item in place before it is written.
+    """
+    for field in PACKED_FIELDS:
+        value = item.get(field)
+        if not isinstance(value, str):
+            continue
+        raw = value.encode("utf-8")
+        if len(raw) < HISTORY_COMPRESS_BYTES:
+            continue
+        data = zlib.compress(raw)
+        if len(data) > HISTORY_S3_BYTES:
+            key = f"{HISTORY_PREFIX}{item['key1']}/{item['key2']}/{field}.zlib"
+            s3.put_object(Bucket=S3_BUCKET, Key=key, Body=data)
+            item[field] = key
+            item[f"{field}_codec"] = "s3+zlib"
+        else:
+            item[field] = data
+            item[f"{field}_codec"] = "zlib"
+    return item
+
+
+def unpack_history(item):
+    """
+    The plain text of a history item read from the table, old or new format.
+    """
+    for field in PACKED_FIELDS:
+        codec = item.pop(f"{field}_codec", None)
+        if codec == "zlib":
+            item[field] = zlib.decompress(bytes(item[field])).decode("utf-8")
+        elif codec == "s3+zlib":
+            try:
+                data = s3.get_object(Bucket=S3_BUCKET, Key=item[field])["Body"].read()
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                    raise
+                # The S3 copy expired before the item did
+                print(f"History: {item[field]} is gone")
+                item[field] = MISSING_TEXT
+                continue
+            item[field] = zlib.decompress(data).decode("utf-8")
+        elif codec is not None:
+            raise ValueError(f"Unknown codec {codec} for {field}")
+    return item
+
+
+def save_history(item):
+    pending.append(item)
+
+
+def flush_history():
+    """
+    Queues the buffered items, or writes them in one attempt when there is no
+    queue or queueing failed. Called at the end of every invocation; never
+    raises, since the response is already decided by then.
+    """
+    items = pending[:]
+    pending.clear()
+    if not items:
+        return
+    try:
+        if HISTORY_QUEUE_URL:
+            items = queue_items(items)
+        if items:
+            lost = write_items(items, INLINE_WRITE_ATTEMPTS)
+            if lost:
+                print(f"History: could not write {json.dumps(lost)}")
+    except Exception as e:
+        # Logged whole, so they can still be put back by hand
+        print(f"History: could not write {json.dumps(items)}: {e!r}")
+
+
+def queue_items(items):
+    # Returns the items that could not be queued, to be written directly
+    failed = []
+    for item in items:
+        try:
+            sqs.send_message(QueueUrl=HISTORY_QUEUE_URL, MessageBody=json.dumps(item))
+        except ClientError as e:
+            print(f"History: queueing {item['key1']} {item['key2']} failed: {e}")
+            failed.append(item)
+    return failed
+
+
+def write_items(items, attempts=BATCH_WRITE_ATTEMPTS):
+    """
+    Packs and batch writes history items, retrying unprocessed ones with
+    backoff. Returns the items still unwritten after the last attempt.
+    """
+    requests = [{"PutRequest": {"Item": python_obj_to_dynamo_obj(pack_history(dict(item)))}} for item in items]
+    by_key = {(item["key1"], item["key2"]): item for item in items}
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(random.uniform(0, 0.05 * 2**attempt))
+        unprocessed = []
+        for i in range(0, len(requests), BATCH_WRITE_LIMIT):
+            response = dynamo.batch_write_item(RequestItems={TABLE_NAME: requests[i : i + BATCH_WRITE_LIMIT]})
+            unprocessed += response.get("UnprocessedItems", {}).get(TABLE_NAME, [])
+        if not unprocessed:
+            return []
+        requests = unprocessed
+    return [by_key[(r["PutRequest"]["Item"]["key1"]["S"], r["PutRequest"]["Item"]["key2"]["S"])] for r in requests]
+
+
+def write_history_records(event):
+    """
+    SQS consumer for HISTORY_QUEUE_URL. Messages whose item could not be
+    written are reported back so only they are retried.
+    """
+    records = {}
+    for record in event["Records"]:
+        item = json.loads(record["body"])
+        records[(item["key1"], item["key2"])] = (record["messageId"], item)
+    lost = write_items([item for _, item in records.values()])
+    print(f"History: wrote {len(records) - len(lost)} of {len(records)} queued items")
+    return {"batchItemFailures": [{"itemIdentifier": records[(i["key1"], i["key2"])][0]} for i in lost]}
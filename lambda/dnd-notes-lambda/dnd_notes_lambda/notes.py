@@ -1,6 +1,5 @@
 from .utils import (
     dynamo_obj_to_python_obj,
-    python_obj_to_dynamo_obj,
     authenticate,
     dynamo,
     TABLE_NAME,
@@ -8,10 +7,17 @@ from .utils import (
     json,
     s3,
     lambda_client,
+    scheduler,
     S3_BUCKET,
+    INGEST_SCHEDULER_ROLE_ARN,
+    INGEST_QUIET_SECONDS,
+    INGEST_MAX_WAIT_SECONDS,
+    INGEST_FUNCTION_ARNS,
     time,
     re,
 )
+from dnd_core import ingest_queue, tracing
+from .history import save_history, unpack_history
 from .input_validation import (
     validate_date
 )
@@ -33,16 +39,20 @@ def get_completion_route(event, user_data, body):
     time_value = int(time.time())
     try:
         question = body["query"]
+        request = {"query": question}
+        # Optional search filters (doc_types, dates, since, until), otherwise the completion routes the question itself
+        if isinstance(body.get("filters"), dict):
+            request["filters"] = body["filters"]
         resp = lambda_client.invoke(
             FunctionName="dnd_rag_completion",
             InvocationType="RequestResponse",
-            Payload=json.dumps({"body": {"query": question}})
+            Payload=json.dumps(tracing.with_trace({"body": request}))
         )
         response_body = json.loads(resp["Payload"].read().decode())
-        print(f'User: {user_data["key2"]} -- Query: {question} -- Response: {response_body["body"]}')
+        tracing.log("completion", user=user_data["key2"], query=question, response=response_body["body"])
         status_code = response_body["statusCode"]
         response_text = response_body["body"]
-        # write to DB
+        # written to DB by flush_history once the response is built
         completion_data = {
             "key1": "completion",
             "key2": f'{user_data["key2"]}#{time_value}',
@@ -53,10 +63,7 @@ def get_completion_route(event, user_data, body):
             "expiration": int(time.time()) + (60 * 60 * 24 * 30),
             "model": "ChatGPT",
         }
-        dynamo.put_item(
-            TableName=TABLE_NAME,
-            Item=python_obj_to_dynamo_obj(completion_data),
-        )
+        save_history(completion_data)
     except:
         traceback.print_exc()
     return format_response(
@@ -82,10 +89,10 @@ def get_completion_gemini_route(event, user_data, body):
         resp = lambda_client.invoke(
             FunctionName="dnd-rag-completion-gemini",
             InvocationType="RequestResponse",
-            Payload=json.dumps({"body": {"user": user_data['key2'], "query": question}})
+            Payload=json.dumps(tracing.with_trace({"body": {"user": user_data['key2'], "query": question}}))
         )
         response_body = json.loads(resp["Payload"].read().decode())
-        print(f'User: {user_data["key2"]} -- Query: {question} -- Response: {response_body["body"]}')
+        tracing.log("completion", user=user_data["key2"], query=question, response=response_body["body"])
         status_code = response_body["statusCode"]
         response_json = json.loads(response_body["body"])
         response_text = ''
@@ -97,7 +104,7 @@ def get_completion_gemini_route(event, user_data, body):
             response_text += "\n\n## Sources"
             for source in response_json.get("sources", []):
                 response_text += f"\n* {source}"
-        # write to DB
+        # written to DB by flush_history once the response is built
         completion_data = {
             "key1": "completion",
             "key2": f'{user_data["key2"]}#{time_value}',
@@ -108,10 +115,7 @@ def get_completion_gemini_route(event, user_data, body):
             "expiration": int(time.time()) + (60 * 60 * 24 * 30),
             "model": "Gemini",
         }
-        dynamo.put_item(
-            TableName=TABLE_NAME,
-            Item=python_obj_to_dynamo_obj(completion_data),
-        )
+        save_history(completion_data)
     except:
         traceback.print_exc()
     return format_response(
@@ -163,7 +167,7 @@ def get_previous_queries_route(event, user_data, body):
             body=output,
         )
     for item in response["Items"]:
-        python_item = dynamo_obj_to_python_obj(item)
+        python_item = unpack_history(dynamo_obj_to_python_obj(item))
         output.append({
             "time": int(python_item["time"]),
             "query": python_item["query"],
@@ -197,7 +201,7 @@ def get_previous_summaries_route(event, user_data, body):
             body=output,
         )
     for item in response["Items"]:
-        python_item = dynamo_obj_to_python_obj(item)
+        python_item = unpack_history(dynamo_obj_to_python_obj(item))
         output.append({
             "time": int(python_item["time"]),
             "date": python_item["date"],
@@ -243,7 +247,7 @@ def delete_note_route(event, user_data, body):
         )
     full_path = PREFIX + filename
     s3.delete_object(Bucket=S3_BUCKET, Key=full_path)
-    trigger_ingest_lambdas(user_data)
+    trigger_ingest_lambdas(user_data, [full_path])
     return format_response(
         event=event,
         http_code=200,
@@ -262,9 +266,11 @@ def set_note_route(event, user_data, body):
             http_code=400,
             body="Bad input, must include filename with a .md extension",
         )
+    changed_keys = []
     old_filename = validate_filename(body.get("old_filename"))
     if old_filename and old_filename != filename:
         full_path = PREFIX + old_filename
+        changed_keys.append(full_path)
         response = s3.delete_object(Bucket=S3_BUCKET, Key=full_path)
         output['delete'] = old_filename
         if 'ResponseMetadata' in response and 'HTTPStatusCode' in response['ResponseMetadata'] and response['ResponseMetadata']['HTTPStatusCode'] == 204:
@@ -278,7 +284,8 @@ def set_note_route(event, user_data, body):
             body="Failed to write file",
         )
     output['write'] = filename
-    trigger_ingest_lambdas(user_data)
+    changed_keys.append(full_path)
+    trigger_ingest_lambdas(user_data, changed_keys)
     return format_response(
         event=event,
         http_code=200,
@@ -307,10 +314,15 @@ def generate_summary_gemini_route(event, user_data, body):
         resp = lambda_client.invoke(
             FunctionName="dnd-summary-gemini",
             InvocationType="RequestResponse",
-            Payload=json.dumps({"body": {"user": user_data['key2'], "date": date}})
+            # force skips the summary cache, so generating again gives a new draft
+            Payload=json.dumps(tracing.with_trace({"body": {
+                "user": user_data['key2'],
+                "date": date,
+                "force": body.get('force') is True,
+            }}))
         )
         response_body = json.loads(resp["Payload"].read().decode())
-        print(f'User: {user_data["key2"]} -- Date: {date} -- Response: {response_body["body"]}')
+        tracing.log("summary", user=user_data["key2"], date=date, response=response_body["body"])
         status_code = response_body["statusCode"]
         response_json = json.loads(response_body["body"])
         response_text = ''
@@ -318,7 +330,7 @@ def generate_summary_gemini_route(event, user_data, body):
             response_text += response_json['response']
         if 'message' in response_json:
             response_text += response_json['message']
-        # write to DB
+        # written to DB by flush_history once the response is built
         completion_data = {
             "key1": "summary",
             "key2": f'{user_data["key2"]}#{time_value}',
@@ -329,10 +341,7 @@ def generate_summary_gemini_route(event, user_data, body):
             "expiration": int(time.time()) + (60 * 60 * 24 * 30),
             "model": "Gemini",
         }
-        dynamo.put_item(
-            TableName=TABLE_NAME,
-            Item=python_obj_to_dynamo_obj(completion_data),
-        )
+        save_history(completion_data)
     except:
         traceback.print_exc()
     return format_response(
@@ -421,9 +430,9 @@ def replace_route(event, user_data, body):
 
     output = replace_text(pattern, replace_term)
 
-    write_back_cache(event)
+    changed_keys = write_back_cache(event)
 
-    trigger_ingest_lambdas(user_data)
+    trigger_ingest_lambdas(user_data, changed_keys)
 
     return format_response(
         event=event,
@@ -483,6 +492,7 @@ def load_cache(event):
         file_cache.pop(key, None)
 
 def write_back_cache(event):
+    written_keys = []
     paginator = s3.get_paginator("list_objects_v2")
     for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=PREFIX):
         for obj in page.get("Contents", []):
@@ -490,6 +500,8 @@ def write_back_cache(event):
             e_tag = obj["ETag"]
             if name in file_cache and file_cache[name]["ETag"] != e_tag:
                 s3.put_object(Bucket=S3_BUCKET, Key=obj["Key"], Body=file_cache[name]["body"].encode('utf-8'))
+                written_keys.append(obj["Key"])
+    return written_keys
 
 
 def find_text(pattern: re.Pattern):
@@ -528,17 +540,44 @@ def find_text(pattern: re.Pattern):
     return output
 
 
-def trigger_ingest_lambdas(user_data):
+def trigger_ingest_lambdas(user_data, keys):
+    if not keys:
+        return
+    if INGEST_SCHEDULER_ROLE_ARN:
+        schedule_ingest_lambdas(keys)
+        return
+    # Only the keys that changed are sent, the ingest lambdas skip the full rescan
+    payload = json.dumps(tracing.with_trace({"user": user_data["key2"], "keys": keys}))
     try:
         lambda_client.invoke(
             FunctionName="dnd-rag-ingest-gemini",
             InvocationType="Event",
-            Payload=json.dumps(user_data)
+            Payload=payload
         )
         lambda_client.invoke(
             FunctionName="dnd_rag_ingest",
             InvocationType="Event",
-            Payload=json.dumps(user_data)
+            Payload=payload
         )
     except:
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+
+
+def schedule_ingest_lambdas(keys):
+    # Saves from the editor come in bursts, so queue the keys and push each ingest's
+    # one-shot schedule out instead of invoking the ingest on every save
+    for function_name, function_arn in INGEST_FUNCTION_ARNS.items():
+        try:
+            ingest_queue.enqueue(dynamo, TABLE_NAME, function_name, keys)
+            ingest_queue.schedule_drain(
+                dynamo,
+                scheduler,
+                TABLE_NAME,
+                function_name,
+                function_arn,
+                INGEST_SCHEDULER_ROLE_ARN,
+                INGEST_QUIET_SECONDS,
+                INGEST_MAX_WAIT_SECONDS,
+            )
+        except:
+            traceback.print_exc()
\ No newline at end of file
@@ -8,6 +8,8 @@ import urllib
 import boto3
 from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 
+from dnd_core import lease, tracing
+
 ADMIN_PHONE = os.environ.get("ADMIN_PHONE")
 HTTPS_DOMAIN_NAME = os.environ.get("HTTPS_DOMAIN_NAME")
 DOMAIN_NAME = os.environ.get("DOMAIN_NAME")
@@ -16,16 +18,22 @@ TABLE_NAME = os.environ.get("DYNAMODB_TABLE_NAME")
 SMS_SQS_QUEUE_URL = os.environ.get("SMS_SQS_QUEUE_URL")
 SMS_SQS_QUEUE_ARN = os.environ.get("SMS_SQS_QUEUE_ARN")
 S3_BUCKET = os.environ.get("S3_BUCKET")
-STARTING_FILE = "dnd_rag_completion.STARTING"
+INGEST_SCHEDULER_ROLE_ARN = os.environ.get("INGEST_SCHEDULER_ROLE_ARN")
+INGEST_QUIET_SECONDS = int(os.environ.get("INGEST_QUIET_SECONDS", "60"))
+INGEST_MAX_WAIT_SECONDS = int(os.environ.get("INGEST_MAX_WAIT_SECONDS", "900"))
+INGEST_FUNCTION_ARNS = {
+    "dnd-rag-ingest-gemini": os.environ.get("DND_RAG_INGEST_GEMINI_ARN"),
+    "dnd_rag_ingest": os.environ.get("DND_RAG_INGEST_ARN"),
+}
 
 digits = "0123456789"
 lowercase_letters = "abcdefghijklmnopqrstuvwxyz"
 uppercase_letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-dynamo = boto3.client("dynamodb")
-sqs = boto3.client("sqs")
-scheduler = boto3.client("scheduler")
-lambda_client = boto3.client("lambda")
-s3 = boto3.client("s3")
+dynamo = tracing.instrument(boto3.client("dynamodb"))
+sqs = tracing.instrument(boto3.client("sqs"))
+scheduler = tracing.instrument(boto3.client("scheduler"))
+lambda_client = tracing.instrument(boto3.client("lambda"))
+s3 = tracing.instrument(boto3.client("s3"))
 
 
 def format_response(event, http_code, body, headers=None):
@@ -128,39 +136,50 @@ def path_starts_with(event, method, path):
 def authenticate(func):
     def wrapper_func(*args, **kwargs):
         event = args[0]
-        if "cookie" not in event["headers"]:
-            return format_response(event=event, http_code=403, body="No active session, please log in")
-        cookie_string = event["headers"]["cookie"]
-        cookie = parse_cookie(cookie_string)
-        body = parse_body(event["body"])
-        csrf_token = body["csrf"]
-        token_data = get_token(cookie)
-        if token_data is None or token_data["expiration"] < int(time.time()):
-            return format_response(
-                event=event,
-                http_code=403,
-                body="Your session has expired, please log in",
-            )
-        active_tokens = get_active_tokens(token_data["user"])
-        if token_data["key2"] not in active_tokens["tokens"].keys():
-            return format_response(
-                event=event,
-                http_code=403,
-                body="Your session has expired, please log in",
-            )
-        if csrf_token is None or token_data["csrf"] != csrf_token:
-            delete_token(token_data["key1"])
-            return format_response(
-                event=event,
-                http_code=403,
-                body="Your CSRF token is invalid, your session has expired, please re log in",
-            )
-        user_data = get_user_data(token_data["user"])
-        return func(event, user_data, body)
+        with tracing.span("auth"):
+            session = check_session(event)
+        if "statusCode" in session:
+            return session
+        return func(event, session["user_data"], session["body"])
 
     return wrapper_func
 
 
+def check_session(event):
+    """
+    Returns the user data and parsed body for a valid session, otherwise the error response to send.
+    """
+    if "cookie" not in event["headers"]:
+        return format_response(event=event, http_code=403, body="No active session, please log in")
+    cookie_string = event["headers"]["cookie"]
+    cookie = parse_cookie(cookie_string)
+    body = parse_body(event["body"])
+    csrf_token = body["csrf"]
+    token_data = get_token(cookie)
+    if token_data is None or token_data["expiration"] < int(time.time()):
+        return format_response(
+            event=event,
+            http_code=403,
+            body="Your session has expired, please log in",
+        )
+    active_tokens = get_active_tokens(token_data["user"])
+    if token_data["key2"] not in active_tokens["tokens"].keys():
+        return format_response(
+            event=event,
+            http_code=403,
+            body="Your session has expired, please log in",
+        )
+    if csrf_token is None or token_data["csrf"] != csrf_token:
+        delete_token(token_data["key1"])
+        return format_response(
+            event=event,
+            http_code=403,
+            body="Your CSRF token is invalid, your session has expired, please re log in",
+        )
+    user_data = get_user_data(token_data["user"])
+    return {"user_data": user_data, "body": body}
+
+
 @authenticate
 def clear_all_tokens_route(event, user_data, body):
     active_tokens = get_active_tokens(user_data["key2"])
@@ -198,8 +217,7 @@ def login_route(event):
     phone = body["phone"]
     submitted_otp = body["otp"]
 
-    print(phone)
-    print(submitted_otp)
+    tracing.log("login attempt", phone=phone)
 
     # get user data
     user_data = get_user_data(phone)
@@ -266,7 +284,6 @@ def otp_route(event):
     user_data = get_user_data(phone)
     if user_data is None:
         return format_response(event=event, http_code=401, body="User is not allowed to log in. Please ask an admin to create you an account.")
-    print(user_data)
 
     # generate and set OTP
     otp_data = get_otp(phone)
@@ -283,13 +300,12 @@ def otp_route(event):
             "phone": f"+1{phone}",
             "message": f"{otp_data['otp']} is your dnd.elliscode.com one-time passcode\n\n@dnd.elliscode.com #{otp_data['otp']}",
         }
-        print(message)
+        tracing.log("sending otp", phone=phone)
         sqs.send_message(
             QueueUrl=SMS_SQS_QUEUE_URL,
             MessageBody=json.dumps(message),
         )
         body_value = {"username": phone}
-    print(otp_data)
 
     return format_response(event=event, http_code=200, body=body_value)
 
@@ -392,23 +408,20 @@ def create_user_data(phone):
 def create_id(length):
     return "".join(secrets.choice(digits + lowercase_letters + uppercase_letters) for i in range(length))
 
-def s3_exists(bucket, key):
-    try:
-        s3.head_object(Bucket=bucket, Key=key)
-        return True
-    except:
-        pass
-    return False
-
-
 @authenticate
 def logged_in_check_route(event, user_data, body):
-    if not s3_exists(bucket=S3_BUCKET, key=STARTING_FILE):
+    # Warming up while an ingest runs would just load the snapshot it is about to replace
+    if not lease.is_held(dynamo, TABLE_NAME, "dnd_rag_ingest"):
         lambda_client.invoke(
             FunctionName="dnd_rag_completion",
             InvocationType="Event",
-            Payload=json.dumps({"body": {}})
+            Payload=json.dumps(tracing.with_trace({"body": {}}))
         )
+    lambda_client.invoke(
+        FunctionName="dnd-rag-completion-gemini",
+        InvocationType="Event",
+        Payload=json.dumps(tracing.with_trace({"body": {"warm": True}}))
+    )
     return format_response(
         event=event,
         http_code=200,
@@ -1,6 +1,7 @@
-import json
 import traceback
 
+from dnd_core import tracing
+
 from dnd_notes_lambda.utils import (
     otp_route,
     login_route,
@@ -25,17 +26,21 @@ from dnd_notes_lambda.notes import (
     replace_route,
     load_cache_route,
 )
+from dnd_notes_lambda.history import flush_history, write_history_records
 
 
+@tracing.traced
 def lambda_handler(event, context):
+    # History items queued by flush_history when HISTORY_QUEUE_URL is set, written here with retries
+    if "Records" in event:
+        return write_history_records(event)
     try:
-        print(json.dumps(event))
-        result = route(event)
-        print(result)
-        return result
+        return route(event)
     except Exception:
         traceback.print_exc()
         return format_response(event=event, http_code=500, body="Internal server error")
+    finally:
+        flush_history()
 
 
 # Only using POST because I want to prevent CORS preflight checks, and setting a
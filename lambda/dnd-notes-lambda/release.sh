@@ -1,5 +1,7 @@
 TIMESTAMP=$(date +%s)
 zip -vr ../../dnd-rag-api-lambda-release-${TIMESTAMP}.zip . -i "*.py"
+cd ../dnd_core
+zip -vr ../../dnd-rag-api-lambda-release-${TIMESTAMP}.zip dnd_core -i "*.py"
 cd ../../
 aws lambda update-function-code --function-name=dnd-notes-lambda --zip-file=fileb://dnd-rag-api-lambda-release-${TIMESTAMP}.zip --no-cli-pager
-cd lambda/dnd-notes-lambda
\ No newline at end of file
+cd lambda/dnd-notes-lambda
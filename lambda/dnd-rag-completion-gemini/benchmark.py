@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Measures lambda_handler overhead with the model call stubbed out, so only import,
+client/config construction, and request handling are timed.
+
+    uv run benchmark.py --cold 10 --warm 200
+
+Cold samples each run in a fresh interpreter (import + first request), warm
+samples repeat the request in one interpreter after a first call.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+EVENT = {"body": {"query": "How did neiro get to the desert with Jeffers?", "user": "5556152345"}}
+
+
+class StubResponse:
+    text = "stubbed answer"
+    candidates = []
+
+
+def stub_model(lambda_function):
+    models = lambda_function.get_client().models
+    models.generate_content = lambda **kwargs: StubResponse()
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def report(name, samples):
+    print(
+        f"{name:>5}: n={len(samples)} "
+        f"p50={percentile(samples, 50) * 1000:.2f}ms "
+        f"p95={percentile(samples, 95) * 1000:.2f}ms "
+        f"max={max(samples) * 1000:.2f}ms"
+    )
+
+
+def child():
+    # Runs in a fresh interpreter: time from import to the first finished request
+    start = time.perf_counter()
+    import lambda_function
+
+    # The stub has to hang off the real client, so its construction is part of the sample,
+    # which is also what a cold container pays before its first model call
+    stub_model(lambda_function)
+    result = lambda_function.lambda_handler(EVENT, None)
+    elapsed = time.perf_counter() - start
+    assert result["statusCode"] == 200, result
+    print(json.dumps({"seconds": elapsed}))
+
+
+def main(cold, warm):
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")
+
+    cold_samples = []
+    for _ in range(cold):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        cold_samples.append(json.loads(output.stdout.strip().splitlines()[-1])["seconds"])
+
+    import lambda_function
+
+    stub_model(lambda_function)
+    lambda_function.lambda_handler(EVENT, None)
+    warm_samples = []
+    for _ in range(warm):
+        start = time.perf_counter()
+        lambda_function.lambda_handler(EVENT, None)
+        warm_samples.append(time.perf_counter() - start)
+
+    if cold_samples:
+        report("cold", cold_samples)
+    if warm_samples:
+        report("warm", warm_samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cold", type=int, default=10, help="fresh interpreter samples")
+    parser.add_argument("--warm", type=int, default=200, help="in-process samples after the first request")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")
+        child()
+    else:
+        main(args.cold, args.warm)
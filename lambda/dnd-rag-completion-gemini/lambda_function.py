@@ -1,30 +1,79 @@
 import os
 import logging
-import sys
 import json
 
-from google import genai
-from google.genai import types
-from google.genai.errors import APIError
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from dnd_core import imports, logs, tracing
+from dnd_core.events import parse_body
+
 FILE_SEARCH_STORE_NAME = "fileSearchStores/dd-session-notes-rag-store-vksej7ft2qat"
 MODEL_NAME = "gemini-2.5-flash"
 LAMBDA_TASK_ROOT = os.environ.get("LAMBDA_TASK_ROOT")
 API_KEY = os.environ.get("GEMINI_API_KEY")
+# httpx drops idle connections after 5 seconds by default, which is shorter than the gap between questions
+KEEPALIVE_SECONDS = float(os.environ.get("GEMINI_KEEPALIVE_SECONDS", "300"))
+
+# google.genai is imported on first use so a cold start only pays for it when a query arrives,
+# and the client and config are then kept for every warm invocation of the container
+genai = None
+types = None
+errors = None
+client = None
+generate_config = None
+
+logger = logs.setup()
+
+def load_genai():
+    global genai, types, errors
+    if genai is None:
+        genai = imports.load("google.genai")
+        types = imports.load("google.genai.types")
+        errors = imports.load("google.genai.errors")
+
+
+def get_client():
+    global client
+    if client is None:
+        load_genai()
+        import httpx
+
+        client = genai.Client(
+            api_key=API_KEY,
+            http_options=types.HttpOptions(
+                client_args={"limits": httpx.Limits(keepalive_expiry=KEEPALIVE_SECONDS)},
+            ),
+        )
+    return client
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.INFO)
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
+def get_generate_config():
+    global generate_config
+    if generate_config is None:
+        load_genai()
+        rag_tool = types.Tool(
+            file_search=types.FileSearch(
+                file_search_store_names=[FILE_SEARCH_STORE_NAME]
+            )
+        )
+        generate_config = types.GenerateContentConfig(
+            tools=[rag_tool],
+            system_instruction=(
+                "You are a Dungeons & Dragons campaign assistant."
+                "The question you will answer relates to a DND campaign."
+                "There is no speaker or narrator, as this is a collective storytelling exercise."
+                "Files with the word 'transcript' in the filename are the least reliable"
+                "Files with the word 'chat-log' in the filename are only to be used to validate combat encounters"
+                "All other files are preferred"
+                "When answering questions about 'who', try to figure out which characters were involved"
+                "When formatting your answers, prefer markdown formatting and bulleted lists"
+                "When answering questions about abilities, reference the filenames with 'sheets' in them"
+                "If you deem a source to be unrelated, please ignore it and do not reference it in your output."
+            ),
+            temperature=2.0,
+        )
+    return generate_config
 
-if not logger.handlers:
-    logger.addHandler(handler)
 
-def extract_unique_file_titles(response: types.GenerateContentResponse) -> list[str]:
+def extract_unique_file_titles(response) -> list[str]:
     unique_file_titles = set()
     grounding_metadata = (
         response.candidates[0].grounding_metadata
@@ -39,20 +88,21 @@ def extract_unique_file_titles(response: types.GenerateContentResponse) -> list[
                 unique_file_titles.add(file_title)
     return list(unique_file_titles)
 
+@tracing.traced
 def lambda_handler(event, context):
     query = None
     try:
-        print(json.dumps(event))
-        print(context)
-
-        body = {}
-        if isinstance(event['body'], dict):
-            body = event['body']
-        elif event['body'].startswith("{"):
-            body = json.loads(event['body'])
+        body = parse_body(event)
 
         query = body.get('query')
         user = body.get('user')
+        if not query and body.get('warm'):
+            if API_KEY:
+                get_client()
+                get_generate_config()
+            output = {'statusCode': 201, 'body': json.dumps({"message": "Successful ping, lambda is now warm"})}
+            logging.info(json.dumps(output))
+            return output
         if not query:
             logging.warning("Request body missing 'query' field.")
             return {
@@ -69,33 +119,15 @@ def lambda_handler(event, context):
                 'body': json.dumps({"message": error_msg})
             }
 
-        client = genai.Client(api_key=API_KEY)
-        rag_tool = types.Tool(
-            file_search=types.FileSearch(
-                file_search_store_names=[FILE_SEARCH_STORE_NAME]
+        with tracing.span("model.client"):
+            gemini_client = get_client()
+            config = get_generate_config()
+        with tracing.span("model.generate"):
+            response = gemini_client.models.generate_content(
+                model=MODEL_NAME,
+                contents=[query],
+                config=config,
             )
-        )
-        config = types.GenerateContentConfig(
-            tools=[rag_tool],
-            system_instruction=(
-                "You are a Dungeons & Dragons campaign assistant."
-                "The question you will answer relates to a DND campaign."
-                "There is no speaker or narrator, as this is a collective storytelling exercise."
-                "Files with the word 'transcript' in the filename are the least reliable"
-                "Files with the word 'chat-log' in the filename are only to be used to validate combat encounters"
-                "All other files are preferred"
-                "When answering questions about 'who', try to figure out which characters were involved"
-                "When formatting your answers, prefer markdown formatting and bulleted lists"
-                "When answering questions about abilities, reference the filenames with 'sheets' in them"
-                "If you deem a source to be unrelated, please ignore it and do not reference it in your output."
-            ),
-            temperature=2.0,
-        )
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[query],
-            config=config,
-        )
         response_text = response.text
         logging.info("Gemini RAG call successful.")
 
@@ -110,15 +142,11 @@ def lambda_handler(event, context):
             })
         }
 
-    except APIError as e:
-        error_msg = f"Gemini API Error: {e}"
-        logging.error(error_msg)
-        return {
-            'statusCode': 200,
-            'body': json.dumps({"message": error_msg, "query": query})
-        }
     except Exception as e:
-        error_msg = f"An unexpected error occurred: {e}"
+        if errors is not None and isinstance(e, errors.APIError):
+            error_msg = f"Gemini API Error: {e}"
+        else:
+            error_msg = f"An unexpected error occurred: {e}"
         logging.error(error_msg)
         return {
             'statusCode': 200,
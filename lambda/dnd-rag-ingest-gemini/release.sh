@@ -23,6 +23,7 @@ docker cp "${CONTAINER}:/opt/python" dimg
 
 # Add handler
 cp lambda_function.py dimg/
+cp -r ../dnd_core/dnd_core dimg/
 
 # Zip lambda package
 (
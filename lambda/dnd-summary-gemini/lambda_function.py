@@ -1,19 +1,27 @@
 import os
 import logging
-import sys
 import boto3
 import json
-import traceback
+import hashlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from dnd_core import imports, logs, tracing
+from dnd_core.events import parse_body
+from dnd_core.storage import iter_objects
+
+# A cached summary is answered from S3 alone, only a model call imports google.genai
+genai = imports.lazy("google.genai")
+types = imports.lazy("google.genai.types")
+errors = imports.lazy("google.genai.errors")
 
-from google import genai
-from google.genai import types
-from google.genai.errors import APIError
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 MODEL_NAME = "gemini-2.5-flash"
 LAMBDA_TASK_ROOT = os.environ.get("LAMBDA_TASK_ROOT")
 API_KEY = os.environ.get("GEMINI_API_KEY")
 S3_BUCKET = os.environ.get("S3_BUCKET")
-s3 = boto3.client("s3")
+s3 = tracing.instrument(boto3.client("s3"))
 
 SYSTEM_INSTRUCTION = (
     "You are a DND session summarizer bot. "
@@ -23,25 +31,264 @@ SYSTEM_INSTRUCTION = (
 
 PROMPT_TEXT = "follow the instructions in instructions.md"
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+NOTES_PREFIX = "session-notes/"
+INSTRUCTIONS_KEY = f"{NOTES_PREFIX}instructions.md"
+SUMMARY_CACHE_PREFIX = "summary-cache/"
+# Section summaries live under their date, summary-cache/sections/<date>/<sha>.json, and the ones a new
+# summary no longer uses are deleted when it is written
+SECTION_CACHE_PREFIX = f"{SUMMARY_CACHE_PREFIX}sections/"
+
+# Inputs estimated above HIERARCHICAL_THRESHOLD_TOKENS are summarized section by section first
+HIERARCHICAL_THRESHOLD_TOKENS = int(os.environ.get("SUMMARY_HIERARCHICAL_THRESHOLD_TOKENS", "120000"))
+SECTION_TOKEN_BUDGET = int(os.environ.get("SUMMARY_SECTION_TOKENS", "24000"))
+MAP_CONCURRENCY = int(os.environ.get("SUMMARY_MAP_CONCURRENCY", "8"))
+# Close enough to Gemini's tokenizer for English prose to size sections without a count_tokens call
+CHARS_PER_TOKEN = 4
+
+SECTION_INSTRUCTION = (
+    "You are a DND session note taker. "
+    "You are given one section of a longer session file. "
+    "Condense it into detailed notes that keep every event in order, every character and NPC involved, "
+    "locations, items gained or lost, combat outcomes, and decisions the party made. "
+    "Do not add an introduction or a conclusion, a later step combines the sections."
+)
+
+# Both survive across warm invocations of the same container
+client = None
+instructions_cache = {"etag": None, "text": None}
 
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.INFO)
+logger = logs.setup()
+
+def get_client():
+    global client
+    if client is None:
+        print("✨ Initializing Gemini client...")
+        # The client will automatically pick up the GEMINI_API_KEY environment variable.
+        client = genai.Client()
+    return client
+
+
+def fetch_text(key, if_none_match=None):
+    """
+    Returns (etag, text) for the key, (etag, None) when it matches ``if_none_match``,
+    or (None, None) when the key does not exist.
+    """
+    params = {"Bucket": S3_BUCKET, "Key": key}
+    if if_none_match:
+        params["IfNoneMatch"] = if_none_match
+    try:
+        response = s3.get_object(**params)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code == "304":
+            return if_none_match, None
+        if code in ("NoSuchKey", "404"):
+            return None, None
+        raise
+    return response["ETag"], response["Body"].read().decode("utf-8")
+
+
+def fetch_instructions():
+    etag, text = fetch_text(INSTRUCTIONS_KEY, instructions_cache["etag"])
+    if etag is None:
+        raise FileNotFoundError(f"s3://{S3_BUCKET}/{INSTRUCTIONS_KEY} does not exist")
+    if text is not None:
+        instructions_cache["etag"] = etag
+        instructions_cache["text"] = text
+    else:
+        print(f"   - Reusing cached instructions.md ({etag})")
+    return {"name": "instructions.md", "etag": etag, "text": instructions_cache["text"]}
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
 
-if not logger.handlers:
-    logger.addHandler(handler)
+def fetch_session_file(name):
+    etag, text = fetch_text(f"{NOTES_PREFIX}sessions/{name}")
+    if etag is None:
+        print(f"⚠️ File not found: {name}. Skipping add...")
+    return {"name": name, "etag": etag, "text": text}
+
+
+def load_summary_inputs(date):
+    """
+    Fetches instructions.md and the session files for the date concurrently. The
+    session files are optional, missing ones come back with a None etag.
+    """
+    session_names = [
+        f"{date}-chat-log.md",
+        f"{date}-notes.md",
+        f"{date}-transcript.md",
+    ]
+    with ThreadPoolExecutor(max_workers=len(session_names) + 1) as executor:
+        instructions = executor.submit(fetch_instructions)
+        sessions = list(executor.map(fetch_session_file, session_names))
+        return [instructions.result()] + sessions
+
+
+def summary_fingerprint(inputs, mode):
+    h = hashlib.sha256()
+    h.update(f"{MODEL_NAME}\n{SYSTEM_INSTRUCTION}\n{PROMPT_TEXT}\n{mode}\n".encode("utf-8"))
+    for part in inputs:
+        h.update(f"{part['name']}={part['etag']}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_cached_summary(date, fingerprint):
+    _, text = fetch_text(f"{SUMMARY_CACHE_PREFIX}{date}.json")
+    if text is None:
+        return None
+    cached = json.loads(text)
+    if cached.get("fingerprint") != fingerprint:
+        return None
+    return cached["response"]
+
+
+def put_cached_summary(date, fingerprint, response_text):
+    s3.put_object(
+        Bucket=S3_BUCKET,
+        Key=f"{SUMMARY_CACHE_PREFIX}{date}.json",
+        Body=json.dumps({"fingerprint": fingerprint, "response": response_text}).encode("utf-8"),
+    )
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+def split_sections(text, budget_tokens):
+    """
+    Splits text into sections of at most ``budget_tokens`` (estimated), breaking on
+    blank lines where possible, then on lines, then anywhere.
+    """
+    budget_chars = budget_tokens * CHARS_PER_TOKEN
+    sections = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        pieces = [paragraph]
+        if len(paragraph) > budget_chars:
+            pieces = []
+            for line in paragraph.split("\n"):
+                pieces += [line[i : i + budget_chars] for i in range(0, max(len(line), 1), budget_chars)]
+        for piece in pieces:
+            if current and len(current) + len(piece) + 2 > budget_chars:
+                sections.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        sections.append(current)
+    return sections
+
+
+def usage_of(response):
+    usage = response.usage_metadata
+    return {
+        "prompt_tokens": (usage.prompt_token_count or 0) if usage else 0,
+        "output_tokens": (usage.candidates_token_count or 0) if usage else 0,
+    }
 
+
+def summarize_section(section):
+    """
+    Summarizes one section, reusing the stored result when the same text was
+    summarized before, so an edit only re-summarizes the sections it touched.
+    """
+    digest = hashlib.sha256(f"{MODEL_NAME}\n{SECTION_INSTRUCTION}\n{section['text']}".encode("utf-8")).hexdigest()
+    cache_key = f"{SECTION_CACHE_PREFIX}{section['date']}/{digest}.json"
+    _, cached = fetch_text(cache_key)
+    if cached is not None:
+        return {**json.loads(cached), "cached": True, "cache_key": cache_key}
+
+    with tracing.span("model.section"):
+        response = get_client().models.generate_content(
+            model=MODEL_NAME,
+            contents=[
+                f"""
+--- {section['name']} part {section['index'] + 1} of {section['count']} start ---
+{section['text']}
+--- {section['name']} part {section['index'] + 1} of {section['count']} end ---
+"""
+            ],
+            config=types.GenerateContentConfig(system_instruction=SECTION_INSTRUCTION, temperature=0.2),
+        )
+    result = {"summary": response.text, **usage_of(response)}
+    s3.put_object(Bucket=S3_BUCKET, Key=cache_key, Body=json.dumps(result).encode("utf-8"))
+    return {**result, "cached": False, "cache_key": cache_key}
+
+
+def prune_section_cache(date, keep):
+    """
+    Deletes the date's section summaries that the summary just written did not
+    use, the leftovers of edited sections.
+    """
+    stale = [
+        obj["Key"] for obj in iter_objects(s3, S3_BUCKET, f"{SECTION_CACHE_PREFIX}{date}/") if obj["Key"] not in keep
+    ]
+    for key in stale:
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+    if stale:
+        print(f"   - Deleted {len(stale)} stale section summaries")
+
+
+def build_hierarchical_prompt(date, inputs):
+    """
+    Map step: session files over the section budget are split and summarized in
+    parallel. Smaller files pass through untouched. The reduce prompt lists the
+    partial summaries in order and applies instructions.md last. Also returns
+    the section cache keys it used.
+    """
+    instructions = inputs[0]
+    sections = []
+    for part in inputs[1:]:
+        if part["text"] is None or estimate_tokens(part["text"]) <= SECTION_TOKEN_BUDGET:
+            continue
+        texts = split_sections(part["text"], SECTION_TOKEN_BUDGET)
+        sections += [
+            {"date": date, "name": part["name"], "index": i, "count": len(texts), "text": t}
+            for i, t in enumerate(texts)
+        ]
+
+    print(f"\n🗺️ Summarizing {len(sections)} sections...")
+    with ThreadPoolExecutor(max_workers=MAP_CONCURRENCY) as executor:
+        summaries = list(executor.map(summarize_section, sections))
+
+    map_tokens = {
+        "sections": len(sections),
+        "cached_sections": sum(1 for summary in summaries if summary["cached"]),
+        "input_tokens_estimate": sum(estimate_tokens(section["text"]) for section in sections),
+        "prompt_tokens": sum(summary["prompt_tokens"] for summary in summaries if not summary["cached"]),
+        "output_tokens": sum(summary["output_tokens"] for summary in summaries if not summary["cached"]),
+    }
+
+    prompt_parts = []
+    by_name = {}
+    for section, summary in zip(sections, summaries):
+        by_name.setdefault(section["name"], []).append(
+            f"--- {section['name']} part {section['index'] + 1} of {section['count']} summary ---\n{summary['summary']}"
+        )
+    for part in inputs[1:]:
+        if part["text"] is None:
+            continue
+        if part["name"] in by_name:
+            print(f"   - Adding summarized: {part['name']}")
+            body = "\n\n".join(by_name[part["name"]])
+        else:
+            print(f"   - Adding: {part['name']}")
+            body = part["text"]
+        prompt_parts.append(f"""
+--- {part['name']} start ---
+{body}
+--- {part['name']} end ---
+""")
+    prompt_parts.append(f"""
+--- {instructions['name']} start ---
+{instructions['text']}
+--- {instructions['name']} end ---
+""")
+    return prompt_parts, map_tokens, {summary["cache_key"] for summary in summaries}
+
+
+@tracing.traced
 def lambda_handler(event, context):
     date = None
-    file_paths = []
     try:
-        logger.info(json.dumps(event))
-        logger.info(context)
-
         if not API_KEY:
             error_msg = "GEMINI_API_KEY environment variable not set."
             logging.error(error_msg)
@@ -50,11 +297,7 @@ def lambda_handler(event, context):
                 'body': json.dumps({"message": error_msg})
             }
 
-        body = {}
-        if isinstance(event['body'], dict):
-            body = event['body']
-        elif event['body'].startswith("{"):
-            body = json.loads(event['body'])
+        body = parse_body(event)
 
         date = body.get('date')
         user = body.get('user')
@@ -65,58 +308,54 @@ def lambda_handler(event, context):
                 'body': json.dumps({"message": "Date is required in the request body."})
             }
         logging.info(f"Received Summary request. User: {user}. Date: '{date}'")
-        file_names = [
-            {"prefix": "", "name": f"instructions.md"},
-            {"prefix": "sessions/", "name": f"{date}-chat-log.md"},
-            {"prefix": "sessions/", "name": f"{date}-notes.md"},
-            {"prefix": "sessions/", "name": f"{date}-transcript.md"},
-        ]
 
-        print("✨ Initializing Gemini client...")
-        try:
-            # The client will automatically pick up the GEMINI_API_KEY environment variable.
-            client = genai.Client()
-        except Exception as e:
-            print(f"🛑 Error initializing client: {e}")
-            print("Please ensure your GEMINI_API_KEY environment variable is set.")
-            return
-
-        file_paths = []
-        for file_name in file_names:
-            if LAMBDA_TASK_ROOT:
-                file_path = f"/tmp/{file_name['name']}"
-            else:
-                file_path = f"{file_name['name']}"
-            s3.download_file(Bucket=S3_BUCKET, Key=f"session-notes/{file_name['prefix']}{file_name['name']}", Filename=file_path)
-            file_paths.append(file_path)
-
-        # --- 1. Upload Files ---
-        print("\n⬆️ Uploading files...")
-
-        # We will also track the files we need to include in the final prompt.
-        prompt_parts = []
-
-        for file_path in file_paths:
-            if not os.path.exists(file_path):
-                print(f"⚠️ File not found: {file_path}. Skipping add...")
-                continue
-
-            print(f"   - Adding: {file_path}")
-
-            # Pass the mime_type argument to the upload call
-
-            # Add the file reference itself to the list of prompt parts
-            with open(file_path, 'r') as f:
+        # --- 1. Load Files ---
+        print("\n⬇️ Loading files...")
+        inputs = load_summary_inputs(date)
+        if all(part["etag"] is None for part in inputs[1:]):
+            print("\n🛑 No session files were found. Aborting.")
+            return {
+                'statusCode': 404,
+                'body': json.dumps({"message": f"No session files exist for {date}", "date": date})
+            }
+
+        mode = body.get('mode', 'auto')
+        if mode == 'auto':
+            total_tokens = sum(estimate_tokens(part["text"]) for part in inputs if part["text"] is not None)
+            mode = 'hierarchical' if total_tokens > HIERARCHICAL_THRESHOLD_TOKENS else 'single'
+        logging.info(f"Summary mode: {mode}")
+
+        # The inputs are unchanged since the last summary, so that summary is still the answer
+        fingerprint = summary_fingerprint(inputs, mode)
+        cached_response = None if body.get('force') else get_cached_summary(date, fingerprint)
+        if cached_response is not None:
+            logging.info("Inputs unchanged, returning the cached summary.")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    "date": date,
+                    "response": cached_response,
+                    "model": "Gemini",
+                    "cached": True,
+                })
+            }
+
+        tokens = {}
+        section_keys = set()
+        if mode == 'hierarchical':
+            prompt_parts, tokens["map"], section_keys = build_hierarchical_prompt(date, inputs)
+        else:
+            prompt_parts = []
+            for part in inputs:
+                if part["text"] is None:
+                    continue
+                print(f"   - Adding: {part['name']}")
                 prompt_parts.append(f"""
---- {os.path.basename(file_path)} start ---
-{f.read()}
---- {os.path.basename(file_path)} end ---
+--- {part['name']} start ---
+{part['text']}
+--- {part['name']} end ---
 """)
 
-        if not prompt_parts:
-            print("\n🛑 No files were successfully read. Aborting.")
-            return
-
         # --- 2. Construct the Full Prompt and Call the API ---
         # Append the final text prompt to the parts list
         prompt_parts.append(PROMPT_TEXT)
@@ -129,16 +368,18 @@ def lambda_handler(event, context):
             temperature=2.0,
         )
 
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt_parts,
-            config=config,
-        )
+        with tracing.span("model.summary"):
+            response = get_client().models.generate_content(
+                model=MODEL_NAME,
+                contents=prompt_parts,
+                config=config,
+            )
         response_text = response.text
-        logging.info("Gemini Summary call successful.")
+        tokens["reduce"] = usage_of(response)
+        logging.info(f"Gemini Summary call successful. Tokens: {json.dumps(tokens)}")
 
-        for file_path in file_paths:
-            os.remove(file_path)
+        put_cached_summary(date, fingerprint, response_text)
+        prune_section_cache(date, section_keys)
 
         return {
             'statusCode': 200,
@@ -146,17 +387,19 @@ def lambda_handler(event, context):
                 "date": date,
                 "response": response_text,
                 "model": "Gemini",
+                "mode": mode,
+                "tokens": tokens,
             })
         }
 
-    except APIError as e:
-        error_msg = f"Gemini API Error: {e}"
-        logging.error(error_msg)
     except Exception as e:
-        error_msg = f"An unexpected error occurred: {e}"
+        # Not errors.APIError: touching the lazy module retries a google.genai import that may be what failed
+        genai_errors = sys.modules.get("google.genai.errors")
+        if genai_errors is not None and isinstance(e, genai_errors.APIError):
+            error_msg = f"Gemini API Error: {e}"
+        else:
+            error_msg = f"An unexpected error occurred: {e}"
         logging.error(error_msg)
-    for file_path in file_paths:
-        os.remove(file_path)
     return {
         'statusCode': 200,
         'body': json.dumps({"message": error_msg, "date": date})
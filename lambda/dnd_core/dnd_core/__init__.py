@@ -0,0 +1,30 @@
+"""
+Helpers shared between the dnd lambdas. Submodules are imported on first use,
+so ``import dnd_core`` is free and a lambda only pays for the helpers it touches.
+"""
+import importlib
+
+SUBMODULES = (
+    "deadline",
+    "documents",
+    "events",
+    "imports",
+    "ingest_queue",
+    "lease",
+    "logs",
+    "storage",
+    "tracing",
+    "vector_index",
+)
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        module = importlib.import_module(f"{__name__}.{name}")
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(SUBMODULES))
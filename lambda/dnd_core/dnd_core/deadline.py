@@ -0,0 +1,37 @@
+import json
+
+from dnd_core import tracing
+
+
+class Deadline:
+    """
+    The time a Lambda invocation has left. Long runs check ``near`` between
+    units of work, and hand what is left to a fresh invocation of themselves
+    while there is still ``reserve_ms`` to save their progress. Without a
+    context (a local run) the deadline is never near.
+    """
+
+    def __init__(self, context, reserve_ms):
+        self.context = context
+        self.reserve_ms = reserve_ms
+
+    def remaining_ms(self):
+        if self.context is None:
+            return None
+        return self.context.get_remaining_time_in_millis()
+
+    def near(self):
+        remaining = self.remaining_ms()
+        return remaining is not None and remaining < self.reserve_ms
+
+
+def continue_later(lambda_client, context, payload=None):
+    """
+    Invokes this function again asynchronously, on the same trace. A drain is
+    enough to pick up both queued keys and a saved checkpoint.
+    """
+    lambda_client.invoke(
+        FunctionName=context.function_name,
+        InvocationType="Event",
+        Payload=json.dumps(tracing.with_trace(payload or {"drain": True})),
+    )
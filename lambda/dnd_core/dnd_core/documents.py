@@ -0,0 +1,27 @@
+import re
+
+# sessions/<date>-notes.md, sessions/<date>-transcript.md, sessions/<date>-chat-log.md
+SESSION_FILE = re.compile(r"(?:^|/)(\d{4}-\d{2}-\d{2})-(notes|transcript|chat-log)\.md$")
+DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+DOC_TYPES = ("notes", "transcript", "chat-log", "sheets", "instructions", "other")
+
+
+def classify(file_name):
+    """
+    Document type and session date of a notes file, from its name relative to
+    the notes prefix. Files without a date get an empty one, Chroma metadata
+    cannot hold None.
+    """
+    match = SESSION_FILE.search(file_name)
+    if match:
+        return {"doc_type": match.group(2), "date": match.group(1)}
+    name = file_name.rsplit("/", 1)[-1]
+    if "sheets" in name:
+        doc_type = "sheets"
+    elif name == "instructions.md":
+        doc_type = "instructions"
+    else:
+        doc_type = "other"
+    date = DATE.search(name)
+    return {"doc_type": doc_type, "date": date.group(0) if date else ""}
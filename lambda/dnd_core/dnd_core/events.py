@@ -0,0 +1,69 @@
+import json
+import time
+import urllib.parse
+
+NOTES_PREFIX = "session-notes/"
+
+# Sentinel key meaning "rescan everything under the prefix"
+FULL_SCAN = "*"
+
+
+def parse_body(event):
+    body = event.get("body")
+    if isinstance(body, dict):
+        return body
+    if isinstance(body, str) and body.startswith("{"):
+        return json.loads(body)
+    return {}
+
+
+def changed_keys(event, prefix=NOTES_PREFIX):
+    """
+    Collects the S3 keys an ingest invocation should process.
+
+    Keys can come from the notes API (a top level or body ``keys`` list) or from
+    S3 event notification ``Records``. Returns None when the event carries
+    neither, which callers treat as a request for a full rescan.
+    """
+    event = event or {}
+    body = parse_body(event)
+    if "Records" not in event and "keys" not in event and "keys" not in body:
+        return None
+
+    requested = []
+    for record in event.get("Records") or []:
+        if "s3" in record:
+            requested.append(urllib.parse.unquote_plus(record["s3"]["object"]["key"]))
+    requested += event.get("keys") or []
+    requested += body.get("keys") or []
+
+    keys = set()
+    for key in requested:
+        if key == FULL_SCAN:
+            keys.add(FULL_SCAN)
+        elif key.startswith(prefix) and key.endswith(".md"):
+            keys.add(key)
+    return keys
+
+
+def fake_s3_event(bucket, keys, event_name="ObjectCreated:Put"):
+    """
+    Builds an S3 event notification like the one S3 delivers to a lambda, for
+    driving the ingest handlers locally.
+    """
+    now = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+    return {
+        "Records": [
+            {
+                "eventVersion": "2.1",
+                "eventSource": "aws:s3",
+                "eventTime": now,
+                "eventName": event_name,
+                "s3": {
+                    "bucket": {"name": bucket, "arn": f"arn:aws:s3:::{bucket}"},
+                    "object": {"key": urllib.parse.quote_plus(key, safe="/")},
+                },
+            }
+            for key in keys
+        ]
+    }
@@ -0,0 +1,105 @@
+"""
+Deferred imports for the heavy SDKs (chromadb, openai, tiktoken, google.genai).
+
+    chromadb = imports.lazy("chromadb")
+
+binds a placeholder that imports the real module on first attribute access, so
+a cold start only pays for an SDK when a request actually uses it. The import
+is recorded as an "import.<module>" span on the request that triggered it.
+
+Run as a script to profile what a lambda imports at cold start:
+
+    python -m dnd_core.imports ../dnd_rag_ingest
+"""
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+from dnd_core import tracing
+
+# Milliseconds each deferred module took to import in this container
+timings = {}
+
+
+def load(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    with tracing.span(f"import.{name}"):
+        module = importlib.import_module(name)
+    timings[name] = (time.perf_counter() - start) * 1000
+    print(f"Imported {name} in {timings[name]:.0f}ms")
+    return module
+
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = load(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy(name):
+    return LazyModule(name)
+
+
+def profile(directory, module="lambda_function"):
+    """
+    Imports ``module`` from ``directory`` in a fresh interpreter with -X importtime
+    and returns ({top level package: self ms}, total ms).
+    """
+    # The lambda's own directory and this checkout of dnd_core, as in the deployment package
+    path = [str(directory), os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get("PYTHONPATH")]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, path)))
+    # Module level boto3 clients need a region, none of them make a call at import
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=directory,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(errors[-1] if errors else f"exit code {result.returncode}")
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = (part.strip() for part in line.removeprefix("import time:").split("|"))
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+    return packages, sum(packages.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start import cost of a lambda, by top level package")
+    parser.add_argument("directories", nargs="+", help="lambda directories containing lambda_function.py")
+    parser.add_argument("--top", type=int, default=15, help="packages to list per lambda")
+    args = parser.parse_args()
+    for directory in args.directories:
+        try:
+            packages, total = profile(os.path.abspath(directory))
+        except RuntimeError as e:
+            print(f"{directory}: import failed, {e}")
+            continue
+        print(f"{directory}: {total:.0f}ms")
+        for package, ms in sorted(packages.items(), key=lambda item: -item[1])[: args.top]:
+            print(f"  {package:<30} {ms:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
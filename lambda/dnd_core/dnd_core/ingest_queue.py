@@ -0,0 +1,165 @@
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+# Queued keys live in the notes table as {"key1": "ingest_queue#<consumer>", "key2": <s3 key>, "time": <ns>}.
+# Re-queueing a key just bumps its time, so a burst of edits to one note is one entry.
+QUEUE_KEY = "ingest_queue"
+DEBOUNCE_KEY = "ingest_debounce"
+QUEUE_TTL_SECONDS = 7 * 24 * 60 * 60
+BATCH_WRITE_LIMIT = 25
+# UnprocessedItems are retried with jittered exponential backoff, enqueue runs on the notes API's request path
+BATCH_WRITE_ATTEMPTS = 5
+BATCH_WRITE_BACKOFF_SECONDS = 0.05
+
+
+def queue_key(consumer):
+    return f"{QUEUE_KEY}#{consumer}"
+
+
+def enqueue(dynamo, table, consumer, keys):
+    """
+    Records changed keys for an ingest consumer. The next drain of that consumer
+    picks them up, whether it is already running or scheduled for later.
+    """
+    now = time.time_ns()
+    expiration = int(time.time()) + QUEUE_TTL_SECONDS
+    requests = [
+        {
+            "PutRequest": {
+                "Item": {
+                    "key1": {"S": queue_key(consumer)},
+                    "key2": {"S": key},
+                    "time": {"N": str(now)},
+                    "expiration": {"N": str(expiration)},
+                }
+            }
+        }
+        for key in sorted(keys)
+    ]
+    for i in range(0, len(requests), BATCH_WRITE_LIMIT):
+        pending = {table: requests[i : i + BATCH_WRITE_LIMIT]}
+        for attempt in range(BATCH_WRITE_ATTEMPTS):
+            if attempt:
+                time.sleep(random.uniform(0, BATCH_WRITE_BACKOFF_SECONDS * 2**attempt))
+            pending = dynamo.batch_write_item(RequestItems=pending).get("UnprocessedItems")
+            if not pending:
+                break
+        else:
+            raise RuntimeError(f"Could not queue {len(pending[table])} keys for {consumer}, DynamoDB is throttling")
+    print(f"Queued {len(keys)} keys for {consumer}")
+
+
+def read(dynamo, table, consumer):
+    """
+    Returns every queued key for the consumer mapped to the time it was queued.
+    """
+    queued = {}
+    paginator = dynamo.get_paginator("query")
+    for page in paginator.paginate(
+        TableName=table,
+        KeyConditionExpression="key1 = :k",
+        ExpressionAttributeValues={":k": {"S": queue_key(consumer)}},
+        ConsistentRead=True,
+    ):
+        for item in page.get("Items", []):
+            queued[item["key2"]["S"]] = item["time"]["N"]
+    return queued
+
+
+def ack(dynamo, table, consumer, queued):
+    """
+    Removes processed keys from the queue. A key that was queued again while it
+    was being processed keeps its newer entry, so the next read returns it.
+    """
+    for key, queued_time in queued.items():
+        try:
+            dynamo.delete_item(
+                TableName=table,
+                Key={"key1": {"S": queue_key(consumer)}, "key2": {"S": key}},
+                ConditionExpression="#t = :t",
+                ExpressionAttributeNames={"#t": "time"},
+                ExpressionAttributeValues={":t": {"N": queued_time}},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+
+def has_pending(dynamo, table, consumer):
+    response = dynamo.query(
+        TableName=table,
+        KeyConditionExpression="key1 = :k",
+        ExpressionAttributeValues={":k": {"S": queue_key(consumer)}},
+        ConsistentRead=True,
+        Limit=1,
+    )
+    return bool(response.get("Items"))
+
+
+def schedule_name(consumer):
+    return re.sub(r"[^0-9A-Za-z_.-]", "-", f"{consumer}-debounce")
+
+
+def schedule_drain(dynamo, scheduler, table, consumer, target_arn, role_arn, quiet_seconds, max_wait_seconds):
+    """
+    Pushes the consumer's one-shot drain schedule out to ``quiet_seconds`` from
+    now, so a burst of edits produces a single ingest after the burst ends. The
+    first edit of a burst opens a window, and the schedule is never pushed past
+    ``max_wait_seconds`` after it so a long editing session still gets ingested.
+    """
+    now = int(time.time())
+    window_start = now
+    try:
+        dynamo.put_item(
+            TableName=table,
+            Item={
+                "key1": {"S": DEBOUNCE_KEY},
+                "key2": {"S": consumer},
+                "first": {"N": str(now)},
+                "expiration": {"N": str(now + QUEUE_TTL_SECONDS)},
+            },
+            ConditionExpression="attribute_not_exists(key2)",
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        window_start = int(e.response.get("Item", {}).get("first", {}).get("N", now))
+
+    fire_at = min(now + quiet_seconds, window_start + max_wait_seconds)
+    fire_at = max(fire_at, now + 1)
+    params = {
+        "Name": schedule_name(consumer),
+        "ScheduleExpression": f"at({datetime.fromtimestamp(fire_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')})",
+        "ScheduleExpressionTimezone": "UTC",
+        "FlexibleTimeWindow": {"Mode": "OFF"},
+        "ActionAfterCompletion": "DELETE",
+        "Target": {
+            "Arn": target_arn,
+            "RoleArn": role_arn,
+            "Input": json.dumps({"drain": True}),
+        },
+    }
+    try:
+        scheduler.update_schedule(**params)
+    except scheduler.exceptions.ResourceNotFoundException:
+        try:
+            scheduler.create_schedule(**params)
+        except scheduler.exceptions.ConflictException:
+            # Another save created it between our update and create
+            scheduler.update_schedule(**params)
+
+
+def close_debounce_window(dynamo, table, consumer):
+    """
+    Called by the consumer when it starts draining, so the next edit opens a new window.
+    """
+    dynamo.delete_item(
+        TableName=table,
+        Key={"key1": {"S": DEBOUNCE_KEY}, "key2": {"S": consumer}},
+    )
@@ -0,0 +1,121 @@
+import secrets
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Leases live in the notes table as {"key1": "lease", "key2": <name>, "owner": ..., "expires": <ms>}.
+# A holder that dies simply stops renewing, and the lease is free again once it expires.
+LEASE_KEY = "lease"
+DEFAULT_TTL_SECONDS = 120
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class Lease:
+    """
+    A named mutual exclusion lease backed by a DynamoDB conditional write.
+
+    ``acquire`` succeeds only if nobody holds the lease or the holder let it
+    expire. While held, a background thread renews it every ``ttl / 4``
+    seconds. If a renewal finds someone else took over, ``lost`` is set and the
+    holder should stop before doing more work.
+    """
+
+    def __init__(self, dynamo, table, name, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.dynamo = dynamo
+        self.table = table
+        self.name = name
+        self.ttl_ms = ttl_seconds * 1000
+        self.owner = secrets.token_hex(16)
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _key(self):
+        return {"key1": {"S": LEASE_KEY}, "key2": {"S": self.name}}
+
+    def acquire(self):
+        now = now_ms()
+        try:
+            self.dynamo.put_item(
+                TableName=self.table,
+                Item={
+                    **self._key(),
+                    "owner": {"S": self.owner},
+                    "expires": {"N": str(now + self.ttl_ms)},
+                    # DynamoDB TTL cleans up leases nobody comes back for
+                    "expiration": {"N": str((now + self.ttl_ms) // 1000 + 24 * 60 * 60)},
+                },
+                ConditionExpression="attribute_not_exists(key2) OR expires < :now",
+                ExpressionAttributeValues={":now": {"N": str(now)}},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        self.lost = False
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._renew_until_stopped, daemon=True)
+        self._heartbeat.start()
+        print(f"Acquired lease {self.name} as {self.owner}")
+        return True
+
+    def renew(self):
+        try:
+            self.dynamo.update_item(
+                TableName=self.table,
+                Key=self._key(),
+                UpdateExpression="SET expires = :expires",
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={
+                    ":expires": {"N": str(now_ms() + self.ttl_ms)},
+                    ":owner": {"S": self.owner},
+                },
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            print(f"Lost lease {self.name}, another holder took over")
+            self.lost = True
+
+    def _renew_until_stopped(self):
+        while not self._stop.wait(self.ttl_ms / 4000):
+            try:
+                self.renew()
+            except Exception as e:
+                # A missed heartbeat is fine as long as a later one lands before expiry
+                print(f"Failed to renew lease {self.name}: {e}")
+            if self.lost:
+                return
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        try:
+            self.dynamo.delete_item(
+                TableName=self.table,
+                Key=self._key(),
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":owner": {"S": self.owner}},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        print(f"Released lease {self.name}")
+
+
+def is_held(dynamo, table, name):
+    response = dynamo.get_item(
+        TableName=table,
+        Key={"key1": {"S": LEASE_KEY}, "key2": {"S": name}},
+        ConsistentRead=True,
+    )
+    item = response.get("Item")
+    return item is not None and int(item["expires"]["N"]) > now_ms()
@@ -0,0 +1,19 @@
+import logging
+import sys
+
+FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+def setup(level=logging.INFO):
+    """
+    Points the root logger at stdout, where Lambda picks it up. Safe to call on
+    every import of a handler module, the handler is only added once.
+    """
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setLevel(level)
+        handler.setFormatter(logging.Formatter(FORMAT))
+        logger.addHandler(handler)
+    return logger
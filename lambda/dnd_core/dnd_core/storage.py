@@ -0,0 +1,31 @@
+import os
+import shutil
+import zipfile
+
+
+def zip_directory(folder, zip_path):
+    # make_archive wants the path without the extension
+    shutil.make_archive(zip_path.removesuffix(".zip"), "zip", folder)
+    print(f"Zipped {folder} → {zip_path}")
+    return zip_path
+
+
+def unzip_file(zip_path, extract_to):
+    os.makedirs(extract_to, exist_ok=True)
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        zip_ref.extractall(extract_to)
+    print(f"Unzipped {zip_path} → {extract_to}")
+
+
+def iter_objects(s3, bucket, prefix, suffix=None):
+    """
+    Yields every object listed under the prefix, following pagination and
+    skipping "directory" placeholders. ``suffix`` keeps only keys ending with it.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/") or (suffix and not key.endswith(suffix)):
+                continue
+            yield obj
@@ -0,0 +1,206 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Fraction of requests whose payloads and span breakdown are logged. Metrics are emitted for every request.
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+LOG_PAYLOAD_CHARS = int(os.environ.get("LOG_PAYLOAD_CHARS", "2000"))
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "dnd")
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+
+# A lambda container handles one request at a time, so the request being traced is module state.
+# Worker threads (thread pools, s3transfer) record into it too, hence the lock on every update.
+current = None
+cold_start = True
+
+
+class Trace:
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.dimensions = {}
+        self.spans = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def record(self, name, ms):
+        with self.lock:
+            count, total = self.spans.get(name, (0, 0.0))
+            self.spans[name] = (count + 1, total + ms)
+
+    def metrics(self):
+        """
+        Span totals rolled up by category, "dynamodb.GetItem" and "dynamodb.Query"
+        both count towards "dynamodb".
+        """
+        totals = {}
+        with self.lock:
+            for name, (_, ms) in self.spans.items():
+                category = name.split(".")[0]
+                totals[category] = totals.get(category, 0.0) + ms
+        return totals
+
+
+def truncate(text, limit=None):
+    limit = LOG_PAYLOAD_CHARS if limit is None else limit
+    if not isinstance(text, str):
+        text = json.dumps(text, default=str)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
+
+
+def redact(event):
+    # Session cookies stay out of the logs
+    if not isinstance(event, dict):
+        return event
+    event = dict(event)
+    for field in ("headers", "multiValueHeaders"):
+        if isinstance(event.get(field), dict):
+            event[field] = {k: v for k, v in event[field].items() if k.lower() != "cookie"}
+    return event
+
+
+def log(message, **fields):
+    """
+    Structured log line tagged with the trace id. Dropped for unsampled requests,
+    use print for anything that must always be logged.
+    """
+    if current is not None and not current.sampled:
+        return
+    line = {"message": message, **{k: truncate(v) for k, v in fields.items()}}
+    if current is not None:
+        line["trace_id"] = current.trace_id
+    print(json.dumps(line))
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current is not None:
+            current.record(name, (time.perf_counter() - start) * 1000)
+
+
+def _before_call(model, context, **kwargs):
+    context["trace_start"] = time.perf_counter()
+
+
+def _after_call(model, context, **kwargs):
+    start = context.get("trace_start")
+    if current is not None and start is not None:
+        current.record(f"{model.service_model.service_name}.{model.name}", (time.perf_counter() - start) * 1000)
+
+
+def instrument(client):
+    """
+    Times every API call a boto3 client makes (retries included) as a
+    "<service>.<Operation>" span. Returns the client so it can wrap the constructor.
+    """
+    events = client.meta.events
+    events.register("before-call.*.*", _before_call)
+    events.register("after-call.*.*", _after_call)
+    events.register("after-call-error.*.*", _after_call)
+    return client
+
+
+def with_trace(payload):
+    """
+    Adds the current trace to a lambda invoke payload so the callee logs under the same id.
+    """
+    if current is None:
+        return payload
+    return {**payload, "trace": {"id": current.trace_id, "sampled": current.sampled}}
+
+
+def start(event, context):
+    global current
+    event = event if isinstance(event, dict) else {}
+    parent = event.get("trace") or {}
+    trace_id = (
+        parent.get("id")
+        or event.get("requestContext", {}).get("requestId")
+        or getattr(context, "aws_request_id", None)
+        or uuid.uuid4().hex
+    )
+    sampled = parent.get("sampled")
+    if sampled is None:
+        sampled = random.random() < LOG_SAMPLE_RATE
+    current = Trace(trace_id, sampled)
+    return current
+
+
+def finish(status=None):
+    """
+    Prints the request's metrics in CloudWatch embedded metric format, which
+    CloudWatch turns into metrics straight from the log line.
+    """
+    global current, cold_start
+    trace = current
+    if trace is None:
+        return
+    current = None
+    totals = trace.metrics()
+    totals["duration"] = (time.perf_counter() - trace.start) * 1000
+    dimension_sets = [["function"]]
+    if trace.dimensions:
+        dimension_sets.append(["function", *trace.dimensions])
+    line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": dimension_sets,
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in totals]
+                    + [{"Name": "cold_start", "Unit": "Count"}],
+                }
+            ],
+        },
+        "function": FUNCTION_NAME,
+        **trace.dimensions,
+        **{name: round(ms, 2) for name, ms in totals.items()},
+        "cold_start": int(cold_start),
+        "trace_id": trace.trace_id,
+        "status": status,
+    }
+    if trace.sampled:
+        line["spans"] = {name: {"count": count, "ms": round(ms, 2)} for name, (count, ms) in trace.spans.items()}
+    cold_start = False
+    print(json.dumps(line))
+
+
+def traced(handler):
+    """
+    Wraps a lambda handler: starts a trace from the event, logs the truncated event
+    and result for sampled requests, and emits the request metrics when it returns.
+    API Gateway events get the route as an extra metric dimension.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        trace = start(event, context)
+        if isinstance(event, dict) and "path" in event:
+            trace.dimensions["route"] = event["path"].rstrip("/") or "/"
+        log("event", event=redact(event))
+        status = None
+        try:
+            result = handler(event, context)
+            if isinstance(result, dict):
+                status = result.get("statusCode")
+            log("result", result=result)
+            return result
+        except Exception:
+            status = 500
+            raise
+        finally:
+            finish(status)
+
+    return wrapper
@@ -0,0 +1,319 @@
+"""
+A read-only copy of the Chroma collection for answering queries without Chroma.
+
+The ingest exports every chunk's embedding into one float32 matrix saved as an
+uncompressed ``vectors.npy``, with ``chunks.json`` next to it holding the text
+and metadata of each row. Both are uploaded under a new snapshot id, then
+``vector-index/current.json`` is pointed at it, so a reader always gets a
+matching pair. The completion lambda memory-maps the matrix, so opening an
+index costs the download and a page-in of whatever the dot products touch.
+
+A quantized index adds ``vectors.int8.npy`` and ``scales.npy``: every vector
+scaled into int8 with its own scale. Searches scan the int8 matrix, a quarter
+of the bytes, for a shortlist of candidates and re-score only those rows
+against the float32 matrix.
+
+Rows are grouped by document type and session date, and the sidecar lists
+each group's row range, so a search filtered to one session or to the
+character sheets only reads that slice of the matrices.
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from dnd_core.documents import classify
+
+INDEX_PREFIX = "vector-index/"
+CURRENT_KEY = f"{INDEX_PREFIX}current.json"
+VECTORS_FILE = "vectors.npy"
+QUANTIZED_FILE = "vectors.int8.npy"
+SCALES_FILE = "scales.npy"
+CHUNKS_FILE = "chunks.json"
+# The snapshot before the current one stays in S3 for readers that are still downloading it
+KEEP_SNAPSHOTS = 2
+# Candidates re-scored in float32 per result asked for
+RESCORE_FACTOR = 4
+# Rows of the int8 matrix converted to float32 at a time, bounds the scratch memory of a scan
+SCAN_BLOCK_ROWS = 8192
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors):
+    """
+    Symmetric int8 quantization with one scale per row: row ≈ quantized * scale.
+    """
+    scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def partition_key(meta):
+    return meta.get("doc_type", ""), meta.get("date", "")
+
+
+def write(folder, ids, vectors, documents, metadatas, model, embed_dimensions=None, quantized=False):
+    """
+    Writes an index into ``folder``. ``embed_dimensions`` is the dimensions option
+    the vectors were requested with, queries must be embedded with the same one.
+    """
+    os.makedirs(folder, exist_ok=True)
+    metadatas = [meta or {} for meta in metadatas]
+    # One contiguous run of rows per (doc_type, date), ids keep the order stable inside a run
+    order = sorted(range(len(ids)), key=lambda i: (partition_key(metadatas[i]), ids[i]))
+    vectors = normalize(vectors)[order] if len(ids) else np.zeros((0, 0), dtype=np.float32)
+    np.save(os.path.join(folder, VECTORS_FILE), np.ascontiguousarray(vectors), allow_pickle=False)
+    files = [VECTORS_FILE]
+    if quantized:
+        int8_vectors, scales = quantize(vectors)
+        np.save(os.path.join(folder, QUANTIZED_FILE), int8_vectors, allow_pickle=False)
+        np.save(os.path.join(folder, SCALES_FILE), scales, allow_pickle=False)
+        files += [QUANTIZED_FILE, SCALES_FILE]
+
+    chunks = [{"id": ids[i], "text": documents[i], **metadatas[i]} for i in order]
+    partitions = []
+    for row, chunk in enumerate(chunks):
+        doc_type, date = partition_key(chunk)
+        if partitions and (partitions[-1]["doc_type"], partitions[-1]["date"]) == (doc_type, date):
+            partitions[-1]["end"] = row + 1
+        else:
+            partitions.append({"doc_type": doc_type, "date": date, "start": row, "end": row + 1})
+    sidecar = {
+        "model": model,
+        "dimensions": int(vectors.shape[1]),
+        "embed_dimensions": embed_dimensions,
+        "quantized": quantized,
+        "files": files,
+        "partitions": partitions,
+        "chunks": chunks,
+    }
+    with open(os.path.join(folder, CHUNKS_FILE), "w", encoding="utf-8") as f:
+        json.dump(sidecar, f)
+    print(
+        f"Exported {len(chunks)} vectors of {vectors.shape[1]} dimensions in {len(partitions)} partitions "
+        f"to {folder} (quantized: {quantized})"
+    )
+    return len(chunks)
+
+
+def export(collection, folder, model, embed_dimensions=None, quantized=False):
+    """
+    Writes the collection's embeddings and chunk metadata into ``folder``. Chunks
+    embedded before doc_type and date were stored get them from their file name.
+    """
+    records = collection.get(include=["embeddings", "documents", "metadatas"])
+    metadatas = []
+    for meta in records["metadatas"]:
+        meta = dict(meta or {})
+        if "doc_type" not in meta and "source" in meta:
+            meta.update(classify(meta["source"]))
+        metadatas.append(meta)
+    return write(
+        folder,
+        records["ids"],
+        records["embeddings"],
+        records["documents"],
+        metadatas,
+        model,
+        embed_dimensions,
+        quantized,
+    )
+
+
+def update(previous_folder, folder, added, removed, model, embed_dimensions=None, quantized=False):
+    """
+    Writes a new index from a previous one: rows whose ids are in ``removed`` or
+    ``added`` are dropped and ``added`` ({id: (embedding, text, metadata)}) is
+    appended. Returns None when the previous index was built with another model
+    or size, the caller has to export from the collection then.
+    """
+    previous = VectorIndex(previous_folder)
+    if previous.model != model or previous.embed_dimensions != embed_dimensions:
+        return None
+    keep = [i for i, chunk in enumerate(previous.chunks) if chunk["id"] not in removed and chunk["id"] not in added]
+    ids = [previous.chunks[i]["id"] for i in keep] + list(added)
+    documents = [previous.chunks[i]["text"] for i in keep] + [text for _, text, _ in added.values()]
+    metadatas = [{k: v for k, v in previous.chunks[i].items() if k not in ("id", "text")} for i in keep]
+    metadatas += [meta for _, _, meta in added.values()]
+    blocks = []
+    if keep:
+        # Rows already in the index were normalized when it was written
+        blocks.append(np.asarray(previous.vectors[keep], dtype=np.float32))
+    if added:
+        blocks.append(normalize([embedding for embedding, _, _ in added.values()]))
+    if blocks and len({block.shape[1] for block in blocks}) > 1:
+        return None
+    vectors = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    print(f"Updating the vector index: {len(keep)} kept, {len(added)} added, {len(previous) - len(keep)} dropped")
+    return write(folder, ids, vectors, documents, metadatas, model, embed_dimensions, quantized)
+
+
+def snapshot_files(folder):
+    with open(os.path.join(folder, CHUNKS_FILE), encoding="utf-8") as f:
+        # Snapshots from before quantization did not list their files
+        return json.load(f).get("files", [VECTORS_FILE]) + [CHUNKS_FILE]
+
+
+def publish(s3, bucket, folder):
+    """
+    Uploads an exported index as a new snapshot and makes it current, then deletes
+    snapshots older than the previous one.
+    """
+    snapshot = str(time.time_ns())
+    prefix = f"{INDEX_PREFIX}{snapshot}/"
+    for name in snapshot_files(folder):
+        s3.upload_file(os.path.join(folder, name), bucket, prefix + name)
+    # Written last, readers only ever see a snapshot whose files are all uploaded
+    s3.put_object(
+        Bucket=bucket,
+        Key=CURRENT_KEY,
+        Body=json.dumps({"snapshot": snapshot}),
+        ContentType="application/json",
+    )
+    print(f"Published vector index snapshot {snapshot}")
+
+    paginator = s3.get_paginator("list_objects_v2")
+    snapshots = set()
+    for page in paginator.paginate(Bucket=bucket, Prefix=INDEX_PREFIX, Delimiter="/"):
+        for common in page.get("CommonPrefixes", []):
+            snapshots.add(common["Prefix"][len(INDEX_PREFIX) :].rstrip("/"))
+    for old in sorted(snapshots, key=int)[:-KEEP_SNAPSHOTS]:
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{INDEX_PREFIX}{old}/"):
+            for obj in page.get("Contents", []):
+                s3.delete_object(Bucket=bucket, Key=obj["Key"])
+    return snapshot
+
+
+def current_snapshot(s3, bucket):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=CURRENT_KEY)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(response["Body"].read())["snapshot"]
+
+
+def download(s3, bucket, snapshot, root):
+    """
+    Downloads a snapshot into ``root/<snapshot>`` and removes any other snapshot
+    folders there, /tmp only has room for one.
+    """
+    folder = os.path.join(root, snapshot)
+    if os.path.isdir(root):
+        for name in os.listdir(root):
+            if name != snapshot:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    os.makedirs(folder, exist_ok=True)
+
+    def fetch(name):
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            s3.download_file(bucket, f"{INDEX_PREFIX}{snapshot}/{name}", path + ".part")
+            os.replace(path + ".part", path)
+
+    # The sidecar lists the rest of the snapshot's files
+    fetch(CHUNKS_FILE)
+    for name in snapshot_files(folder):
+        fetch(name)
+    return folder
+
+
+class VectorIndex:
+    def __init__(self, folder, snapshot=None):
+        self.snapshot = snapshot
+        # Memory-mapped, pages are read from disk as the search touches them
+        self.vectors = np.load(os.path.join(folder, VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(folder, CHUNKS_FILE), encoding="utf-8") as f:
+            sidecar = json.load(f)
+        self.model = sidecar["model"]
+        self.dimensions = sidecar["dimensions"]
+        self.embed_dimensions = sidecar.get("embed_dimensions")
+        self.chunks = sidecar["chunks"]
+        # Snapshots from before partitioning are one partition no filter matches
+        self.partitions = sidecar.get("partitions") or [
+            {"doc_type": None, "date": None, "start": 0, "end": len(self.chunks)}
+        ]
+        self.quantized = None
+        self.scales = None
+        if sidecar.get("quantized"):
+            self.quantized = np.load(os.path.join(folder, QUANTIZED_FILE), mmap_mode="r")
+            self.scales = np.load(os.path.join(folder, SCALES_FILE))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def dates(self):
+        return sorted({p["date"] for p in self.partitions if p["date"]})
+
+    def ranges(self, doc_types=None, dates=None, since=None, until=None):
+        """
+        Row ranges of the partitions matching every given filter, adjacent ones merged.
+        """
+        ranges = []
+        for p in self.partitions:
+            if doc_types is not None and p["doc_type"] not in doc_types:
+                continue
+            if dates is not None and p["date"] not in dates:
+                continue
+            if since is not None and not (p["date"] and p["date"] >= since):
+                continue
+            if until is not None and not (p["date"] and p["date"] <= until):
+                continue
+            if ranges and ranges[-1][1] == p["start"]:
+                ranges[-1] = (ranges[-1][0], p["end"])
+            else:
+                ranges.append((p["start"], p["end"]))
+        return ranges
+
+    def coarse_scores(self, query, ranges):
+        scores = []
+        for start, end in ranges:
+            for block_start in range(start, end, SCAN_BLOCK_ROWS):
+                block_end = min(block_start + SCAN_BLOCK_ROWS, end)
+                block = self.quantized[block_start:block_end].astype(np.float32)
+                scores.append((block @ query) * self.scales[block_start:block_end])
+        return np.concatenate(scores)
+
+    def search(self, query_vector, k=5, rescore=True, **filters):
+        """
+        Returns the ``k`` chunks closest to the query by cosine similarity, best
+        first, each as (score, chunk). ``filters`` are those of ``ranges`` and limit
+        the search to the matching partitions. A quantized index shortlists
+        ``k * RESCORE_FACTOR`` candidates from the int8 scan and ranks them by their
+        float32 score, or by the int8 score when ``rescore`` is False.
+        """
+        query = normalize(query_vector).reshape(-1)
+        if len(self.chunks) and query.shape[0] != self.vectors.shape[1]:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, the index has {self.vectors.shape[1]}")
+        ranges = self.ranges(**filters) if filters else [(0, len(self.chunks))]
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges] or [np.zeros(0, dtype=int)])
+        if len(rows) == 0:
+            return []
+        k = min(k, len(rows))
+        if self.quantized is None:
+            scores = np.concatenate([self.vectors[start:end] @ query for start, end in ranges])
+            return self._best(rows, scores, k)
+
+        scores = self.coarse_scores(query, ranges)
+        if not rescore:
+            return self._best(rows, scores, k)
+        shortlist = min(k * RESCORE_FACTOR, len(scores))
+        candidates = np.sort(rows[np.argpartition(-scores, shortlist - 1)[:shortlist]])
+        # Fancy indexing a memmap only reads the candidate rows
+        return self._best(candidates, self.vectors[candidates] @ query, k)
+
+    def _best(self, rows, scores, k):
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.chunks[rows[i]]) for i in top]
@@ -0,0 +1,28 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# Publishes dnd_core as a Lambda layer. Layers are unpacked under /opt and
+# /opt/python is on the runtime's sys.path, so the package goes in python/.
+LAYER_NAME=dnd-core
+
+TIMESTAMP=$(date +%s)
+ZIP=dnd-core-layer-release-${TIMESTAMP}.zip
+
+# Clean old artifacts
+rm -rf layer
+mkdir -p layer/python
+cp -r dnd_core layer/python/
+find layer -name "__pycache__" -type d -prune -exec rm -rf {} +
+
+(
+  cd layer
+  zip -vr "../${ZIP}" python
+)
+
+aws lambda publish-layer-version \
+  --layer-name "${LAYER_NAME}" \
+  --zip-file "fileb://${ZIP}" \
+  --compatible-runtimes python3.12 python3.14 \
+  --query LayerVersionArn \
+  --output text \
+  --no-cli-pager
@@ -1,153 +1,153 @@
-import json
 import traceback
 
 from datetime import datetime
 
-from openai import OpenAI
-import chromadb
-from chromadb.utils import embedding_functions
 import boto3
-import zipfile
 import os
-import time
+import re
 
-s3 = boto3.client("s3")
+from dnd_core import imports, tracing
+from dnd_core.events import parse_body
+
+# Imported by the first init(), which times them as "import.*" spans of the cold request
+openai = imports.lazy("openai")
+vector_index = imports.lazy("dnd_core.vector_index")
+
+s3 = tracing.instrument(boto3.client("s3"))
 
 S3_BUCKET = os.environ.get("S3_BUCKET")
 MODEL_NAME = os.environ.get("MODEL_NAME", "gpt-4o-mini")
 
-CHROMA_PATH = "/tmp/chroma_data"
+# Chunks given to the model per question, lambda/bench/eval.py measures what k does to recall and context size
+SEARCH_K = int(os.environ.get("SEARCH_K", "5"))
+
+# Snapshots of the vector index the ingest publishes, only the one in use is kept
+INDEX_ROOT = "/tmp/vector_index"
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
-# This is where I would copy files from S3 to my /tmp/chroma_data directory
-COLLECTION_NAME = "dnd_sessions"
-EMBED_MODEL = "text-embedding-3-small"  # low-cost, high-quality model
 client = None
-collection = None
-zip_timestamp = None
-current_chroma_path: str | None = None
-
-def unzip_file(zip_path, extract_to):
-    """
-    Unzips a ZIP file into the given directory.
-    Creates the target directory if it doesn't exist.
-    """
-    os.makedirs(extract_to, exist_ok=True)
-
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
-
-    print(f"Unzipped {zip_path} → {extract_to}")
+index = None
+
+FILTER_KEYS = ("doc_types", "dates", "since", "until")
+LAST_SESSION = re.compile(r"\b(last|latest|previous|most recent) (session|game|time)\b", re.IGNORECASE)
+# Sheet phrasing only: "spells", "stats" or "skills" alone also come up in questions about what happened
+SHEET_WORDS = re.compile(
+    r"\b(character sheets?|stat blocks?|armou?r class|hit points|max hp|ability scores?|spell slots?|"
+    r"proficiency bonus|spell save dc)\b"
+    r"|\b\w+['’]s (stats|sheet|ac|hp|inventory|skills|proficiencies|spell list|feats)\b",
+    re.IGNORECASE,
+)
+DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
 
 def init():
-    global client, collection, zip_timestamp, current_chroma_path
-    should_not_init = False
-    if client is not None and collection is not None and zip_timestamp is not None and current_chroma_path is not None:
-        response = s3.head_object(
-            Bucket=S3_BUCKET,
-            Key="chromadb.zip",
-        )
-        last_modified = response['LastModified']
-        if zip_timestamp >= last_modified:
-            should_not_init = True
-        else:
-            zip_timestamp = last_modified
-    if should_not_init:
+    global client, index
+    snapshot = vector_index.current_snapshot(s3, S3_BUCKET)
+    if snapshot is None:
+        raise RuntimeError("No vector index has been published yet, run dnd_rag_ingest first")
+    if index is not None and index.snapshot == snapshot:
         print("Already initialized, skipping initialization portion")
         return
-    print("Initializing...")
-
-    # Kill references
-    client = None
-    collection = None
-
-    if current_chroma_path is not None and os.path.exists(current_chroma_path):
-        for root, dirs, files in os.walk(current_chroma_path, topdown=False):
-            for name in files:
-                os.remove(os.path.join(root, name))
-            for name in dirs:
-                os.rmdir(os.path.join(root, name))
-    if os.path.exists("/tmp/chromadb.zip"):
-        os.remove("/tmp/chromadb.zip")
-
-    response = s3.head_object(
-        Bucket=S3_BUCKET,
-        Key="chromadb.zip",
-    )
-    zip_timestamp = response['LastModified']
-
-    s3.download_file(S3_BUCKET, "chromadb.zip", "/tmp/chromadb.zip")
-    current_chroma_path = CHROMA_PATH + "_" + str(int(time.time()))
-    unzip_file("/tmp/chromadb.zip", current_chroma_path)
-
-    # Initialize clients
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    chroma_client = chromadb.PersistentClient(path=current_chroma_path)
-    embed_fn = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=OPENAI_API_KEY,
-        model_name=EMBED_MODEL,
-    )
-
-    collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        embedding_function=embed_fn,
-    )
+    print(f"Loading vector index snapshot {snapshot}...")
+
+    # Kill references so the old mapping is closed before its folder is removed
+    index = None
+    folder = vector_index.download(s3, S3_BUCKET, snapshot, INDEX_ROOT)
+    with tracing.span("index.open"):
+        index = vector_index.VectorIndex(folder, snapshot)
+    print(f"Loaded {len(index)} chunks of {index.dimensions} dimensions")
+
+    if client is None:
+        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+
+
+def route(query):
+    """
+    Search filters implied by the wording of the question, empty when it should search everything.
+    """
+    # A named session wins, "what spells did we see last session" is about the session, not the sheets
+    dates = DATE.findall(query)
+    if dates:
+        return {"dates": dates}
+    if LAST_SESSION.search(query) and index.dates():
+        return {"dates": [index.dates()[-1]]}
+    if SHEET_WORDS.search(query):
+        return {"doc_types": ["sheets"]}
+    return {}
+
+
+def retrieve(query, query_vector, filters=None, routed=True, k=SEARCH_K):
+    """
+    The k best chunks as (score, chunk), and the filters they were searched with.
+    Explicit filters are searched as given, routed ones fall back to the whole
+    index when they come up short.
+    """
+    if routed:
+        filters = route(query)
+    filters = {key: value for key, value in (filters or {}).items() if key in FILTER_KEYS}
+    results = index.search(query_vector, k=k, **filters)
+    if routed and filters and len(results) < k:
+        results = index.search(query_vector, k=k)
+    return results, filters
 
 
+@tracing.traced
 def lambda_handler(event, context):
     try:
-        print(json.dumps(event))
-        print(context)
-        init()
+        with tracing.span("init"):
+            init()
 
-        body = {}
-        if isinstance(event['body'], dict):
-            body = event['body']
-        elif event['body'].startswith("{"):
-            body = json.loads(event['body'])
+        body = parse_body(event)
 
         query = body.get('query')
 
         if query is None:
             output = {"statusCode": 201, "body": "Successful ping, lambda is now warm" }
-            print(json.dumps(output))
             return output
 
-        # Search top 5 relevant chunks
-        results = collection.query(
-            query_texts=[query],
-            n_results=5,
-        )
+        # The query is embedded with the model and size the index was built with
+        with tracing.span("embed"):
+            options = {"dimensions": index.embed_dimensions} if index.embed_dimensions else {}
+            query_vector = client.embeddings.create(model=index.model, input=[query], **options).data[0].embedding
+        filters = body.get("filters")
+        routed = filters is None and body.get("route", True)
+        with tracing.span("index.search"):
+            results, filters = retrieve(query, query_vector, filters, routed)
+        tracing.log("filters", filters=filters, routed=routed)
 
         context = ""
-        for doc, meta in zip(results["documents"][0], results["metadatas"][0]):
-            print(f"📄 From {meta['source']}, chunk {meta['chunk']}")
-            print(doc[:100] + "...\n")
-            context += f"<SOURCE><NAME>{meta['source']}</NAME><TEXT>{doc}</TEXT></SOURCE>"
+        for score, chunk in results:
+            tracing.log(
+                "source",
+                source=chunk["source"],
+                chunk=chunk["chunk"],
+                score=round(score, 4),
+                text=tracing.truncate(chunk["text"], 100),
+            )
+            context += f"<SOURCE><NAME>{chunk['source']}</NAME><TEXT>{chunk['text']}</TEXT></SOURCE>"
 
         # Build prompt for LLM
         system_prompt = f"""
 You are a Dungeons & Dragons campaign assistant.
 The question you will answer relates to a DND campaign.
 There is no speaker or narrator, as this is a collective storytelling exercise.
-The <QUESTION> you will answer will be accompanied by <SOURCE>s from a RAG application using ChromaDB.
+The <QUESTION> you will answer will be accompanied by <SOURCE>s from a RAG application.
 Always return a list of <SOURCE>s used to determine your answer by listing the <NAME>s with a short summary of the <TEXT>s, in a markdown-style list.
 If you deem a <SOURCE> to be unrelated, please ignore it and do not list it in the <SOURCE>s."""
         user_prompt = f"""
 <CONTEXT>{context}</CONTEXT>
 <QUESTION>{query}</QUESTION>"""
 
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
-        print(response)
+        with tracing.span("model.generate"):
+            response = client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+            )
+        tracing.log("usage", usage=response.usage)
         output ={"statusCode": 200, "body": response.choices[0].message.content}
-        print(json.dumps(output))
         return output
     except Exception:
         traceback.print_exc()
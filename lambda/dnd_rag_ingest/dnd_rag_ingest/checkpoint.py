@@ -0,0 +1,103 @@
+"""
+Progress of an ingest that has to outlive one invocation. The plan is the list
+of files to embed or delete, decided up front from the manifest. Each batch of
+finished files is saved to S3 with its embeddings, so a run that picks the
+checkpoint up replays those batches into its copy of the collection without
+calling the embedding model again, and carries on from the first unfinished
+file. The checkpoint is deleted once the snapshot it led to is published.
+"""
+import json
+
+from botocore.exceptions import ClientError
+
+from dnd_core.storage import iter_objects
+
+CHECKPOINT_PREFIX = "ingest-checkpoint/"
+PLAN_KEY = f"{CHECKPOINT_PREFIX}plan.json"
+
+
+def batch_key(number):
+    return f"{CHECKPOINT_PREFIX}batch-{number:05d}.json"
+
+
+class Checkpoint:
+    def __init__(self, s3, bucket, collection_name, base, processed=None, work=None, done=0, batches=0):
+        self.s3 = s3
+        self.bucket = bucket
+        self.collection_name = collection_name
+        # ETag of the chromadb.zip the batches apply to
+        self.base = base
+        # Queue entries the plan covers, acknowledged once the result is published
+        self.processed = processed or {}
+        # [{"key", "file_name", "hash"}], a None hash deletes the file's chunks
+        self.work = work or []
+        self.done = done
+        self.batches = batches
+
+    @classmethod
+    def load(cls, s3, bucket, collection_name, base):
+        """
+        The saved checkpoint, or None. One taken against another chromadb.zip or
+        collection cannot be replayed and is deleted.
+        """
+        try:
+            data = json.loads(s3.get_object(Bucket=bucket, Key=PLAN_KEY)["Body"].read())
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        checkpoint = cls(
+            s3, bucket, collection_name, base, data["processed"], data["work"], data["done"], data["batches"]
+        )
+        if data["collection"] != collection_name or data["base"] != base:
+            print(f"Discarding the checkpoint taken against {data['collection']} {data['base']}")
+            checkpoint.delete()
+            return None
+        print(f"Resuming from the checkpoint: {checkpoint.done} of {len(checkpoint.work)} files done")
+        return checkpoint
+
+    def pending(self):
+        return self.work[self.done :]
+
+    def extend(self, work, queued):
+        self.work += work
+        self.processed.update(queued)
+        if self.pending():
+            self.save()
+
+    def save(self):
+        plan = {
+            "collection": self.collection_name,
+            "base": self.base,
+            "processed": self.processed,
+            "work": self.work,
+            "done": self.done,
+            "batches": self.batches,
+        }
+        self.s3.put_object(Bucket=self.bucket, Key=PLAN_KEY, Body=json.dumps(plan), ContentType="application/json")
+
+    def save_batch(self, records, files):
+        """
+        Saves the records of the next ``files`` planned files, then the plan that
+        counts them as done.
+        """
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=batch_key(self.batches),
+            Body=json.dumps(records),
+            ContentType="application/json",
+        )
+        self.batches += 1
+        self.done += files
+        self.save()
+        print(f"Checkpoint: {self.done} of {len(self.work)} files done")
+
+    def saved_batches(self):
+        for number in range(self.batches):
+            yield json.loads(self.s3.get_object(Bucket=self.bucket, Key=batch_key(number))["Body"].read())
+
+    def delete(self):
+        # The plan first, batches without one are never read
+        self.s3.delete_object(Bucket=self.bucket, Key=PLAN_KEY)
+        for obj in iter_objects(self.s3, self.bucket, CHECKPOINT_PREFIX):
+            self.s3.delete_object(Bucket=self.bucket, Key=obj["Key"])
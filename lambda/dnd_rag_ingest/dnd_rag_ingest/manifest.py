@@ -0,0 +1,91 @@
+"""
+Which chunks every notes file has in the collection. It is saved in the Chroma
+folder as manifest.json, so it travels in chromadb.zip with the data it
+describes, and the ingest decides what to embed and delete from it instead of
+reading the collection back.
+"""
+import json
+import os
+
+MANIFEST_FILE = "manifest.json"
+
+
+class Manifest:
+    def __init__(self, collection_name, files=None, rebuilt=False):
+        self.collection_name = collection_name
+        # file name -> {"file_id": name + content hash, "ids": chunk ids}
+        self.files = files or {}
+        # Built from the collection this run, so the snapshot has to be saved even if nothing else changed
+        self.rebuilt = rebuilt
+
+    @classmethod
+    def load(cls, chroma_path, collection):
+        path = os.path.join(chroma_path, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("collection") == collection.name:
+                return cls(collection.name, data["files"])
+        return cls.rebuild(collection)
+
+    @classmethod
+    def rebuild(cls, collection):
+        """
+        One pass over the chunk metadata, for snapshots saved before the manifest
+        existed or after the collection changed.
+        """
+        files = {}
+        records = collection.get(include=["metadatas"])
+        for chunk_id, meta in zip(records["ids"], records["metadatas"]):
+            if not meta:
+                continue
+            entry = files.setdefault(meta["source"], {"file_id": meta["file_id"], "ids": []})
+            if entry["file_id"] != meta["file_id"]:
+                # Chunks of two versions of the file, the next sync re-embeds it and deletes both
+                entry["file_id"] = None
+            entry["ids"].append(chunk_id)
+        print(f"Rebuilt the manifest from {len(records['ids'])} chunks of {len(files)} files")
+        return cls(collection.name, files, rebuilt=True)
+
+    def save(self, chroma_path):
+        with open(os.path.join(chroma_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"collection": self.collection_name, "files": self.files}, f)
+
+    def file_id(self, file_name):
+        return self.files.get(file_name, {}).get("file_id")
+
+    def all_ids(self):
+        return {chunk_id for entry in self.files.values() for chunk_id in entry["ids"]}
+
+    def chunk_ids(self, file_name):
+        return set(self.files.get(file_name, {}).get("ids", []))
+
+    def set(self, file_name, file_id, ids):
+        self.files[file_name] = {"file_id": file_id, "ids": list(ids)}
+
+    def remove(self, file_name):
+        return set(self.files.pop(file_name, {}).get("ids", []))
+
+
+class Changes:
+    """
+    Chunks added and removed during one ingest, enough to update the published
+    vector index without reading the whole collection.
+    """
+
+    def __init__(self):
+        self.added = {}
+        self.removed = set()
+
+    def __bool__(self):
+        return bool(self.added or self.removed)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        for chunk_id, embedding, document, meta in zip(ids, embeddings, documents, metadatas):
+            self.added[chunk_id] = (embedding, document, meta)
+            self.removed.discard(chunk_id)
+
+    def remove(self, ids):
+        for chunk_id in ids:
+            self.added.pop(chunk_id, None)
+            self.removed.add(chunk_id)
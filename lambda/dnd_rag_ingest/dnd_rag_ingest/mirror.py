@@ -0,0 +1,134 @@
+"""
+A copy of the session notes in /tmp that outlives the invocation. Next to the
+files it keeps the ETag and content hash of every key it downloaded, so a warm
+container only fetches the keys whose ETag changed, and never has to read a
+file back to hash it.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from dnd_core.storage import iter_objects
+
+# A single part upload's ETag is the MD5 of the content, a multipart one has a -<parts> suffix
+MD5_ETAG = re.compile(r"^[0-9a-f]{32}$")
+DOWNLOAD_WORKERS = 16
+# Only notes are ever planned, anything else under the prefix would just fill /tmp
+NOTES_SUFFIX = ".md"
+
+
+def content_hash(etag, path):
+    etag = etag.strip('"')
+    if MD5_ETAG.match(etag):
+        return etag
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class Mirror:
+    def __init__(self, s3, bucket, prefix, folder, state_path):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.folder = folder
+        self.state_path = state_path
+        # key -> {"etag": S3 ETag, "hash": MD5 of the content}
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+        self.downloaded = 0
+
+    def path(self, key):
+        return os.path.join(self.folder, key.removeprefix(self.prefix))
+
+    def is_current(self, key, etag):
+        entry = self.state.get(key)
+        return entry is not None and entry["etag"] == etag and os.path.exists(self.path(key))
+
+    def save(self):
+        with open(self.state_path + ".part", "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + ".part", self.state_path)
+
+    def download(self, key, if_none_match=None):
+        """
+        Fetches one key into the mirror. Returns its state entry, the cached one
+        when S3 answers 304 to ``if_none_match``, or None when the key is gone.
+        """
+        params = {"Bucket": self.bucket, "Key": key}
+        if if_none_match:
+            params["IfNoneMatch"] = if_none_match
+        try:
+            response = self.s3.get_object(**params)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "304":
+                return self.state[key]
+            if code in ("NoSuchKey", "404"):
+                return None
+            raise
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The ETag comes with the body, so the hash always describes what was written
+        with open(path + ".part", "wb") as f:
+            shutil.copyfileobj(response["Body"], f)
+        os.replace(path + ".part", path)
+        self.downloaded += 1
+        return {"etag": response["ETag"], "hash": content_hash(response["ETag"], path)}
+
+    def sync(self, workers=DOWNLOAD_WORKERS):
+        """
+        Brings the whole prefix up to date: fetches new and changed keys in
+        parallel and deletes local files whose key is gone. Returns {key: hash}.
+        """
+        listed = {
+            obj["Key"]: obj["ETag"] for obj in iter_objects(self.s3, self.bucket, self.prefix, suffix=NOTES_SUFFIX)
+        }
+        stale = [key for key, etag in listed.items() if not self.is_current(key, etag)]
+        print(f"Mirror: {len(listed) - len(stale)} of {len(listed)} files current, downloading {len(stale)}")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for key, entry in zip(stale, executor.map(self.download, stale)):
+                if entry is None:
+                    # Deleted between the listing and the download
+                    del listed[key]
+                else:
+                    self.state[key] = entry
+
+        for key in set(self.state) - set(listed):
+            self.remove(key)
+        # Files from before the mirror kept state, or left by a crashed run
+        keep = {self.path(key) for key in listed}
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                if path not in keep:
+                    os.remove(path)
+        self.save()
+        return {key: self.state[key]["hash"] for key in listed}
+
+    def fetch(self, key):
+        """
+        Brings one key up to date, with a conditional GET when the mirror has
+        it already. Returns its hash, or None when the key no longer exists.
+        """
+        cached = self.state.get(key) if os.path.exists(self.path(key)) else None
+        entry = self.download(key, cached["etag"] if cached else None)
+        if entry is None:
+            self.remove(key)
+        else:
+            self.state[key] = entry
+        self.save()
+        return entry["hash"] if entry else None
+
+    def remove(self, key):
+        self.state.pop(key, None)
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+            print(f"Mirror: removed {key}")
@@ -1,209 +1,519 @@
 import json
 import time
 import traceback
-import glob
-import hashlib
 from pathlib import Path
-from openai import OpenAI
-import chromadb
-from chromadb.utils import embedding_functions
-from tiktoken import get_encoding
+import shutil
 import boto3
-import zipfile
 import os
-import shutil
 
-STARTING_FILE = "dnd_rag_ingest.STARTING"
-
-s3 = boto3.client("s3")
+from dnd_core.documents import classify
+from dnd_core.events import changed_keys, fake_s3_event, FULL_SCAN, NOTES_PREFIX
+from dnd_core import imports, ingest_queue
+from dnd_core.deadline import Deadline, continue_later
+from dnd_core.lease import Lease
+from dnd_core.storage import iter_objects, unzip_file, zip_directory
+from dnd_core import tracing
+from dnd_rag_ingest.checkpoint import Checkpoint
+from dnd_rag_ingest.manifest import Changes, Manifest
+from dnd_rag_ingest.mirror import Mirror
+
+# Only a run that has queued work to embed pays for importing these
+chromadb = imports.lazy("chromadb")
+embedding_functions = imports.lazy("chromadb.utils.embedding_functions")
+tiktoken = imports.lazy("tiktoken")
+vector_index = imports.lazy("dnd_core.vector_index")
+
+FUNCTION_NAME = "dnd_rag_ingest"
+
+s3 = tracing.instrument(boto3.client("s3"))
+dynamo = tracing.instrument(boto3.client("dynamodb"))
+lambda_client = tracing.instrument(boto3.client("lambda"))
 
 S3_BUCKET = os.environ.get("S3_BUCKET")
+TABLE_NAME = os.environ.get("DYNAMODB_TABLE_NAME")
 CHROMA_ZIP = "/tmp/chromadb.zip"
+# Kept between warm invocations, with the ETags of what it holds next to it
 DATA_FOLDER = "/tmp/session-notes/"
+MIRROR_STATE = "/tmp/session-notes.json"
 CHROMA_PATH = "/tmp/chroma_data/"
 CHROMA_SNAPSHOT_ZIP = "/tmp/chroma_snapshot.zip"
+INDEX_EXPORT_PATH = "/tmp/vector_index_export/"
+INDEX_PREVIOUS_PATH = "/tmp/vector_index_previous/"
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-
-# This is where I would copy files from S3 to my /tmp/chroma_data directory
-COLLECTION_NAME = "dnd_sessions"
-EMBED_MODEL = "text-embedding-3-small"  # low-cost, high-quality model
-
-def zip_directory(folder, zip_path):
-    """
-    Create a ZIP file from a folder.
-    Result: zip_path (e.g., /tmp/chroma.zip)
-    """
-    # zip_path must not end in .zip for make_archive base_name
-    base = zip_path.replace(".zip", "")
-    shutil.make_archive(base, 'zip', folder)
-    print(f"Zipped {folder} → {zip_path}")
-    return zip_path
-
-def unzip_file(zip_path, extract_to):
-    """
-    Unzips a ZIP file into the given directory.
-    Creates the target directory if it doesn't exist.
-    """
-    os.makedirs(extract_to, exist_ok=True)
+# Compaction copies the collection this many chunks at a time and times this many sample queries
+COMPACT_BATCH = 1000
+COMPACT_QUERIES = 50
 
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
+# Files embedded between two checkpoints
+CHECKPOINT_FILES = int(os.environ.get("CHECKPOINT_FILES", "20"))
+# Time left at which a run stops starting batches and continues in a new invocation
+DEADLINE_RESERVE_MS = int(os.environ.get("DEADLINE_RESERVE_MS", "120000"))
 
-    print(f"Unzipped {zip_path} → {extract_to}")
-
-def download_s3_directory(bucket, prefix, local_path="/tmp"):
-    """
-    Recursively download an S3 prefix (directory) into a local folder.
-    Example:
-        download_s3_directory("mybucket", "notes/", "/tmp/notes")
-    """
-    paginator = s3.get_paginator("list_objects_v2")
-
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-        for obj in page.get("Contents", []):
-            key = obj["Key"]
-
-            # Skip "directory" placeholders if present
-            if key.endswith("/"):
-                continue
-
-            # Build local path
-            rel_path = key[len(prefix):] if key.startswith(prefix) else key
-            local_file_path = os.path.join(local_path, rel_path)
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+EMBED_MODEL = "text-embedding-3-small"  # low-cost, high-quality model
+# Shortened embeddings through the model's dimensions option, unset keeps the full 1536
+EMBED_DIMENSIONS = int(os.environ.get("EMBED_DIMENSIONS", "0")) or None
+# Adds int8 copies of the vectors to the exported index for dnd_rag_completion to scan
+INDEX_QUANTIZED = os.environ.get("INDEX_QUANTIZED", "false").lower() == "true"
 
-            # Download the file
-            s3.download_file(bucket, key, local_file_path)
-            print(f"Downloaded: s3://{bucket}/{key} → {local_file_path}")
+# This is where I would copy files from S3 to my /tmp/chroma_data directory
+# Vectors of different sizes cannot share a collection, so every size gets its own
+COLLECTION_NAME = "dnd_sessions" if EMBED_DIMENSIONS is None else f"dnd_sessions_{EMBED_DIMENSIONS}"
+embed_fn = None
 
 # Helper to chunk text
 def chunk_text(text, chunk_size=300, overlap=75):
-    tokens = get_encoding("cl100k_base").encode(text)
+    encoding = tiktoken.get_encoding("cl100k_base")
+    tokens = encoding.encode(text)
     chunks = []
     start = 0
     while start < len(tokens):
         end = min(start + chunk_size, len(tokens))
-        chunk = get_encoding("cl100k_base").decode(tokens[start:end])
+        chunk = encoding.decode(tokens[start:end])
         chunks.append(chunk)
         start += chunk_size - overlap
     return chunks
 
-# Compute a stable hash for each file (for deduplication)
-def file_hash(path):
-    with open(path, "rb") as f:
-        return hashlib.md5(f.read()).hexdigest()
-
+def get_embed_fn():
+    global embed_fn
+    if embed_fn is None:
+        embed_fn = embedding_functions.OpenAIEmbeddingFunction(
+            api_key=OPENAI_API_KEY,
+            model_name=EMBED_MODEL,
+            dimensions=EMBED_DIMENSIONS,
+        )
+    return embed_fn
+
+def open_collection(chroma_path):
+    chroma_client = chromadb.PersistentClient(path=chroma_path)
+
+    # Collections left over from another EMBED_DIMENSIONS would only make the snapshot bigger
+    for existing in chroma_client.list_collections():
+        if existing.name != COLLECTION_NAME and existing.name.startswith("dnd_sessions"):
+            print(f"🗑️ Deleting collection {existing.name}, EMBED_DIMENSIONS is now {EMBED_DIMENSIONS}")
+            chroma_client.delete_collection(existing.name)
+
+    return chroma_client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        embedding_function=get_embed_fn(),
+    )
+
+def embed_file(file_path, file_name, file_id):
+    """
+    Chunks and embeds one file. The record is everything needed to store it,
+    so a checkpointed batch can be stored again without calling the model.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    chunks = chunk_text(text)
+    embeddings = []
+    if len(chunks) > 0:
+        # Embedded here rather than inside upsert so the two show up as separate spans
+        with tracing.span("embed"):
+            embeddings = get_embed_fn()(chunks)
+    return file_record(file_name, file_id, chunks, embeddings)
+
+def file_record(file_name, file_id, chunks, embeddings):
+    ids = [f"{file_id}_{i}" for i in range(len(chunks))]
+    # doc_type and date let dnd_rag_completion search one kind of file or one session
+    metadatas = [
+        {"file_id": file_id, "source": file_name, "chunk": i, **classify(file_name)} for i in range(len(chunks))
+    ]
+    return {
+        "file_name": file_name,
+        "file_id": file_id,
+        "ids": ids,
+        # Plain floats, the record is saved as JSON in checkpoints
+        "embeddings": [[float(x) for x in embedding] for embedding in embeddings],
+        "documents": chunks,
+        "metadatas": metadatas,
+    }
+
+def store_file(collection, manifest, changes, record):
+    """
+    Writes an embedded file into the collection and deletes the chunks of the
+    version the manifest has for it. A record without a file_id removes the file.
+    """
+    file_name = record["file_name"]
+    if record["file_id"] is None:
+        stale_ids = manifest.remove(file_name)
+        if stale_ids:
+            print(f"🗑️ Deleting {len(stale_ids)} entries for removed file {file_name}")
+            collection.delete(ids=list(stale_ids))
+            changes.remove(stale_ids)
+        return 0
+
+    ids = record["ids"]
+    if ids:
+        with tracing.span("chroma.upsert"):
+            collection.upsert(
+                documents=record["documents"],
+                embeddings=record["embeddings"],
+                ids=ids,
+                metadatas=record["metadatas"]
+            )
+        changes.add(ids, record["embeddings"], record["documents"], record["metadatas"])
+    print(f"✅ Added {len(ids)} chunks from {file_name}")
+
+    stale_ids = manifest.chunk_ids(file_name) - set(ids)
+    if stale_ids:
+        print(f"🗑️ Deleting {len(stale_ids)} stale entries for {file_name}")
+        collection.delete(ids=list(stale_ids))
+        changes.remove(stale_ids)
+    manifest.set(file_name, record["file_id"], ids)
+    return len(ids)
+
+def open_mirror():
+    return Mirror(s3, S3_BUCKET, NOTES_PREFIX, DATA_FOLDER, MIRROR_STATE)
+
+def plan_all_files(mirror, manifest):
+    hashes = mirror.sync()
+
+    # Process all markdown files
+    md_keys = sorted(key for key in hashes if key.endswith(".md"))
+    work = []
+    seen = set()
+    for key in md_keys:
+        file_name = key.removeprefix(NOTES_PREFIX)
+        seen.add(file_name)
+        # The file id has always been name + MD5, the ETag of a single part upload is that MD5
+        if manifest.file_id(file_name) == file_name + hashes[key]:
+            continue
+        work.append({"key": key, "file_name": file_name, "hash": hashes[key]})
+
+    # Files the manifest knows about that are no longer in sessions/
+    removed = set(manifest.files) - seen
+    for file_name in sorted(removed):
+        work.append({"key": NOTES_PREFIX + file_name, "file_name": file_name, "hash": None})
+    print(f"Planned {len(work) - len(removed)} files to embed and {len(removed)} to delete of {len(md_keys)}")
+    return work
+
+def plan_changed_files(mirror, manifest, keys):
+    """
+    Plans only the given S3 keys. A key that no longer exists in S3 has its
+    chunks removed, a key whose content is unchanged is left alone.
+    """
+    work = []
+    for key in sorted(keys):
+        file_name = key.removeprefix(NOTES_PREFIX)
+        content_hash = mirror.fetch(key)
+        if content_hash is None:
+            if file_name in manifest.files:
+                work.append({"key": key, "file_name": file_name, "hash": None})
+        elif manifest.file_id(file_name) == file_name + content_hash:
+            print(f"Skipping {file_name} (already embedded)")
+        else:
+            work.append({"key": key, "file_name": file_name, "hash": content_hash})
+    return work
+
+def run_item(mirror, item):
+    """
+    The record for one planned file. The mirror may be from another container
+    than the plan, so a copy that does not have the planned content is fetched
+    again, and whatever S3 holds now is what gets embedded.
+    """
+    key, file_name, content_hash = item["key"], item["file_name"], item["hash"]
+    if content_hash is not None and (
+        mirror.state.get(key, {}).get("hash") != content_hash or not os.path.exists(mirror.path(key))
+    ):
+        content_hash = mirror.fetch(key)
+    if content_hash is None:
+        return {"file_name": file_name, "file_id": None}
+    return embed_file(mirror.path(key), file_name, file_name + content_hash)
+
+def export_index(collection, manifest, changes, snapshot):
+    """
+    Writes the index to publish into INDEX_EXPORT_PATH. Starts from the current
+    snapshot and applies this run's changes when it can, so only the changed
+    rows come out of Chroma; a rebuilt manifest, a new model or size, or a
+    snapshot that does not hold exactly the manifest's chunks means a full export.
+    """
+    shutil.rmtree(INDEX_EXPORT_PATH, ignore_errors=True)
+    if snapshot is not None and not manifest.rebuilt:
+        previous = vector_index.download(s3, S3_BUCKET, snapshot, INDEX_PREVIOUS_PATH)
+        written = vector_index.update(
+            previous, INDEX_EXPORT_PATH, changes.added, changes.removed, EMBED_MODEL, EMBED_DIMENSIONS, INDEX_QUANTIZED
+        )
+        if written is not None:
+            exported = {chunk["id"] for chunk in vector_index.VectorIndex(INDEX_EXPORT_PATH).chunks}
+            if exported == manifest.all_ids():
+                return
+            print(f"Snapshot {snapshot} does not match the manifest, exporting the whole collection")
+        shutil.rmtree(INDEX_EXPORT_PATH, ignore_errors=True)
+    vector_index.export(collection, INDEX_EXPORT_PATH, EMBED_MODEL, EMBED_DIMENSIONS, INDEX_QUANTIZED)
+
+def publish_snapshot(collection, manifest, changes, chroma_path, lease):
+    """
+    Uploads the collection with its manifest as chromadb.zip, then publishes the
+    vector index taken from it. Skipped when nothing changed since the last one.
+    """
+    snapshot = vector_index.current_snapshot(s3, S3_BUCKET)
+    if not (changes or manifest.rebuilt or snapshot is None):
+        print("Nothing changed, keeping the published snapshots")
+        return False
+
+    # Step 2 — ZIP updated Chroma snapshot, with the manifest that describes it
+    manifest.save(chroma_path)
+    with tracing.span("chroma.zip"):
+        zip_directory(chroma_path, CHROMA_SNAPSHOT_ZIP)
+
+    # Step 3 — Upload the ZIP back to S3
+    if lease.lost:
+        raise RuntimeError("Lost the ingest lease, not publishing this snapshot")
+    s3.upload_file(CHROMA_SNAPSHOT_ZIP, S3_BUCKET, "chromadb.zip")
+    print(f"Uploaded {CHROMA_SNAPSHOT_ZIP} → s3://{S3_BUCKET}/chromadb.zip")
+
+    # The read-only copy dnd_rag_completion queries, published after the Chroma snapshot it is taken from
+    with tracing.span("index.export"):
+        export_index(collection, manifest, changes, snapshot)
+    vector_index.publish(s3, S3_BUCKET, INDEX_EXPORT_PATH)
+    return True
+
+def folder_bytes(folder):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(folder) for name in files)
+
+def query_latency(collection, query_embeddings):
+    """
+    p50/p95 milliseconds of a top-5 query, after one query that loads the index,
+    and the ids each query returned.
+    """
+    collection.query(query_embeddings=query_embeddings[:1], n_results=5)
+    timings = []
+    results = []
+    for embedding in query_embeddings:
+        start = time.perf_counter()
+        found = collection.query(query_embeddings=[embedding], n_results=5, include=[])
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append(found["ids"][0])
+    timings.sort()
+    return {"p50": round(timings[len(timings) // 2], 2), "p95": round(timings[int(len(timings) * 0.95)], 2)}, results
+
+def compact_snapshot(lease):
+    """
+    Rebuilds the collection from its live chunks into a fresh Chroma folder,
+    leaving behind the tombstones and free pages that every re-embedded file
+    leaves in the HNSW index and SQLite file, and publishes it as chromadb.zip
+    once it holds exactly the same chunks. The vector index is written fresh on
+    every publish and has nothing to compact.
+    """
+    old_path = CHROMA_PATH + "_" + str(time.time_ns())
+    new_path = old_path + "_compact"
+    s3.download_file(S3_BUCKET, "chromadb.zip", CHROMA_ZIP)
+    with tracing.span("chroma.unzip"):
+        unzip_file(CHROMA_ZIP, old_path)
+    old = open_collection(old_path)
+    total = old.count()
+    if total == 0:
+        clean_up(old_path)
+        return {"chunks": 0}
+
+    new = chromadb.PersistentClient(path=new_path).get_or_create_collection(
+        name=COLLECTION_NAME,
+        embedding_function=get_embed_fn(),
+    )
+    with tracing.span("chroma.compact"):
+        for offset in range(0, total, COMPACT_BATCH):
+            page = old.get(include=["embeddings", "documents", "metadatas"], limit=COMPACT_BATCH, offset=offset)
+            new.add(
+                ids=page["ids"],
+                embeddings=page["embeddings"],
+                documents=page["documents"],
+                metadatas=page["metadatas"],
+            )
+    old_ids = set(old.get(include=[])["ids"])
+    new_ids = set(new.get(include=[])["ids"])
+    if new.count() != total or new_ids != old_ids:
+        raise RuntimeError(f"Compacted collection has {new.count()} chunks, expected {total}, not publishing it")
+
+    # The same stored embeddings as queries, so the comparison needs no model calls
+    sample = old.get(ids=sorted(old_ids)[:: max(total // COMPACT_QUERIES, 1)][:COMPACT_QUERIES], include=["embeddings"])
+    queries = [list(map(float, embedding)) for embedding in sample["embeddings"]]
+    latency_before, results_before = query_latency(old, queries)
+    latency_after, results_after = query_latency(new, queries)
+    agreement = sum(len(set(a) & set(b)) for a, b in zip(results_before, results_after)) / (5 * len(queries))
+
+    Manifest.load(old_path, old).save(new_path)
+    with tracing.span("chroma.zip"):
+        zip_directory(new_path, CHROMA_SNAPSHOT_ZIP)
+    report = {
+        "chunks": total,
+        "zip_bytes": {"before": os.path.getsize(CHROMA_ZIP), "after": os.path.getsize(CHROMA_SNAPSHOT_ZIP)},
+        "folder_bytes": {"before": folder_bytes(old_path), "after": folder_bytes(new_path)},
+        "query_ms": {"before": latency_before, "after": latency_after},
+        "top5_agreement": round(agreement, 3),
+    }
+    # A collection that never had chunks deleted can come out a little bigger, that one stays
+    report["published"] = report["zip_bytes"]["after"] < report["zip_bytes"]["before"]
+    print(f"🧹 Compaction report: {json.dumps(report)}")
+
+    if report["published"]:
+        if lease.lost:
+            raise RuntimeError("Lost the ingest lease, not publishing the compacted snapshot")
+        s3.upload_file(CHROMA_SNAPSHOT_ZIP, S3_BUCKET, "chromadb.zip")
+        print(f"Uploaded {CHROMA_SNAPSHOT_ZIP} → s3://{S3_BUCKET}/chromadb.zip")
+    clean_up(old_path)
+    clean_up(new_path)
+    return report
+
+def clean_up(chroma_path):
+    # Step 4 - Delete old chroma stuff, the notes mirror stays for the next warm invocation
+    for root, dirs, files in os.walk(chroma_path, topdown=False):
+        for name in files:
+            os.remove(os.path.join(root, name))
+    if os.path.exists(CHROMA_ZIP):
+        os.remove(CHROMA_ZIP)
+    if os.path.exists(CHROMA_SNAPSHOT_ZIP):
+        os.remove(CHROMA_SNAPSHOT_ZIP)
+    shutil.rmtree(INDEX_EXPORT_PATH, ignore_errors=True)
+    shutil.rmtree(INDEX_PREVIOUS_PATH, ignore_errors=True)
+
+@tracing.traced
 def lambda_handler(event, context):
+    lease = None
     try:
-        print(json.dumps(event))
-        print(context)
-        if 'Contents' in s3.list_objects_v2(Bucket=S3_BUCKET, Prefix=STARTING_FILE, MaxKeys=1):
-            message = 'Already running, skipping this invocation...'
+        keys = changed_keys(event)
+        # A scheduled drain only processes what is already queued, anything else is queued first
+        if keys is None and not event.get("drain") and not event.get("compact"):
+            keys = {FULL_SCAN}
+        if keys:
+            ingest_queue.enqueue(dynamo, TABLE_NAME, FUNCTION_NAME, keys)
+
+        lease = Lease(dynamo, TABLE_NAME, FUNCTION_NAME)
+        if not lease.acquire():
+            lease = None
+            message = 'Already running, the running invocation will pick up the queued files...'
             print(message)
             return {
                 'statusCode': 201,
                 'body': json.dumps({'message': message})
             }
 
-        s3.put_object(Bucket=S3_BUCKET, Key=STARTING_FILE, Body=b"")
-
         print("Initializing...")
 
-        current_chroma_path = CHROMA_PATH + "_" + str(int(time.time()))
-        download_s3_directory(S3_BUCKET, "session-notes/", DATA_FOLDER)
+        if event.get("compact"):
+            base = s3.head_object(Bucket=S3_BUCKET, Key="chromadb.zip")["ETag"]
+            if Checkpoint.load(s3, S3_BUCKET, COLLECTION_NAME, base) is not None:
+                # Its batches apply to the current chromadb.zip, the ingest has to finish first
+                lease.release()
+                lease = None
+                if context is not None:
+                    continue_later(lambda_client, context)
+                return {"statusCode": 200, "body": "An ingest is checkpointed, not compacting until it is published"}
+            report = compact_snapshot(lease)
+            lease.release()
+            lease = None
+            if context is not None and ingest_queue.has_pending(dynamo, TABLE_NAME, FUNCTION_NAME):
+                continue_later(lambda_client, context)
+            return {"statusCode": 200, "body": json.dumps(report)}
+
+        ingest_queue.close_debounce_window(dynamo, TABLE_NAME, FUNCTION_NAME)
+        queued = ingest_queue.read(dynamo, TABLE_NAME, FUNCTION_NAME)
+        base = s3.head_object(Bucket=S3_BUCKET, Key="chromadb.zip")["ETag"]
+        checkpoint = Checkpoint.load(s3, S3_BUCKET, COLLECTION_NAME, base)
+        if not queued and checkpoint is None:
+            return {"statusCode": 200, "body": "No session notes changed, nothing to ingest"}
+
+        current_chroma_path = CHROMA_PATH + "_" + str(time.time_ns())
         s3.download_file(S3_BUCKET, "chromadb.zip", CHROMA_ZIP)
-        unzip_file(CHROMA_ZIP, current_chroma_path)
+        with tracing.span("chroma.unzip"):
+            unzip_file(CHROMA_ZIP, current_chroma_path)
 
         # Initialize clients
-        try:
-            chroma_client = chromadb.PersistentClient(path=current_chroma_path)
-            embed_fn = embedding_functions.OpenAIEmbeddingFunction(
-                api_key=OPENAI_API_KEY,
-                model_name=EMBED_MODEL,
-            )
-
-            collection = chroma_client.get_or_create_collection(
-                name=COLLECTION_NAME,
-                embedding_function=embed_fn,
-            )
+        collection = open_collection(current_chroma_path)
+        manifest = Manifest.load(current_chroma_path, collection)
+        changes = Changes()
+        mirror = open_mirror()
+        deadline = Deadline(context, DEADLINE_RESERVE_MS)
+
+        added_chunks = 0
+        # Every invocation embeds at least one batch, so a resumed run always gets further
+        batches_run = 0
+        if checkpoint is None:
+            checkpoint = Checkpoint(s3, S3_BUCKET, COLLECTION_NAME, base)
+            if collection.count() == 0 and FULL_SCAN not in queued:
+                # A new collection, first run or a changed EMBED_DIMENSIONS, has to start from every file
+                checkpoint.extend(plan_all_files(mirror, manifest), {})
+        else:
+            # What earlier invocations already embedded
+            for records in checkpoint.saved_batches():
+                for record in records:
+                    added_chunks += store_file(collection, manifest, changes, record)
+        while True:
+            if not checkpoint.pending():
+                # Coalesce whatever arrived while we were embedding into the next plan
+                queued = {
+                    k: v
+                    for k, v in ingest_queue.read(dynamo, TABLE_NAME, FUNCTION_NAME).items()
+                    if checkpoint.processed.get(k) != v
+                }
+                if not queued:
+                    break
+                if FULL_SCAN in queued:
+                    work = plan_all_files(mirror, manifest)
+                else:
+                    work = plan_changed_files(mirror, manifest, set(queued))
+                checkpoint.extend(work, queued)
+                continue
 
-            # Load existing IDs to avoid re-uploading
-            existing_docs = {m["file_id"]: m for m in collection.get()["metadatas"]} if collection.count() > 0 else {}
-
-            # Process all markdown files
-            md_files = glob.glob(os.path.join(DATA_FOLDER, "**/*.md"), recursive=True)
-            print(md_files)
-            added_chunks = 0
-
-            file_ids = []
-            for file_path in md_files:
-                file_name = file_path.removeprefix(DATA_FOLDER)
-                file_id = file_name + file_hash(file_path)
-                file_ids.append(file_id)
-                if file_id in existing_docs:
-                    print(f"Skipping {file_name} (already embedded)")
-                    continue
-
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-
-                chunks = chunk_text(text)
-                ids = [f"{file_id}_{i}" for i in range(len(chunks))]
-                metadatas = [{"file_id": file_id, "source": file_name, "chunk": i} for i in range(len(chunks))]
-
-                if len(chunks) > 0:
-                    collection.upsert(
-                        documents=chunks,
-                        ids=ids,
-                        metadatas=metadatas
-                    )
-
-                print(f"✅ Added {len(chunks)} chunks from {file_name}")
-                added_chunks += len(chunks)
-
-            ids_to_delete = []
-            results = collection.get(include=["metadatas"])
-            for i, meta in enumerate(results["metadatas"]):
-                if not meta:
-                    continue
-                # print(meta['file_id'])
-                if meta['file_id'] not in file_ids:
-                    ids_to_delete.append(results["ids"][i])
-            # Step 4. Delete them
-            if ids_to_delete:
-                print(f"🗑️ Deleting {len(ids_to_delete)} entries (stale files removed from sessions/)")
-                collection.delete(ids=ids_to_delete)
-            else:
-                print("✅ No stale entries to delete.")
-
-            print(f"\n🎉 Done. {added_chunks} new chunks embedded and stored in '{COLLECTION_NAME}'.")
-            print(f"Total records in collection: {collection.count()}")
-
-            # Step 2 — ZIP updated Chroma snapshot
-            zip_directory(current_chroma_path, CHROMA_SNAPSHOT_ZIP)
-        except:
-            traceback.print_exc()
-
-        # Step 3 — Upload the ZIP back to S3
-        s3.upload_file(CHROMA_SNAPSHOT_ZIP, S3_BUCKET, "chromadb.zip")
-        print(f"Uploaded {CHROMA_SNAPSHOT_ZIP} → s3://daniel-townsend-dnd-notes-userspace/chromadb.zip")
-        s3.delete_object(Bucket=S3_BUCKET, Key=STARTING_FILE)
-
-        # Step 4 - Delete old chroma stuff
-        for root, dirs, files in os.walk(current_chroma_path, topdown=False):
-            for name in files:
-                os.remove(os.path.join(root, name))
-        if os.path.exists(CHROMA_ZIP):
-            os.remove(CHROMA_ZIP)
-        if os.path.exists(CHROMA_SNAPSHOT_ZIP):
-            os.remove(CHROMA_SNAPSHOT_ZIP)
+            if batches_run and deadline.near():
+                # Progress is saved up to the last batch, a fresh invocation replays it and goes on
+                lease.release()
+                lease = None
+                continue_later(lambda_client, context)
+                clean_up(current_chroma_path)
+                message = f"Checkpointed {checkpoint.done} of {len(checkpoint.work)} files, continuing in a new run"
+                print(message)
+                return {"statusCode": 202, "body": message}
+
+            batch = checkpoint.pending()[:CHECKPOINT_FILES]
+            records = [run_item(mirror, item) for item in batch]
+            for record in records:
+                added_chunks += store_file(collection, manifest, changes, record)
+            checkpoint.save_batch(records, len(batch))
+            batches_run += 1
+            if lease.lost:
+                raise RuntimeError("Lost the ingest lease, not publishing this snapshot")
+
+        if batches_run and deadline.near() and (changes or manifest.rebuilt):
+            # Not enough time left to zip, upload and export, a fresh invocation replays the batches and publishes
+            lease.release()
+            lease = None
+            continue_later(lambda_client, context)
+            clean_up(current_chroma_path)
+            return {"statusCode": 202, "body": "Embedded everything, publishing in a new invocation"}
+
+        print(f"\n🎉 Done. {added_chunks} new chunks embedded and stored in '{COLLECTION_NAME}'.")
+        print(f"Total records in collection: {collection.count()}")
+
+        publish_snapshot(collection, manifest, changes, current_chroma_path, lease)
+
+        # Only now is the work durable, so only now does it leave the queue
+        checkpoint.delete()
+        ingest_queue.ack(dynamo, TABLE_NAME, FUNCTION_NAME, checkpoint.processed)
+        lease.release()
+        lease = None
+
+        # A trigger that queued after our last read would otherwise wait for the next edit
+        if context is not None and ingest_queue.has_pending(dynamo, TABLE_NAME, FUNCTION_NAME):
+            continue_later(lambda_client, context)
+
+        clean_up(current_chroma_path)
 
         return {"statusCode": 200, "body": f"Updated the chromadb files and changed the environment variable in the dnd_rag_api, you should be good to go now"}
     except Exception:
         traceback.print_exc()
-        s3.delete_object(Bucket=S3_BUCKET, Key=STARTING_FILE)
 
-        return {"statusCode": 500, "body": f"Internal server error"}
\ No newline at end of file
+        return {"statusCode": 500, "body": f"Internal server error"}
+    finally:
+        if lease is not None:
+            lease.release()
+
+if __name__ == '__main__':
+    import sys
+    # python lambda_function.py session-notes/sessions/2025-11-25-notes.md ...
+    if len(sys.argv) > 1:
+        print(lambda_handler(fake_s3_event(S3_BUCKET, sys.argv[1:]), None))
+    else:
+        print(lambda_handler({}, None))
@@ -0,0 +1,208 @@
+"""
+Content addressed backups for sync-notes.py.
+
+Every backed up file is cut into content-defined chunks with a gear rolling
+hash, so an edit only changes the chunks around it and a transcript backed up
+ten times costs one copy plus its edits. Layout under the backup directory:
+
+    chunks/<sha256[:2]>/<sha256>   zlib compressed chunk bodies
+    index.json                     {"files": {<rel>: [<version>, ...]}}, oldest version first
+
+A version is {"id", "time", "sha256", "size", "chunks"}, where chunks lists the
+chunk hashes in file order.
+
+The rolling hash runs in Python at a few MB/s, so recordings and anything
+over FIXED_CHUNK_ABOVE are cut at fixed offsets instead. An unchanged copy
+still dedups, an edit in the middle does not, which audio never gets anyway.
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+MIN_CHUNK = 2 * 1024
+MAX_CHUNK = 64 * 1024
+# 13 bits gives an 8 KB average chunk. The top bits of the gear hash depend on the last 64 bytes.
+CUT_MASK = ((1 << 13) - 1) << 51
+HASH_MASK = (1 << 64) - 1
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+READ_SIZE = 1024 * 1024
+FIXED_CHUNK = 1024 * 1024
+FIXED_CHUNK_ABOVE = 8 * 1024 * 1024
+
+
+def chunk_file(f):
+    """
+    Yields the content-defined chunks of a binary file object. A boundary falls
+    wherever the rolling hash of the last 64 bytes matches the mask, so it moves
+    with the content instead of with the offset.
+    """
+    pending = b""
+    # Carried across reads like pending, only a cut resets it
+    h = 0
+    for block in iter(lambda: f.read(READ_SIZE), b""):
+        start = 0
+        size = len(pending)
+        for i, byte in enumerate(block):
+            h = ((h << 1) + GEAR[byte]) & HASH_MASK
+            size += 1
+            if (size >= MIN_CHUNK and not h & CUT_MASK) or size >= MAX_CHUNK:
+                yield pending + block[start : i + 1]
+                pending = b""
+                start = i + 1
+                size = 0
+                h = 0
+        pending += block[start:]
+    if pending:
+        yield pending
+
+
+def fixed_chunks(f):
+    yield from iter(lambda: f.read(FIXED_CHUNK), b"")
+
+
+class BackupStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.chunks = self.root / "chunks"
+        self.index_file = self.root / "index.json"
+        # Backups run from the sync thread pool
+        self.lock = threading.Lock()
+        self.index = None
+
+    def load(self):
+        if self.index is None:
+            if self.index_file.exists():
+                self.index = json.loads(self.index_file.read_text())
+            else:
+                self.index = {"files": {}}
+        return self.index
+
+    def save_index(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.index, indent=2))
+        os.replace(tmp, self.index_file)
+
+    def chunk_path(self, digest):
+        return self.chunks / digest[:2] / digest
+
+    def write_chunk(self, digest, data):
+        """
+        Returns the number of bytes written, 0 if the chunk is already stored.
+        """
+        path = self.chunk_path(digest)
+        if path.exists():
+            return 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        body = zlib.compress(data)
+        tmp = path.parent / f".{digest}.{uuid.uuid4().hex}"
+        tmp.write_bytes(body)
+        os.replace(tmp, path)
+        return len(body)
+
+    def backup(self, rel, path, fixed=False):
+        """
+        Stores a new version of ``path`` under ``rel``. Returns the version, or
+        None when the newest stored version already has the same content.
+        ``fixed`` cuts it into fixed size chunks, as any file over
+        FIXED_CHUNK_ABOVE is.
+        """
+        whole = hashlib.sha256()
+        digests = []
+        size = 0
+        written = 0
+        chunks = fixed_chunks if fixed or os.path.getsize(path) > FIXED_CHUNK_ABOVE else chunk_file
+        with open(path, "rb") as f:
+            for data in chunks(f):
+                whole.update(data)
+                size += len(data)
+                digest = hashlib.sha256(data).hexdigest()
+                written += self.write_chunk(digest, data)
+                digests.append(digest)
+
+        now = datetime.now()
+        version = {
+            "id": now.strftime("%Y%m%d-%H%M%S-%f"),
+            "time": now.isoformat(timespec="seconds"),
+            "sha256": whole.hexdigest(),
+            "size": size,
+            "chunks": digests,
+        }
+        with self.lock:
+            versions = self.load()["files"].setdefault(rel, [])
+            if versions and versions[-1]["sha256"] == version["sha256"]:
+                print(f"[backup] {rel} unchanged since {versions[-1]['id']}")
+                return None
+            versions.append(version)
+            self.save_index()
+        print(f"[backup] {rel} → {version['id']} ({len(digests)} chunks, {written / 1024:.1f} KB new)")
+        return version
+
+    def versions(self, rel=None):
+        files = self.load()["files"]
+        if rel is None:
+            return files
+        return {rel: files.get(rel, [])}
+
+    def find(self, rel, version_id=None):
+        versions = self.load()["files"].get(rel)
+        if not versions:
+            raise KeyError(f"No backups of {rel}")
+        if version_id is None:
+            return versions[-1]
+        for version in versions:
+            if version["id"] == version_id:
+                return version
+        raise KeyError(f"No backup {version_id} of {rel}")
+
+    def restore(self, rel, dest, version_id=None):
+        version = self.find(rel, version_id)
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.parent / f".{dest.name}.{uuid.uuid4().hex}"
+        whole = hashlib.sha256()
+        with open(tmp, "wb") as f:
+            for digest in version["chunks"]:
+                data = zlib.decompress(self.chunk_path(digest).read_bytes())
+                whole.update(data)
+                f.write(data)
+        if whole.hexdigest() != version["sha256"]:
+            tmp.unlink()
+            raise ValueError(f"Backup {version['id']} of {rel} is corrupt")
+        os.replace(tmp, dest)
+        return version
+
+    def gc(self, keep):
+        """
+        Keeps the newest ``keep`` versions of every file and deletes the chunks
+        no remaining version refers to. Returns (versions dropped, chunks deleted, bytes freed).
+        """
+        with self.lock:
+            files = self.load()["files"]
+            dropped = 0
+            for rel, versions in list(files.items()):
+                if len(versions) > keep:
+                    dropped += len(versions) - keep
+                    files[rel] = versions[len(versions) - keep :] if keep else []
+                if not files[rel]:
+                    del files[rel]
+            live = {digest for versions in files.values() for version in versions for digest in version["chunks"]}
+            self.save_index()
+
+            deleted = 0
+            freed = 0
+            if self.chunks.exists():
+                for folder in self.chunks.iterdir():
+                    for path in folder.iterdir():
+                        if path.name not in live:
+                            freed += path.stat().st_size
+                            path.unlink()
+                            deleted += 1
+                    if not any(folder.iterdir()):
+                        folder.rmdir()
+        return dropped, deleted, freed
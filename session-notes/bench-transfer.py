@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compares single-request put_object/get_object with the managed multipart
+transfers sync-notes.py uses, for one large file. Point it at a local S3
+stand-in so nothing real gets billed, e.g. MinIO:
+
+    docker run -p 9000:9000 minio/minio server /data
+    AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin \
+        python bench-transfer.py --endpoint-url http://localhost:9000 --size 200
+
+Reports wall time and the peak Python heap allocation (tracemalloc) of each.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+KEY = "bench/transfer.bin"
+
+
+def measure(name, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>14}: {elapsed:.2f}s, peak heap {peak / MB:.1f} MB")
+
+
+def main(endpoint_url, bucket, size_mb, part_size_mb, concurrency):
+    s3 = boto3.client("s3", endpoint_url=endpoint_url)
+    try:
+        s3.create_bucket(Bucket=bucket)
+    except (s3.exceptions.BucketAlreadyOwnedByYou, s3.exceptions.BucketAlreadyExists):
+        pass
+    config = TransferConfig(
+        multipart_threshold=part_size_mb * MB,
+        multipart_chunksize=part_size_mb * MB,
+        max_concurrency=concurrency,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.bin")
+        dest = os.path.join(tmp, "dest.bin")
+        with open(source, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(MB))
+        print(f"{size_mb} MB file, {part_size_mb} MB parts, {concurrency} parallel parts")
+
+        def put_object():
+            with open(source, "rb") as f:
+                s3.put_object(Bucket=bucket, Key=KEY, Body=f.read())
+
+        def get_object():
+            with open(dest, "wb") as f:
+                f.write(s3.get_object(Bucket=bucket, Key=KEY)["Body"].read())
+
+        measure("put_object", put_object)
+        measure("get_object", get_object)
+        measure("upload_file", lambda: s3.upload_file(source, bucket, KEY, Config=config))
+        measure("download_file", lambda: s3.download_file(bucket, KEY, dest, Config=config))
+        s3.delete_object(Bucket=bucket, Key=KEY)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoint-url", help="S3 compatible endpoint, leave out to hit real S3")
+    parser.add_argument("--bucket", default="sync-notes-bench")
+    parser.add_argument("--size", type=int, default=200, help="file size in MB")
+    parser.add_argument("--part-size", type=int, default=8, help="multipart part size in MB")
+    parser.add_argument("--concurrency", type=int, default=10, help="parallel parts per transfer")
+    args = parser.parse_args()
+    main(args.endpoint_url, args.bucket, args.size, args.part_size, args.concurrency)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Runs an ingest against this folder instead of in Lambda, for backfills too big
+for one invocation.
+
+    uv run --project ../lambda/dnd_rag_ingest ingest-local.py chroma
+    uv run --project ../lambda/dnd-rag-ingest-gemini ingest-local.py gemini
+
+Run it from the session-notes folder after sync-notes.py, so the folder
+matches the bucket. The lambda code is loaded from ../lambda, so the result is
+exactly what the lambda would produce: the chroma mode hashes and chunks the
+files in a process pool, embeds the chunks in batches, and uploads
+chromadb.zip with its manifest and a new vector index snapshot; the gemini
+mode hashes in a process pool and syncs the File Search store from the local
+files. Both hold the function's lease while they work, and read the same
+environment variables as the lambda (DYNAMODB_TABLE_NAME, OPENAI_API_KEY,
+FILE_SEARCH_STORE_NAME, ...).
+"""
+import argparse
+import hashlib
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+LOCAL_DIR = Path(".")
+LAMBDA_DIR = Path(__file__).resolve().parent.parent / "lambda"
+BUCKET = "daniel-townsend-dnd-notes-userspace"
+PREFIX = "session-notes/"
+PIPELINES = {"chroma": "dnd_rag_ingest", "gemini": "dnd-rag-ingest-gemini"}
+
+# The same files sync-notes.py syncs
+SYNC_SUFFIXES = (".md",)
+IGNORE_SUFFIXES = (".ignore.md",)
+IGNORE_PREFIXES = (".session-sync-backups/", ".session-sync-tmp/")
+
+# Set in each pool worker by load_worker
+lambda_module = None
+
+
+def load_lambda(pipeline):
+    """
+    Imports a lambda's lambda_function.py by path, with dnd_core and the lambda's
+    own packages importable the way they are in its deployment package.
+    """
+    directory = LAMBDA_DIR / PIPELINES[pipeline]
+    for path in (LAMBDA_DIR / "dnd_core", directory):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
+    name = f"{PIPELINES[pipeline].replace('-', '_')}_lambda"
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, directory / "lambda_function.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_worker(pipeline, bucket):
+    global lambda_module
+    os.environ.setdefault("S3_BUCKET", bucket)
+    lambda_module = load_lambda(pipeline)
+
+
+def list_files():
+    files = {}
+    for root, dirs, names in os.walk(LOCAL_DIR):
+        rel_root = Path(root).relative_to(LOCAL_DIR).as_posix()
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        dirs[:] = [d for d in dirs if not f"{rel_root}{d}/".startswith(IGNORE_PREFIXES)]
+        for name in names:
+            rel = rel_root + name
+            if name.endswith(SYNC_SUFFIXES) and not name.endswith(IGNORE_SUFFIXES):
+                files[rel] = str((LOCAL_DIR / rel).resolve())
+    return files
+
+
+def md5_file(path):
+    # The S3 ETag of a single part upload, which both ingests use as the content hash
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return lambda_module.chunk_text(f.read())
+
+
+def hash_files(pool, files):
+    paths = list(files.values())
+    return dict(zip(files, pool.map(md5_file, paths, chunksize=16)))
+
+
+def ingest_chroma(args, pool):
+    module = load_lambda("chroma")
+    files = list_files()
+    started = time.perf_counter()
+    hashes = hash_files(pool, files)
+    print(f"Hashed {len(files)} files in {time.perf_counter() - started:.1f}s")
+
+    lease = None
+    if not args.dryrun:
+        lease = module.Lease(module.dynamo, module.TABLE_NAME, module.FUNCTION_NAME)
+        if not lease.acquire():
+            sys.exit(f"{module.FUNCTION_NAME} is running, try again when it is done")
+    chroma_path = tempfile.mkdtemp(prefix="chroma_local_")
+    try:
+        module.s3.download_file(module.S3_BUCKET, "chromadb.zip", module.CHROMA_ZIP)
+        module.unzip_file(module.CHROMA_ZIP, chroma_path)
+        collection = module.open_collection(chroma_path)
+        manifest = module.Manifest.load(chroma_path, collection)
+        changes = module.Changes()
+
+        changed = sorted(name for name in files if manifest.file_id(name) != name + hashes[name])
+        removed = sorted(set(manifest.files) - set(files))
+        print(f"{len(changed)} files to embed, {len(removed)} to delete, {len(files) - len(changed)} unchanged")
+        if args.dryrun:
+            for name in changed:
+                print(f"  embed  {name}")
+            for name in removed:
+                print(f"  delete {name}")
+            return
+
+        started = time.perf_counter()
+        chunks = dict(zip(changed, pool.map(chunk_file, [files[name] for name in changed])))
+        total = sum(len(c) for c in chunks.values())
+        print(f"Chunked {len(changed)} files into {total} chunks in {time.perf_counter() - started:.1f}s")
+
+        # Every chunk of every changed file in one list, embedded a batch per request
+        flat = [chunk for name in changed for chunk in chunks[name]]
+        batches = [flat[i : i + args.batch_size] for i in range(0, len(flat), args.batch_size)]
+        embed_fn = module.get_embed_fn()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.embed_jobs) as executor:
+            embeddings = [embedding for batch in executor.map(embed_fn, batches) for embedding in batch]
+        print(f"Embedded {len(flat)} chunks in {len(batches)} requests in {time.perf_counter() - started:.1f}s")
+
+        position = 0
+        for name in changed:
+            count = len(chunks[name])
+            vectors = embeddings[position : position + count]
+            record = module.file_record(name, name + hashes[name], chunks[name], vectors)
+            position += count
+            module.store_file(collection, manifest, changes, record)
+        for name in removed:
+            module.store_file(collection, manifest, changes, {"file_name": name, "file_id": None})
+        print(f"Total records in collection: {collection.count()}")
+
+        module.publish_snapshot(collection, manifest, changes, chroma_path, lease)
+    finally:
+        if lease is not None:
+            lease.release()
+        module.clean_up(chroma_path)
+        shutil.rmtree(chroma_path, ignore_errors=True)
+
+
+def ingest_gemini(args, pool):
+    module = load_lambda("gemini")
+    files = list_files()
+    started = time.perf_counter()
+    hashes = hash_files(pool, files)
+    print(f"Hashed {len(files)} files in {time.perf_counter() - started:.1f}s")
+    local_map = {
+        name: {"key": PREFIX + name, "hash": hashes[name], "filename": os.path.basename(name), "path": files[name]}
+        for name in files
+    }
+
+    client = module.genai.Client()
+    remote_map = module.list_remote_documents(client, module.FILE_SEARCH_STORE_NAME)
+    if args.dryrun:
+        for name in sorted(local_map):
+            if remote_map.get(name, {}).get("hash") != local_map[name]["hash"]:
+                print(f"  upload {name}")
+        for name in sorted(set(remote_map) - set(local_map)):
+            print(f"  delete {name}")
+        return
+
+    dynamo = module.boto3.client("dynamodb")
+    lease = module.Lease(dynamo, module.TABLE_NAME, module.FUNCTION_NAME)
+    if not lease.acquire():
+        sys.exit(f"{module.FUNCTION_NAME} is running, try again when it is done")
+    try:
+        _, failed = module.synchronize_files(client, module.boto3.client("s3"), local_map, remote_map)
+    finally:
+        lease.release()
+    if failed:
+        for name in sorted(failed):
+            print(f"  failed {name}")
+        sys.exit(f"{len(failed)} files failed to sync, run again to retry them")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("pipeline", choices=sorted(PIPELINES))
+    parser.add_argument("--bucket", default=os.environ.get("S3_BUCKET", BUCKET))
+    parser.add_argument("--dryrun", action="store_true", help="only list what would be embedded or deleted")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="processes for hashing and chunking")
+    parser.add_argument("--batch-size", type=int, default=256, help="chunks per embedding request")
+    parser.add_argument("--embed-jobs", type=int, default=4, help="embedding requests in flight")
+    args = parser.parse_args()
+
+    # The lambda modules read their settings at import
+    os.environ.setdefault("S3_BUCKET", args.bucket)
+    pool = ProcessPoolExecutor(max_workers=args.jobs, initializer=load_worker, initargs=(args.pipeline, args.bucket))
+    with pool:
+        if args.pipeline == "chroma":
+            ingest_chroma(args, pool)
+        else:
+            ingest_gemini(args, pool)
+
+
+if __name__ == "__main__":
+    main()
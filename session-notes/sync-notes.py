@@ -1,27 +1,51 @@
 #!/usr/bin/env python3
 import boto3
+from boto3.s3.transfer import TransferConfig
 import os
+import sys
 import hashlib
 import json
 import time
 import argparse
 import difflib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+from backup_store import BackupStore
+
 LOCAL_DIR = Path(".")
 BUCKET = "daniel-townsend-dnd-notes-userspace"
 PREFIX = "session-notes/"
+# Recordings get their own prefix, everything that reads PREFIX (the notes API, both ingests) expects markdown
+AUDIO_PREFIX = "session-audio/"
 
 STATE_FILE = Path(".sync-state.json")
 BACKUP_DIR = Path(".session-sync-backups")
-IGNORE_SUFFIXES = [".ignore.md"]
+# Downloads land here first and are renamed into place, it is on the same filesystem as LOCAL_DIR
+DOWNLOAD_DIR = Path(".session-sync-tmp")
+SYNC_SUFFIXES = (".md",)
+AUDIO_SUFFIXES = (".mp3", ".m4a", ".wav")
+IGNORE_SUFFIXES = (".ignore.md",)
+# Relative to LOCAL_DIR, so a plain string prefix check replaces resolving every path
+IGNORE_PREFIXES = (BACKUP_DIR.as_posix() + "/", DOWNLOAD_DIR.as_posix() + "/")
+HASH_WORKERS = 8
+MB = 1024 * 1024
+
+# Replaced from the command line in main()
+transfer_config = TransferConfig(multipart_threshold=8 * MB, multipart_chunksize=8 * MB, max_concurrency=10)
+progress = None
+backups = BackupStore(BACKUP_DIR)
+
 
+def should_ignore(rel: str) -> bool:
+    return rel.endswith(IGNORE_SUFFIXES) or rel.startswith(IGNORE_PREFIXES)
 
-def should_ignore(path: Path) -> bool:
-    bad_suffix = any(str(path).endswith(sfx) for sfx in IGNORE_SUFFIXES)
-    bad_prefix = Path(path).resolve().is_relative_to(Path(BACKUP_DIR).resolve())
-    return bad_suffix or bad_prefix
+
+def s3_key(rel):
+    return (AUDIO_PREFIX if rel.endswith(AUDIO_SUFFIXES) else PREFIX) + rel
 
 
 def sha256_of_file(path):
@@ -32,8 +56,129 @@ def sha256_of_file(path):
     return h.hexdigest()
 
 
-def sha256_of_bytes(data):
-    return hashlib.sha256(data).hexdigest()
+class Progress:
+    """
+    Aggregate byte counter for the large transfers, redrawn on one line at most a
+    few times a second. Small notes finish too quickly to be worth a progress line.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+        self.last_draw = 0.0
+
+    def track(self, size):
+        # The boto3 transfer Callback for an object of this size
+        if size < self.threshold:
+            return None
+        with self.lock:
+            self.total += size
+        return self
+
+    def __call__(self, transferred):
+        with self.lock:
+            self.done += transferred
+            now = time.monotonic()
+            if now - self.last_draw < 0.2 and self.done < self.total:
+                return
+            self.last_draw = now
+            end = "\n" if self.done >= self.total else ""
+            sys.stdout.write(f"\r[transfer] {self.done / MB:.1f} / {self.total / MB:.1f} MB{end}")
+            sys.stdout.flush()
+
+    def finish(self):
+        # Leave the line of an interrupted transfer before the summary
+        if self.done < self.total:
+            sys.stdout.write("\n")
+
+
+def remote_state(remote, sha256):
+    # What we know about an S3 object after a sync, so the next run can trust its listing
+    return {"hash": sha256, "etag": remote["etag"], "size": remote["size"]}
+
+
+def fetch_remote(s3, remote):
+    """
+    Downloads the object to a temporary file on first use only, so objects the
+    listing already proves unchanged are never fetched. The body is streamed to
+    disk (in parallel parts for large objects) instead of held in memory.
+    """
+    if remote.get("tmp") is None:
+        DOWNLOAD_DIR.mkdir(exist_ok=True)
+        tmp = DOWNLOAD_DIR / f"{uuid.uuid4().hex}{Path(remote['key']).suffix}"
+        s3.download_file(
+            BUCKET, remote["key"], str(tmp), Config=transfer_config, Callback=progress.track(remote["size"])
+        )
+        remote["tmp"] = tmp
+        remote["hash"] = sha256_of_file(tmp)
+    return remote["tmp"]
+
+
+def remote_hash(s3, remote):
+    if remote["hash"] is None:
+        fetch_remote(s3, remote)
+    return remote["hash"]
+
+
+def upload(s3, rel, local):
+    size = local["path"].stat().st_size
+    s3.upload_file(str(local["path"]), BUCKET, s3_key(rel), Config=transfer_config, Callback=progress.track(size))
+    # upload_file doesn't hand back the ETag, and the next sync needs it to skip this object
+    etag = s3.head_object(Bucket=BUCKET, Key=s3_key(rel))["ETag"]
+    return {"hash": local["hash"], "etag": etag, "size": size}
+
+
+def cleanup_downloads():
+    if DOWNLOAD_DIR.exists():
+        for path in DOWNLOAD_DIR.iterdir():
+            path.unlink()
+        DOWNLOAD_DIR.rmdir()
+
+
+def scan_local(state, stats, suffixes=SYNC_SUFFIXES):
+    """
+    Finds the local markdown files and their hashes. A file whose mtime and size
+    match the state file reuses its stored hash, the rest are hashed in a pool.
+    """
+    cache = state.setdefault("local", {})
+    local_files = {}
+    to_hash = []
+    for root, dirs, files in os.walk(LOCAL_DIR):
+        rel_root = Path(root).relative_to(LOCAL_DIR).as_posix()
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        # Don't descend into ignored folders at all
+        dirs[:] = [d for d in dirs if not should_ignore(f"{rel_root}{d}/")]
+        for name in files:
+            rel = rel_root + name
+            if not name.endswith(suffixes) or should_ignore(rel):
+                continue
+            path = LOCAL_DIR / rel
+            st = path.stat()
+            stats["scanned"] += 1
+            local_files[rel] = {
+                "path": path,
+                "mtime": st.st_mtime,
+                "hash": None,
+            }
+            cached = cache.get(rel)
+            if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size:
+                local_files[rel]["hash"] = cached["sha256"]
+            else:
+                to_hash.append((rel, st))
+
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        hashes = executor.map(lambda item: sha256_of_file(local_files[item[0]]["path"]), to_hash)
+        for (rel, st), sha256 in zip(to_hash, hashes):
+            local_files[rel]["hash"] = sha256
+            cache[rel] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": sha256}
+    stats["hashed"] += len(to_hash)
+
+    for rel in list(cache):
+        if rel not in local_files:
+            del cache[rel]
+    return local_files
 
 
 def load_state():
@@ -58,159 +203,304 @@ def prompt(options, question):
         print("Invalid choice, try again.")
 
 
-def backup_file(path):
-    ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-    folder = BACKUP_DIR / ts
-    folder.mkdir(parents=True, exist_ok=True)
-    dest = folder / path.name
-    print(f"[backup] {path} → {dest}")
-    dest.write_bytes(path.read_bytes())
+def backup_file(rel, path):
+    # Recordings are too big for the rolling hash and never dedup across edits anyway
+    backups.backup(rel, path, fixed=rel.endswith(AUDIO_SUFFIXES))
+
+
+def list_backups(rel=None):
+    for name, versions in sorted(backups.versions(rel).items()):
+        print(name)
+        for version in reversed(versions):
+            print(f"  {version['id']}  {version['time']}  {version['size']} bytes")
+
+
+def restore_backup(rel, version_id=None):
+    dest = LOCAL_DIR / rel
+    if dest.exists():
+        backup_file(rel, dest)
+    version = backups.restore(rel, dest, version_id)
+    print(f"[restored] {rel} from {version['id']}, the next sync treats it as a local edit")
+
+
+def gc_backups(keep):
+    dropped, deleted, freed = backups.gc(keep)
+    print(f"[gc] dropped {dropped} old versions, deleted {deleted} chunks, freed {freed / 1024:.1f} KB")
+
+
+def show_diff(s3, rel, local, remote):
+    if rel.endswith(AUDIO_SUFFIXES):
+        print(f"Binary file {rel} differs")
+        return
+    local_text = local["path"].read_text().splitlines() if local else []
+    remote_text = fetch_remote(s3, remote).read_text().splitlines() if remote else []
+    diff = difflib.unified_diff(
+        local_text, remote_text,
+        fromfile="local/"+rel,
+        tofile="remote/"+rel,
+        lineterm=""
+    )
+    print("\n".join(diff))
+
+
+def resolve_conflict(s3, rel, local, remote, reason, on_conflict):
+    """
+    Picks the action for a file that changed on both sides (or changed on one side
+    and was deleted on the other), either from the policy or by asking.
+    """
+    print(f"[conflict] {rel} ({reason})")
+    policy_actions = {
+        "local": "upload" if local else "delete_remote",
+        "remote": "download" if remote else "delete_local",
+        "backup": "backup",
+        "skip": "skip",
+    }
+    if on_conflict != "prompt":
+        return policy_actions[on_conflict]
+
+    if local:
+        print(f"Local mtime:  {datetime.fromtimestamp(local['mtime'])}")
+    if remote:
+        print(f"Remote mtime: {datetime.fromtimestamp(remote['mtime'])}")
+    options = {
+        "dl": "download remote → overwrite local" if remote else "delete local (deleted on S3)",
+        "ul": "upload local → overwrite remote" if local else "delete remote (deleted locally)",
+        "b": "backup local and skip",
+        "df": "show diff",
+        "s": "skip",
+    }
+    if not local:
+        del options["b"]
+    while True:
+        choice = prompt(options, "Conflict detected: what do you want to do?")
+        if choice == "df":
+            show_diff(s3, rel, local, remote)
+            continue
+        return {"dl": policy_actions["remote"], "ul": policy_actions["local"], "b": "backup", "s": "skip"}[choice]
+
+
+def plan_sync(s3, local_files, s3_files, known, on_conflict, verbose, jobs):
+    """
+    Three-way comparison of each file against the hash it had at the last sync.
+    A side that still matches that base is unchanged, so a change on only one
+    side is copied over without asking, deletions included. Only a change on both
+    sides, or a deletion on one side and a change on the other, is a conflict.
+    """
+    summary = {
+        "unchanged": 0, "uploaded": 0, "downloaded": 0, "deleted_remote": 0, "deleted_local": 0,
+        "conflicts": 0, "skipped": 0, "backed_up": 0, "failed": 0,
+    }
+    all_files = sorted(set(local_files.keys()) | set(s3_files.keys()))
 
+    # Remote hashes the listing couldn't vouch for are needed before deciding, fetch them together
+    needs_hash = [
+        s3_files[rel]
+        for rel in all_files
+        if rel in s3_files and s3_files[rel]["hash"] is None and (rel in local_files or rel in known)
+    ]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(lambda remote: fetch_remote(s3, remote), needs_hash))
 
-def main(dryrun=False, verbose=False):
+    actions = []
+    for rel in all_files:
+        local = local_files.get(rel)
+        remote = s3_files.get(rel)
+        base = known.get(rel, {}).get("hash")
+
+        if local and remote:
+            remote_sha256 = remote_hash(s3, remote)
+            if local["hash"] == remote_sha256:
+                if verbose:
+                    print(f"[same] {rel}")
+                known[rel] = remote_state(remote, remote_sha256)
+                summary["unchanged"] += 1
+                continue
+            if base is not None and local["hash"] == base:
+                actions.append(("download", rel))
+                continue
+            if base is not None and remote_sha256 == base:
+                actions.append(("upload", rel))
+                continue
+            summary["conflicts"] += 1
+            action = resolve_conflict(s3, rel, local, remote, "changed on both sides", on_conflict)
+        elif remote:
+            if base is None:
+                actions.append(("download", rel))
+                continue
+            if remote_hash(s3, remote) == base:
+                actions.append(("delete_remote", rel))
+                continue
+            summary["conflicts"] += 1
+            action = resolve_conflict(s3, rel, None, remote, "deleted locally, changed on S3", on_conflict)
+        else:
+            if base is None:
+                actions.append(("upload", rel))
+                continue
+            if local["hash"] == base:
+                actions.append(("delete_local", rel))
+                continue
+            summary["conflicts"] += 1
+            action = resolve_conflict(s3, rel, local, None, "deleted on S3, changed locally", on_conflict)
+
+        if action == "skip":
+            print(f"[skip] {rel}")
+            summary["skipped"] += 1
+        else:
+            actions.append((action, rel))
+    return actions, summary
+
+
+def move_recordings(s3, keys, known, dryrun):
+    """
+    Moves recordings synced under PREFIX, from before they had their own
+    prefix, to AUDIO_PREFIX.
+    """
+    for key in keys:
+        rel = key[len(PREFIX):]
+        if dryrun:
+            print(f"[dryrun] would move {key} to {s3_key(rel)}")
+            continue
+        s3.copy({"Bucket": BUCKET, "Key": key}, BUCKET, s3_key(rel), Config=transfer_config)
+        s3.delete_object(Bucket=BUCKET, Key=key)
+        if rel in known:
+            # Same content, but a copy made in parts gets a different ETag
+            known[rel]["etag"] = s3.head_object(Bucket=BUCKET, Key=s3_key(rel))["ETag"]
+        print(f"[moved] {key} → {s3_key(rel)}")
+
+
+def run_action(s3, action, rel, local, remote, known):
+    if action == "upload":
+        known[rel] = upload(s3, rel, local)
+        print(f"[uploaded] {rel}")
+        return "uploaded"
+    if action == "download":
+        dest = LOCAL_DIR / rel
+        if local:
+            backup_file(rel, local["path"])
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(fetch_remote(s3, remote), dest)
+        known[rel] = remote_state(remote, remote_hash(s3, remote))
+        print(f"[downloaded] {rel}")
+        return "downloaded"
+    if action == "delete_remote":
+        s3.delete_object(Bucket=BUCKET, Key=s3_key(rel))
+        known.pop(rel, None)
+        print(f"[deleted remote] {rel}")
+        return "deleted_remote"
+    if action == "delete_local":
+        backup_file(rel, local["path"])
+        local["path"].unlink()
+        known.pop(rel, None)
+        print(f"[deleted local] {rel}")
+        return "deleted_local"
+    if action == "backup":
+        backup_file(rel, local["path"])
+        print(f"[skipped after backup] {rel}")
+        return "backed_up"
+    raise ValueError(f"Unknown action {action}")
+
+
+def run_actions(s3, actions, local_files, s3_files, known, summary, jobs):
+    def run(item):
+        action, rel = item
+        try:
+            return run_action(s3, action, rel, local_files.get(rel), s3_files.get(rel), known)
+        except Exception as e:
+            print(f"[failed] {action} {rel}: {e}")
+            return "failed"
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for outcome in executor.map(run, actions):
+            summary[outcome] += 1
+
+
+def main(
+    dryrun=False,
+    verbose=False,
+    show_stats=False,
+    on_conflict="prompt",
+    jobs=8,
+    part_size_mb=8,
+    concurrency=10,
+    audio=False,
+):
+    global transfer_config, progress
+    started = time.perf_counter()
+    stats = {"scanned": 0, "hashed": 0}
     s3 = boto3.client("s3")
+    # Objects above one part are split into parts that move in parallel, per file on top of --jobs
+    transfer_config = TransferConfig(
+        multipart_threshold=part_size_mb * MB,
+        multipart_chunksize=part_size_mb * MB,
+        max_concurrency=concurrency,
+    )
+    progress = Progress(part_size_mb * MB)
+    listings = [(PREFIX, SYNC_SUFFIXES)]
+    if audio:
+        listings.append((AUDIO_PREFIX, AUDIO_SUFFIXES))
+    suffixes = tuple(suffix for _, listed in listings for suffix in listed)
 
     print("Loading state...")
     state = load_state()
     known = state["files"]
 
     print("Scanning local directory...")
-    local_files = {}
-    for path in LOCAL_DIR.rglob("*.md"):
-        if should_ignore(path):
-            continue
-        rel = str(path.relative_to(LOCAL_DIR))
-        local_files[rel] = {
-            "path": path,
-            "mtime": path.stat().st_mtime,
-            "hash": sha256_of_file(path),
-        }
+    local_files = scan_local(state, stats, suffixes)
+    scan_seconds = time.perf_counter() - started
 
     print("Scanning S3...")
     s3_files = {}
     paginator = s3.get_paginator("list_objects_v2")
-    for page in paginator.paginate(Bucket=BUCKET, Prefix=PREFIX):
-        for obj in page.get("Contents", []):
-            key = obj["Key"]
-            if not key.endswith(".md"):
-                continue
-            rel = key[len(PREFIX):]
-            data = s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
-            s3_files[rel] = {
-                "key": key,
-                "mtime": obj["LastModified"].timestamp(),
-                "data": data,
-                "hash": sha256_of_bytes(data),
-            }
-
-    all_files = sorted(set(local_files.keys()) | set(s3_files.keys()))
-
-    for rel in all_files:
-        local = local_files.get(rel)
-        remote = s3_files.get(rel)
-        known_hash = known.get(rel, {}).get("hash")
-
-        # CASE 1: File only on S3
-        if local is None:
-            print(f"[remote-only] {rel}")
-            choice = prompt(
-                {"d": "download", "s": "skip"},
-                f"File '{rel}' exists on S3 but not locally."
-            )
-            if choice == "d":
-                dest = LOCAL_DIR / rel
-                dest.parent.mkdir(parents=True, exist_ok=True)
-                if not dryrun:
-                    dest.write_bytes(remote["data"])
-                print(f"[downloaded] {rel}")
-                known[rel] = {"hash": remote["hash"]}
-            continue
-
-        # CASE 2: File only locally
-        if remote is None:
-            print(f"[local-only] {rel}")
-            choice = prompt(
-                {"u": "upload", "s": "skip"},
-                f"File '{rel}' exists locally but not on S3."
-            )
-            if choice == "u":
-                if not dryrun:
-                    s3.put_object(
-                        Bucket=BUCKET,
-                        Key=PREFIX + rel,
-                        Body=local["path"].read_bytes(),
-                    )
-                print(f"[uploaded] {rel}")
-                known[rel] = {"hash": local["hash"]}
-            continue
-
-        # CASE 3: Exists on both sides → check for conflict
-        local_hash = local["hash"]
-        remote_hash = remote["hash"]
-
-        if local_hash == remote_hash:
-            if verbose:
-                print(f"[same] {rel}")
-            known[rel] = {"hash": local_hash}
-            continue
-
-        # Conflict
-        print(f"[conflict] {rel}")
-        print(f"Local mtime:  {datetime.fromtimestamp(local['mtime'])}")
-        print(f"Remote mtime: {datetime.fromtimestamp(remote['mtime'])}")
-
-        choice = prompt(
-            {
-                "dl": "download remote → overwrite local",
-                "ul": "upload local → overwrite remote",
-                "b": "backup both",
-                "df": "show diff",
-                "s": "skip"
-            },
-            "Conflict detected: what do you want to do?"
-        )
-
-        if choice == "df":
-            local_text = local["path"].read_text().splitlines()
-            remote_text = remote["data"].decode("utf-8").splitlines()
-            diff = difflib.unified_diff(
-                local_text, remote_text,
-                fromfile="local/"+rel,
-                tofile="remote/"+rel,
-                lineterm=""
-            )
-            print("\n".join(diff))
-            continue  # re-prompt next run
-
-        if choice == "b":
-            backup_file(local["path"])
-            print("[skipped after backup]")
-            continue
-
-        if choice == "dl":
-            if not dryrun:
-                backup_file(local["path"])
-                local["path"].write_bytes(remote["data"])
-            print(f"[downloaded] {rel}")
-            known[rel] = {"hash": remote_hash}
-            continue
-
-        if choice == "ul":
-            if not dryrun:
-                backup_file(local["path"])
-                s3.put_object(
-                    Bucket=BUCKET,
-                    Key=PREFIX + rel,
-                    Body=local["path"].read_bytes(),
-                )
-            print(f"[uploaded] {rel}")
-            known[rel] = {"hash": local_hash}
-            continue
-
-        print(f"[skip] {rel}")
+    for prefix, listed_suffixes in listings:
+        misplaced = []
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                if prefix == PREFIX and key.endswith(AUDIO_SUFFIXES):
+                    misplaced.append(key)
+                if not key.endswith(listed_suffixes):
+                    continue
+                rel = key[len(prefix):]
+                remote = {
+                    "key": key,
+                    "mtime": obj["LastModified"].timestamp(),
+                    "etag": obj["ETag"],
+                    "size": obj["Size"],
+                    "tmp": None,
+                    "hash": None,
+                }
+                # Same ETag and size as the last sync means the content hash we stored still holds
+                last = known.get(rel, {})
+                if last.get("etag") == remote["etag"] and last.get("size") == remote["size"]:
+                    remote["hash"] = last.get("hash")
+                s3_files[rel] = remote
+        # Before the AUDIO_PREFIX listing, so the moved recordings are listed where they are now
+        move_recordings(s3, misplaced, known, dryrun)
+
+    actions, summary = plan_sync(s3, local_files, s3_files, known, on_conflict, verbose, jobs)
+
+    try:
+        if dryrun:
+            for action, rel in actions:
+                print(f"[dryrun] would {action.replace('_', ' ')} {rel}")
+        else:
+            run_actions(s3, actions, local_files, s3_files, known, summary, jobs)
+    finally:
+        progress.finish()
+        cleanup_downloads()
+
+    print(
+        "[summary] "
+        + ", ".join(f"{name}: {count}" for name, count in summary.items() if count or name in ("unchanged", "failed"))
+    )
 
     print("Saving state...")
     save_state(state)
+    if show_stats:
+        print(
+            f"[stats] files scanned: {stats['scanned']}, files hashed: {stats['hashed']}, "
+            f"local scan: {scan_seconds:.2f}s, total: {time.perf_counter() - started:.2f}s"
+        )
     print("Done.")
 
 
@@ -218,5 +508,43 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--dryrun", action="store_true")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--stats", action="store_true", help="report files scanned, files hashed and time taken")
+    parser.add_argument(
+        "--on-conflict",
+        choices=["prompt", "local", "remote", "backup", "skip"],
+        default="prompt",
+        help="how to resolve files changed on both sides, local/remote pick the side that wins",
+    )
+    parser.add_argument("--batch", action="store_true", help="never prompt, conflicts follow --on-conflict or are skipped")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="concurrent uploads/downloads")
+    parser.add_argument("--part-size", type=int, default=8, help="multipart part size in MB")
+    parser.add_argument("--concurrency", type=int, default=10, help="parallel parts per transfer")
+    parser.add_argument("--audio", action="store_true", help=f"also sync {', '.join(AUDIO_SUFFIXES)} recordings")
+    parser.add_argument("--backups", nargs="?", const="", metavar="FILE", help="list backed up versions and exit")
+    parser.add_argument("--restore", metavar="FILE", help="restore a backed up file and exit")
+    parser.add_argument("--version", help="backup version id for --restore, defaults to the newest")
+    parser.add_argument("--gc", action="store_true", help="drop old backup versions and unused chunks and exit")
+    parser.add_argument("--keep", type=int, default=10, help="backup versions per file kept by --gc")
     args = parser.parse_args()
-    main(dryrun=args.dryrun, verbose=args.verbose)
\ No newline at end of file
+    if args.backups is not None:
+        list_backups(args.backups or None)
+        sys.exit()
+    if args.restore:
+        restore_backup(args.restore, args.version)
+        sys.exit()
+    if args.gc:
+        gc_backups(args.keep)
+        sys.exit()
+    on_conflict = args.on_conflict
+    if args.batch and on_conflict == "prompt":
+        on_conflict = "skip"
+    main(
+        dryrun=args.dryrun,
+        verbose=args.verbose,
+        show_stats=args.stats,
+        on_conflict=on_conflict,
+        jobs=args.jobs,
+        part_size_mb=args.part_size,
+        concurrency=args.concurrency,
+        audio=args.audio,
+    )
\ No newline at end of file